@@ -0,0 +1,410 @@
+#!/usr/bin/env python
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+#
+# Benchmark for the split pipeline.  Generates synthetic sources at a few
+# sizes and formats, splits each one for every monitor definition and
+# reports how long each stage took as JSON:
+#
+#    open    Image.open, i.e. reading the header
+#    layout  calculate_scale and the padding, worked out from scratch
+#    decode  draft and load
+#    crop    cutting every tile out of the source
+#    resample   resizing every tile, where a Pillow upgrade that slows
+#            LANCZOS down shows up
+#    save    encoding the tiles to memory, in the source format unless
+#            --output-format says otherwise
+#
+# crop and resample add up the trace spans of every tile, so with
+# --tile-threads they can come to more than the time the tiles took;
+# total_ms and MP/s go by the wall clock.
+#
+# With --resample-engine numpy the tiles are resampled a second time by
+# Pillow, off the books, and each case reports how much resample time NumPy
+# saved (or lost) against it.  Where it comes out ahead depends on the BLAS
+# NumPy is built with and how many cores it can spread the matrix products
+# over: on one core Pillow's C is hard to beat, with a multithreaded BLAS
+# the big shrinks of large sources go to NumPy first.
+#
+# Each case runs in a fresh process so its peak RSS is its own.  Save the
+# output and hand it back with --baseline to fail when throughput drops,
+# e.g. after a Pillow upgrade.  Both runs need the same options and
+# encoder, a baseline taken with others is turned down:
+#
+#    python src/split_benchmark.py -o baseline.json
+#    python src/split_benchmark.py --baseline baseline.json
+###############################################################################
+import argparse
+import copy
+import io
+import json
+import multiprocessing
+import os
+import os.path
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+import wallpaper_splitter
+from wallpaper_splitter import DEFAULT_MONITOR_DIR, Image, load_layouts
+
+STAGES = ['open', 'layout', 'decode', 'crop', 'resample', 'save']
+
+# What of a report has to match the baseline for the two to be compared
+SETTINGS = ['options', 'output_format', 'encoder_profile', 'encoder']
+
+def make_source(width, height):
+   """A synthetic width x height RGB image.  Gradients with some noise on
+      top so it neither compresses to nothing nor is pure noise."""
+   noise = Image.effect_noise((width, height), 48)
+   horizontal = Image.linear_gradient('L').rotate(90).resize((width, height))
+   radial = Image.radial_gradient('L').resize((width, height))
+   return Image.merge('RGB', (horizontal, noise, radial))
+
+def write_sources(directory, sizes, formats):
+   """Encode a synthetic source for every size and format into directory.
+      Returns a list of (size, format, file name)."""
+   sources = []
+   for width, height in sizes:
+      img = make_source(width, height)
+      for fmt in formats:
+         filename = os.path.join(directory, "source_{0}x{1}.{2}".format(
+            width, height, fmt.lower()))
+         img.save(filename, format=fmt)
+         sources.append(((width, height), fmt, filename))
+   return sources
+
+def peak_rss_mb():
+   """Peak resident set size of this process in MB"""
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   if sys.platform == 'darwin':
+      # Bytes there, KB everywhere else
+      peak /= 1024
+   return peak / 1024.0
+
+def time_split(monitors, opts, filename, plan, encoder):
+   """Split filename once for monitors, timing each stage.  plan is the
+      LayoutPlan kept between runs, the way a batch would.  encoder is the
+      (format, encoder settings) to save with, format None meaning that of
+      the source.  Returns a dict of stage name to seconds, the number of
+      tiles and how many bytes they came to.  Besides STAGES it holds
+      tiles, the wall clock time of cutting the tiles, and total, that of
+      the whole split.  With --resample-engine numpy pillow_resample is
+      how long Pillow took to resample the same tiles."""
+   timings = {}
+   start = time.perf_counter()
+   img = Image.open(filename)
+   fmt = encoder[0] or img.format
+   timings['open'] = time.perf_counter() - start
+
+   # Always from scratch, what the first image of a size costs
+   start = time.perf_counter()
+   plan.compile(*img.size)
+   timings['layout'] = time.perf_counter() - start
+
+   start = time.perf_counter()
+   source = wallpaper_splitter.prepare_source(img, monitors, opts, plan)
+   timings['decode'] = time.perf_counter() - start
+
+   # crop and resample (and decode, for strips) come from the spans
+   # make_tiles traces
+   events = []
+   wallpaper_splitter.Trace_hooks.append(events.append)
+   start = time.perf_counter()
+   try:
+      tiles = [tile for _, tile in
+               wallpaper_splitter.make_tiles(monitors, opts, source)]
+   finally:
+      wallpaper_splitter.Trace_hooks.remove(events.append)
+   timings['tiles'] = time.perf_counter() - start
+   timings['crop'] = timings['resample'] = 0.0
+   tiles_decode = 0.0
+   for event in events:
+      if event.stage == 'decode':
+         tiles_decode += event.end - event.start
+      elif event.stage in timings:
+         timings[event.stage] += event.end - event.start
+
+   def encode(idx, tile):
+      buf = io.BytesIO()
+      wallpaper_splitter.encode_tile(tile, buf, fmt, encoder[1])
+      return buf.tell()
+
+   start = time.perf_counter()
+   size = sum(tile_bytes for _, tile_bytes in
+              wallpaper_splitter.map_tiles(encode, tiles, opts.tile_threads))
+   timings['save'] = time.perf_counter() - start
+
+   if opts.resample_engine == 'numpy' and not opts.crop_only:
+      pillow_opts = copy.copy(opts)
+      pillow_opts.resample_engine = 'tile'
+      events = []
+      wallpaper_splitter.Trace_hooks.append(events.append)
+      try:
+         for _ in wallpaper_splitter.make_tiles(monitors, pillow_opts,
+                                                source):
+            pass
+      finally:
+         wallpaper_splitter.Trace_hooks.remove(events.append)
+      timings['pillow_resample'] = sum(event.end - event.start
+                                       for event in events
+                                       if event.stage == 'resample')
+
+   img.close()
+   timings['total'] = sum(timings[stage] for stage in
+                          ['open', 'layout', 'decode', 'tiles', 'save'])
+   timings['decode'] += tiles_decode
+   return timings, len(tiles), size
+
+def run_case(case):
+   """Benchmark one (layout, source) case.  Runs in its own process."""
+   name, monitors, options, encoder, size, fmt, filename, repeat = case
+   opts = wallpaper_splitter.split_options(**options)
+   plan = wallpaper_splitter.LayoutPlan(monitors, opts)
+   runs = []
+   for _ in range(repeat):
+      timings, tile_count, tile_bytes = time_split(monitors, opts, filename,
+                                                   plan, encoder)
+      runs.append(timings)
+
+   stages = dict((stage, statistics.median(run[stage] for run in runs))
+                 for stage in STAGES + ['tiles'])
+   total = statistics.median(run['total'] for run in runs)
+   megapixels = size[0] * size[1] / 1e6
+   result = {"layout": name,
+             "size": "{0}x{1}".format(*size),
+             "format": fmt,
+             "tiles": tile_count,
+             "tile_bytes": tile_bytes,
+             "megapixels": round(megapixels, 3),
+             "stages_ms": dict((stage, round(stages[stage] * 1000.0, 3))
+                               for stage in STAGES),
+             "total_ms": round(total * 1000.0, 3),
+             "mp_per_s": round(megapixels / total, 3),
+             "peak_rss_mb": round(peak_rss_mb(), 1)}
+   if 'pillow_resample' in runs[0]:
+      pillow = statistics.median(run['pillow_resample'] for run in runs)
+      result['numpy_vs_pillow'] = {
+         "pillow_ms": round(pillow * 1000.0, 3),
+         "numpy_ms": round(stages['resample'] * 1000.0, 3),
+         "saved_ms": round((pillow - stages['resample']) * 1000.0, 3)}
+   return result
+
+def changed_settings(report, baseline):
+   """Which of SETTINGS report and baseline were run with differently.
+      Throughput measured with another engine or encoder says nothing
+      about a regression."""
+   # As they would read back from the report file
+   report = json.loads(json.dumps(dict((name, report[name])
+                                       for name in SETTINGS)))
+   return [name for name in SETTINGS if report[name] != baseline.get(name)]
+
+def case_key(result):
+   return (result['layout'], result['size'], result['format'])
+
+def compare(results, baseline, threshold):
+   """Compare throughput against a previous run.  Prints a line per case
+      and returns the cases that got slower by more than threshold (a
+      fraction)."""
+   previous = dict((case_key(result), result)
+                   for result in baseline['results'])
+   regressions = []
+   for result in results:
+      old = previous.get(case_key(result))
+      if old is None:
+         print("  new ", *case_key(result), file=sys.stderr)
+         continue
+      change = result['mp_per_s'] / old['mp_per_s'] - 1.0
+      slower = change < -threshold
+      print("  {0} {1} {2} {3}: {4:.1f} -> {5:.1f} MP/s ({6:+.1%})".format(
+               "SLOW" if slower else "ok  ", *case_key(result),
+               old['mp_per_s'], result['mp_per_s'], change),
+            end='', file=sys.stderr)
+      # Reports from before crop and resample were split up only have
+      # tiles
+      if 'resample' in old['stages_ms']:
+         print(", resample {0:.1f} -> {1:.1f} ms".format(
+                  old['stages_ms']['resample'],
+                  result['stages_ms']['resample']), end='', file=sys.stderr)
+      print(file=sys.stderr)
+      if slower:
+         regressions.append(result)
+   return regressions
+
+def parse_size(value):
+   try:
+      width, height = value.lower().split('x')
+      return int(width), int(height)
+   except ValueError:
+      raise argparse.ArgumentTypeError("sizes look like 3840x2160")
+
+def parse_cmdline():
+   """Do command line parsing stuff"""
+   parser = argparse.ArgumentParser(description='Wallpaper-Splitter '
+                                                'Benchmark')
+   parser.add_argument("--sizes", nargs='+', type=parse_size,
+                       default=[(1920, 1080), (3840, 2160), (7680, 4320)],
+                       metavar='WxH',
+                       help="Source sizes to generate (default 1920x1080 "
+                            "3840x2160 7680x4320)")
+   parser.add_argument("--formats", nargs='+', default=['JPEG', 'PNG'],
+                       metavar='FORMAT',
+                       help="Source formats to generate (default JPEG PNG)")
+   parser.add_argument("--monitor-dir", default=DEFAULT_MONITOR_DIR,
+                       metavar='<dir>',
+                       help="Monitor definitions to benchmark (default "
+                            "resources/monitor_defs)")
+   parser.add_argument("--layouts", nargs='+', metavar='NAME',
+                       help="Only these monitor definitions")
+   parser.add_argument("--repeat", type=int, default=3, metavar='N',
+                       help="Runs per case, the median is reported "
+                            "(default 3)")
+   parser.add_argument("--crop-only", action='store_true',
+                       help="Benchmark --crop-only splitting")
+   parser.add_argument("--auto-position", action='store_true',
+                       help="Benchmark --auto-position placement (counted "
+                            "in the decode stage)")
+   parser.add_argument("--tile-threads", type=int, default=0, metavar='N',
+                       help="Cut, resize and encode the tiles of each "
+                            "source on up to N threads")
+   parser.add_argument("--no-draft", dest='draft', action='store_false',
+                       help="Benchmark without draft decoding")
+   parser.add_argument("--no-mmap", dest='mmap', action='store_false',
+                       help="Benchmark decoding uncompressed sources whole "
+                            "instead of mapping them")
+   parser.add_argument("--resample-engine",
+                       choices=wallpaper_splitter.RESAMPLE_ENGINES,
+                       default='tile',
+                       help="Resampling engine to use.  numpy also times "
+                            "Pillow resampling the same tiles and reports "
+                            "the difference, to show where it pays off on "
+                            "this machine")
+   parser.add_argument("--strip-height", type=int, default=0, metavar='ROWS',
+                       help="Benchmark strip decoding")
+   parser.add_argument("--output-format",
+                       type=wallpaper_splitter.parse_output_format,
+                       metavar='FORMAT',
+                       help="Save the tiles as FORMAT instead of the "
+                            "source format")
+   parser.add_argument("--encoder-profile", default='default',
+                       metavar='NAME|<file.json>',
+                       help="Encoder settings to save the tiles with "
+                            "(default, fastest, smallest or a JSON file)")
+   parser.add_argument("--output", "-o", metavar='<file>',
+                       help="Write the JSON report here instead of stdout")
+   parser.add_argument("--baseline", metavar='<file>',
+                       help="Compare against a previous report and fail if "
+                            "any case got slower than --threshold")
+   parser.add_argument("--threshold", type=float, default=10.0,
+                       metavar='PERCENT',
+                       help="Throughput drop that counts as a regression "
+                            "(default 10)")
+   args = parser.parse_args()
+
+   if args.repeat < 1:
+      parser.error("--repeat must be at least 1")
+   if args.strip_height > 0:
+      wallpaper_splitter.lift_pixel_limit()
+   try:
+      args.encoder_settings = wallpaper_splitter.encoder_settings(
+         args.encoder_profile)
+   except (OSError, ValueError) as e:
+      parser.error("Unable to load encoder profile: " + str(e))
+   return args
+
+def main():
+   """Command line entry point"""
+   opts = parse_cmdline()
+   layouts = load_layouts([opts.monitor_dir])
+   if opts.layouts:
+      missing = set(opts.layouts) - set(layouts)
+      if missing:
+         sys.exit("Unknown layout(s): " + ", ".join(sorted(missing)))
+      layouts = dict((name, layouts[name]) for name in opts.layouts)
+   options = {"auto_position": opts.auto_position,
+              "crop_only": opts.crop_only,
+              "draft": opts.draft,
+              "mmap": opts.mmap,
+              "resample_engine": opts.resample_engine,
+              "strip_height": opts.strip_height,
+              "tile_threads": opts.tile_threads}
+   encoder = (opts.output_format, opts.encoder_settings)
+   settings = {"options": options,
+               "output_format": opts.output_format,
+               "encoder_profile": opts.encoder_profile,
+               "encoder": opts.encoder_settings}
+
+   # Before spending minutes on a run that can't be compared
+   baseline = None
+   if opts.baseline is not None:
+      with open(opts.baseline, 'r') as f:
+         baseline = json.load(f)
+      changed = changed_settings(settings, baseline)
+      if changed:
+         sys.exit(opts.baseline + " was run with different " +
+                  ", ".join(changed) + "; take a new baseline with these "
+                  "options or rerun with the baseline's")
+
+   with tempfile.TemporaryDirectory(prefix='wallpaper-bench-') as directory:
+      sources = write_sources(directory, opts.sizes, opts.formats)
+      cases = [(name, layouts[name], options, encoder, size, fmt, filename,
+                opts.repeat)
+               for name in sorted(layouts)
+               for size, fmt, filename in sources]
+      results = []
+      with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+         for result in pool.imap(run_case, cases):
+            print(" ".join(case_key(result)), "{0:.1f} MP/s".format(
+                  result['mp_per_s']), end='', file=sys.stderr)
+            if 'numpy_vs_pillow' in result:
+               print(", NumPy saved {0:.1f} ms of resampling against "
+                     "Pillow".format(result['numpy_vs_pillow']['saved_ms']),
+                     end='', file=sys.stderr)
+            print(file=sys.stderr)
+            results.append(result)
+
+   report = {"python": platform.python_version(),
+             "pillow": Image.__version__,
+             "platform": platform.platform(),
+             "repeat": opts.repeat,
+             "results": results}
+   report.update(settings)
+   if opts.output is not None:
+      with open(opts.output, 'w') as f:
+         json.dump(report, f, indent=1)
+   else:
+      json.dump(report, sys.stdout, indent=1)
+      print()
+
+   if baseline is not None:
+      print("Against", opts.baseline,
+            "(Pillow " + str(baseline.get('pillow')) + "):", file=sys.stderr)
+      regressions = compare(results, baseline, opts.threshold / 100.0)
+      if regressions:
+         print(len(regressions), "case(s) regressed by more than",
+               str(opts.threshold) + "%", file=sys.stderr)
+         sys.exit(1)
+
+if __name__ == '__main__':
+   main()
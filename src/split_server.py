@@ -0,0 +1,638 @@
+#!/usr/bin/env python
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+#
+# Long running split server.  Keeps the monitor definitions, Pillow and a
+# pool of worker processes around so a split request only pays for the
+# split itself.  Speaks a small subset of HTTP/1.1 over localhost TCP or a
+# Unix socket:
+#
+#    GET  /layouts              The monitor definitions that are loaded
+#    GET  /metrics              Request counts and latencies
+#    POST /split?layout=<name>  Body is the encoded source image
+#    POST /preview?layout=<name>
+#                               A PNG of how the image falls across the
+#                               monitors, see wallpaper_splitter.preview()
+#
+# /split takes the tile options of wallpaper_splitter.split() as query
+# parameters (left=1, top_padding=40, crop_only=1, ...) along with
+# format=<PIL format> for the tiles (default: same as the source) and
+# encoder_profile=fastest|smallest to encode them with.  Tiles are streamed
+# back as multipart/mixed, one part per monitor, unless dest=<path prefix>
+# is given in which case they are written to <prefix><suffix>.<ext> and the
+# file names come back as JSON.  dest is relative to --dest-root and must
+# stay inside it; without --dest-root it is turned down.
+#
+# /preview takes the same parameters plus width=<pixels> (default 640).  If
+# dest is given the tiles are split in the background once the preview has
+# been sent.
+###############################################################################
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import io
+import json
+import logging
+import multiprocessing
+import os
+import os.path
+import sys
+import time
+import urllib.parse
+
+import wallpaper_splitter
+from wallpaper_splitter import DEFAULT_MONITOR_DIR, Image, load_layouts
+
+# Query parameters /split understands and how to read them
+BOOL_OPTIONS = ['left', 'right', 'top', 'bottom', 'auto_position', 'crop_only',
+                'draft']
+INT_OPTIONS = ['left_padding', 'right_padding', 'top_padding',
+               'bottom_padding', 'strip_height', 'tile_threads']
+STR_OPTIONS = ['resample_engine']
+
+# Widest /preview a client may ask for
+MAX_PREVIEW_WIDTH = 4096
+
+# How many LayoutPlans each worker keeps, one per layout and set of options
+MAX_PLANS = 16
+
+# Longest request line or header line, and most header lines, a request
+# may have before it is turned down with a 431
+MAX_LINE = 8192
+MAX_HEADERS = 100
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+                405: "Method Not Allowed", 411: "Length Required",
+                413: "Payload Too Large",
+                431: "Request Header Fields Too Large",
+                500: "Internal Server Error", 503: "Service Unavailable"}
+
+# Worker process state, set up by init_worker
+Layouts = {}
+Plans = collections.OrderedDict()
+
+def init_worker(layouts, log_level):
+   """Process pool initializer.  Hand every worker the layouts once instead
+      of with every job."""
+   global Layouts
+   Layouts = layouts
+   wallpaper_splitter.set_log_level(log_level)
+
+def layout_plan(layout, options):
+   """The LayoutPlan this worker keeps for layout split with options.
+      Only the MAX_PLANS most recently used are kept, so clients trying
+      every top_padding there is don't grow the worker without bound."""
+   key = (layout, tuple(sorted(options.items())))
+   plan = Plans.get(key)
+   if plan is not None:
+      Plans.move_to_end(key)
+      return plan
+   plan = wallpaper_splitter.LayoutPlan(
+      Layouts[layout], wallpaper_splitter.split_options(**options))
+   Plans[key] = plan
+   while len(Plans) > MAX_PLANS:
+      Plans.popitem(last=False)
+   return plan
+
+def split_job(layout, options, body, fmt=None, dest=None, profile=None):
+   """Split the encoded image body for layout, encoding the tiles with the
+      encoder profile named profile.  Runs in a worker process.
+
+      Returns (format, tiles, seconds) where tiles is a list of
+      (suffix, data) with data the encoded tile, or the file it was
+      written to if dest was given."""
+   start = time.perf_counter()
+   plan = layout_plan(layout, options)
+   img = Image.open(io.BytesIO(body))
+   fmt = fmt or img.format
+   if dest is None:
+      tiles = [(monitor['suffix'], data) for monitor, data in
+               wallpaper_splitter.split(img, plan, format=fmt,
+                                        encoder_profile=profile)]
+      return fmt, tiles, time.perf_counter() - start
+
+   # Same as the command line: never leave half a tile behind
+   settings = wallpaper_splitter.encoder_settings(profile or 'default')
+   tiles = []
+   for monitor, tile in wallpaper_splitter.split(img, plan):
+      filename = dest + monitor['suffix'] + \
+                 wallpaper_splitter.extension_for(fmt)
+      wallpaper_splitter.save_tile(tile, filename, settings)
+      tiles.append((monitor['suffix'], filename))
+   return fmt, tiles, time.perf_counter() - start
+
+def preview_job(layout, options, body, width):
+   """Draw the preview of the encoded image body for layout, width pixels
+      across.  Runs in a worker process.  Returns (PNG data, seconds)."""
+   start = time.perf_counter()
+   img = wallpaper_splitter.preview(body, layout_plan(layout, options),
+                                    width)
+   buf = io.BytesIO()
+   img.save(buf, 'PNG', compress_level=1)
+   return buf.getvalue(), time.perf_counter() - start
+
+def parse_split_query(query):
+   """Pull the layout, split options, format, dest and encoder profile out
+      of the /split query string.  Raises ValueError if something is
+      off."""
+   params = dict((k, v[-1]) for k, v in
+                 urllib.parse.parse_qs(query, keep_blank_values=True).items())
+   if 'layout' not in params:
+      raise ValueError("layout is required")
+   options = {}
+   for name in BOOL_OPTIONS:
+      if name in params:
+         options[name] = params[name].lower() in ('', '1', 'true', 'yes')
+   for name in INT_OPTIONS:
+      if name in params:
+         options[name] = int(params[name])
+   for name in STR_OPTIONS:
+      if name in params:
+         options[name] = params[name]
+   # Turn down what the command line would, rather than quietly split
+   # with the defaults in the worker
+   wallpaper_splitter.split_options(**options)
+   known = set(BOOL_OPTIONS + INT_OPTIONS + STR_OPTIONS +
+               ['layout', 'format', 'dest', 'encoder_profile'])
+   unknown = set(params) - known
+   if unknown:
+      raise ValueError("Unknown parameter(s): " + ", ".join(sorted(unknown)))
+   # Only the built in profiles, encoder_settings would read any file
+   # named here
+   profile = params.get('encoder_profile') or None
+   if profile is not None and \
+      profile not in wallpaper_splitter.ENCODER_PROFILES:
+      raise ValueError("Unknown encoder_profile: " + profile)
+   # Same names, extensions and MIME types as --output-format
+   fmt = params.get('format') or None
+   if fmt is not None:
+      try:
+         fmt = wallpaper_splitter.parse_output_format(fmt)
+      except argparse.ArgumentTypeError as e:
+         raise ValueError(str(e))
+   return (params['layout'], options, fmt, params.get('dest') or None,
+           profile)
+
+def resolve_dest(dest, root):
+   """Turn the dest path prefix of a request into one under root, the
+      --dest-root directory.  The tiles are written with the server's
+      permissions, so anything outside root, or no root at all, raises
+      ValueError, as does a directory that isn't there."""
+   if root is None:
+      raise ValueError("dest needs the server started with --dest-root")
+   directory, prefix = os.path.split(dest)
+   directory = os.path.realpath(os.path.join(root, directory))
+   if os.path.commonpath([root, directory]) != root:
+      raise ValueError("dest must be inside the --dest-root")
+   if not os.path.isdir(directory):
+      raise ValueError("No such directory for dest: " + dest)
+   return os.path.join(directory, prefix)
+
+def parse_preview_query(query):
+   """parse_split_query for /preview, which also takes a width.  Returns
+      the width followed by what parse_split_query does."""
+   params = urllib.parse.parse_qs(query, keep_blank_values=True)
+   width = int(params.pop('width', [wallpaper_splitter.PREVIEW_WIDTH])[-1])
+   if not 0 < width <= MAX_PREVIEW_WIDTH:
+      raise ValueError("width must be between 1 and " +
+                       str(MAX_PREVIEW_WIDTH))
+   return (width,) + parse_split_query(
+      urllib.parse.urlencode(params, doseq=True))
+
+def percentile(values, fraction):
+   """The fraction (0-1) percentile of a sorted list"""
+   if not values:
+      return 0.0
+   return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class SplitServer(object):
+   """Accepts split requests and runs them on a pool of worker processes.
+
+      At most max_concurrent splits run at once.  Up to max_queue more may
+      be uploading their image or waiting for a slot; anything past that
+      is turned away with a 503 before its body is read, so a flood of
+      requests can't pile up unbounded memory."""
+
+   def __init__(self, layouts, opts):
+      self.layouts = layouts
+      self.opts = opts
+      # Workers are started as the first jobs come in.  Forked there and
+      # then they would hold on to whatever connections were open, so a
+      # client told the connection closes would never see it close.
+      context = None
+      if 'forkserver' in multiprocessing.get_all_start_methods():
+         context = multiprocessing.get_context('forkserver')
+      self.pool = concurrent.futures.ProcessPoolExecutor(
+         max_workers=opts.workers, initializer=init_worker,
+         initargs=(layouts, wallpaper_splitter.Logger.level),
+         mp_context=context)
+      self.slots = asyncio.Semaphore(opts.max_concurrent)
+      self.waiting = 0
+      self.running = 0
+      # Requests whose image is still being read
+      self.reading = 0
+      self.counts = collections.Counter()
+      # Splits started by /preview that are still going
+      self.behind = set()
+      # Recent (total, queued, split) latencies in seconds
+      self.latencies = collections.deque(maxlen=1024)
+
+   def metrics(self):
+      """Counters and latency percentiles as a dict"""
+      ret = {"requests": dict(self.counts),
+             "running": self.running,
+             "waiting": self.waiting,
+             "reading": self.reading}
+      for idx, name in enumerate(['total', 'queued', 'split']):
+         values = sorted(entry[idx] * 1000.0 for entry in self.latencies)
+         ret[name + "_ms"] = {"p50": percentile(values, 0.5),
+                              "p90": percentile(values, 0.9),
+                              "p99": percentile(values, 0.99),
+                              "max": values[-1] if values else 0.0}
+      return ret
+
+   async def handle_connection(self, reader, writer):
+      """Serve requests on one connection until the client is done"""
+      try:
+         while True:
+            keep_alive = await self.handle_request(reader, writer)
+            if not keep_alive:
+               break
+      except (ConnectionError, asyncio.IncompleteReadError):
+         pass
+      finally:
+         writer.close()
+
+   async def handle_request(self, reader, writer):
+      """Read and answer one request.  Returns whether the connection
+         should be kept open for another."""
+      try:
+         request_line = await reader.readline()
+      except ValueError:
+         # Longer than MAX_LINE.  What is left of it is still in the way.
+         self.counts['bad'] += 1
+         await self.respond(writer, 431, {"error": "Request line too long"})
+         return False
+      if not request_line:
+         return False
+      try:
+         method, target, version = request_line.decode('latin-1').split()
+      except ValueError:
+         await self.respond(writer, 400, {"error": "Bad request line"})
+         return False
+
+      headers = {}
+      count = 0
+      while True:
+         try:
+            line = await reader.readline()
+         except ValueError:
+            self.counts['bad'] += 1
+            await self.respond(writer, 431, {"error": "Header too long"})
+            return False
+         if line in (b'\r\n', b'\n', b''):
+            break
+         count += 1
+         if count > MAX_HEADERS:
+            self.counts['bad'] += 1
+            await self.respond(writer, 431, {"error": "Too many headers"})
+            return False
+         name, _, value = line.decode('latin-1').partition(':')
+         headers[name.strip().lower()] = value.strip()
+      keep_alive = version == 'HTTP/1.1' and \
+                   headers.get('connection', '').lower() != 'close'
+
+      url = urllib.parse.urlsplit(target)
+      if url.path == '/layouts' and method == 'GET':
+         await self.respond(writer, 200, self.layouts)
+      elif url.path == '/metrics' and method == 'GET':
+         await self.respond(writer, 200, self.metrics())
+      elif url.path in ('/split', '/preview'):
+         if method != 'POST':
+            await self.respond(writer, 405, {"error": "POST an image"})
+         elif 'content-length' not in headers:
+            await self.respond(writer, 411, {"error": "Content-Length "
+                                                      "is required"})
+            return False
+         else:
+            body = await self.read_body(writer, reader,
+                                        headers['content-length'])
+            if body is None:
+               # Whatever of it was sent is still in the way
+               return False
+            if url.path == '/split':
+               await self.split(writer, url.query, body)
+            else:
+               await self.preview(writer, url.query, body)
+      else:
+         await self.respond(writer, 404, {"error": "No such thing"})
+      return keep_alive
+
+   def too_busy(self):
+      return self.waiting + self.reading >= self.opts.max_queue
+
+   async def read_body(self, writer, reader, content_length):
+      """Read a request body of content_length bytes.  If the length is no
+         good, or there is no room in the queue for another request, the
+         reply is sent without reading it and None is returned."""
+      try:
+         length = int(content_length)
+      except ValueError:
+         length = -1
+      if length < 0:
+         self.counts['bad'] += 1
+         await self.respond(writer, 400, {"error": "Bad Content-Length"})
+         return None
+      if length > self.opts.max_body:
+         await self.respond(writer, 413, {"error": "Image too big"})
+         return None
+      if self.too_busy():
+         self.counts['rejected'] += 1
+         await self.respond(writer, 503, {"error": "Too busy"},
+                            [("Retry-After", "1")])
+         return None
+      self.reading += 1
+      try:
+         return await reader.readexactly(length)
+      finally:
+         self.reading -= 1
+
+   async def split(self, writer, query, body):
+      """Answer a /split request"""
+      start = time.perf_counter()
+      try:
+         layout, options, fmt, dest, profile = parse_split_query(query)
+         if layout not in self.layouts:
+            raise ValueError("Unknown layout " + layout)
+         if dest is not None:
+            dest = resolve_dest(dest, self.opts.dest_root)
+      except ValueError as e:
+         self.counts['bad'] += 1
+         await self.respond(writer, 400, {"error": str(e)})
+         return
+
+      if self.waiting >= self.opts.max_queue:
+         self.counts['rejected'] += 1
+         await self.respond(writer, 503, {"error": "Too busy"},
+                            [("Retry-After", "1")])
+         return
+
+      try:
+         (fmt, tiles, split_time), queued = await self.run_job(
+            start, split_job, layout, options, body, fmt, dest, profile)
+      except Image.UnidentifiedImageError:
+         self.counts['bad'] += 1
+         await self.respond(writer, 400, {"error": "Body is not an image"})
+         return
+      except Exception as e:
+         self.counts['failed'] += 1
+         await self.respond(writer, 500, {"error": repr(e)})
+         return
+
+      if dest is not None:
+         await self.respond(writer, 200, {"format": fmt, "tiles": tiles})
+      else:
+         await self.stream_tiles(writer, fmt, tiles)
+      total = time.perf_counter() - start
+      self.counts['ok'] += 1
+      self.latencies.append((total, queued, split_time))
+      if not self.opts.quiet:
+         print("split", layout, len(body), "bytes ->", len(tiles), "tiles",
+               "in {0:.1f} ms (queued {1:.1f} ms, split {2:.1f} ms)".format(
+                  total * 1000.0, queued * 1000.0, split_time * 1000.0))
+
+   async def run_job(self, start, job, *args):
+      """Run job(*args) on the pool once a slot is free.  Returns what it
+         returned and how long it waited since start."""
+      self.waiting += 1
+      try:
+         await self.slots.acquire()
+      finally:
+         self.waiting -= 1
+      queued = time.perf_counter() - start
+      self.running += 1
+      try:
+         loop = asyncio.get_running_loop()
+         return await loop.run_in_executor(self.pool, job, *args), queued
+      finally:
+         self.running -= 1
+         self.slots.release()
+
+   async def preview(self, writer, query, body):
+      """Answer a /preview request"""
+      start = time.perf_counter()
+      try:
+         width, layout, options, fmt, dest, profile = \
+            parse_preview_query(query)
+         if layout not in self.layouts:
+            raise ValueError("Unknown layout " + layout)
+         if dest is not None:
+            dest = resolve_dest(dest, self.opts.dest_root)
+      except ValueError as e:
+         self.counts['bad'] += 1
+         await self.respond(writer, 400, {"error": str(e)})
+         return
+
+      if self.waiting >= self.opts.max_queue:
+         self.counts['rejected'] += 1
+         await self.respond(writer, 503, {"error": "Too busy"},
+                            [("Retry-After", "1")])
+         return
+
+      try:
+         (data, preview_time), queued = await self.run_job(
+            start, preview_job, layout, options, body, width)
+      except Image.UnidentifiedImageError:
+         self.counts['bad'] += 1
+         await self.respond(writer, 400, {"error": "Body is not an image"})
+         return
+      except Exception as e:
+         self.counts['failed'] += 1
+         await self.respond(writer, 500, {"error": repr(e)})
+         return
+      self.write_head(writer, 200, [("Content-Type", "image/png"),
+                                    ("Content-Length", str(len(data)))])
+      writer.write(data)
+      await writer.drain()
+      self.counts['preview'] += 1
+      if not self.opts.quiet:
+         print("preview", layout, len(body), "bytes in {0:.1f} ms (queued "
+               "{1:.1f} ms, preview {2:.1f} ms)".format(
+                  (time.perf_counter() - start) * 1000.0, queued * 1000.0,
+                  preview_time * 1000.0))
+
+      if dest is not None:
+         task = asyncio.ensure_future(self.split_behind(
+            layout, options, body, fmt, dest, profile))
+         self.behind.add(task)
+         task.add_done_callback(self.behind.discard)
+
+   async def split_behind(self, layout, options, body, fmt, dest, profile):
+      """Split the tiles of a /preview with dest once the client has its
+         preview.  Nobody is waiting on the answer so problems are only
+         logged."""
+      start = time.perf_counter()
+      if self.waiting >= self.opts.max_queue:
+         self.counts['rejected'] += 1
+         print("WARNING: Too busy to split", dest, "after its preview",
+               file=sys.stderr)
+         return
+      try:
+         (fmt, tiles, split_time), queued = await self.run_job(
+            start, split_job, layout, options, body, fmt, dest, profile)
+      except Exception as e:
+         self.counts['failed'] += 1
+         print("WARNING: Unable to split", dest, "after its preview:",
+               repr(e), file=sys.stderr)
+         return
+      self.counts['ok'] += 1
+      self.latencies.append((time.perf_counter() - start, queued,
+                             split_time))
+      if not self.opts.quiet:
+         print("split", layout, "->", len(tiles), "tiles in", dest,
+               "after its preview")
+
+   async def stream_tiles(self, writer, fmt, tiles):
+      """Send tiles back as a chunked multipart/mixed response, waiting for
+         the client to keep up between parts."""
+      boundary = "wallpaper-splitter-tile"
+      content_type = Image.MIME.get(fmt, "application/octet-stream")
+      self.write_head(writer, 200,
+                      [("Content-Type",
+                        "multipart/mixed; boundary=" + boundary),
+                       ("Transfer-Encoding", "chunked")])
+      for suffix, data in tiles:
+         head = ("--" + boundary + "\r\n" +
+                 "Content-Type: " + content_type + "\r\n" +
+                 "Content-Length: " + str(len(data)) + "\r\n" +
+                 "X-Monitor-Suffix: " + suffix + "\r\n\r\n").encode('latin-1')
+         self.write_chunk(writer, head + data + b"\r\n")
+         await writer.drain()
+      self.write_chunk(writer, ("--" + boundary + "--\r\n").encode('latin-1'))
+      self.write_chunk(writer, b"")
+      await writer.drain()
+
+   def write_head(self, writer, status, headers):
+      lines = ["HTTP/1.1 " + str(status) + " " + HTTP_REASONS[status]]
+      lines += [name + ": " + value for name, value in headers]
+      writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+
+   def write_chunk(self, writer, data):
+      writer.write(("%x\r\n" % len(data)).encode('latin-1') + data + b"\r\n")
+
+   async def respond(self, writer, status, obj, headers=()):
+      """Send obj back as a JSON response"""
+      body = json.dumps(obj).encode('utf-8')
+      self.write_head(writer, status,
+                      [("Content-Type", "application/json"),
+                       ("Content-Length", str(len(body)))] + list(headers))
+      writer.write(body)
+      await writer.drain()
+
+def parse_cmdline():
+   """Do command line parsing stuff"""
+   parser = argparse.ArgumentParser(description='Wallpaper-Splitter Server')
+   parser.add_argument("--http", metavar='[HOST:]PORT',
+                       help="Listen for HTTP on HOST:PORT (HOST defaults to "
+                            "127.0.0.1)")
+   parser.add_argument("--socket", metavar='<path>',
+                       help="Listen for HTTP on a Unix socket at <path>")
+   parser.add_argument("--monitor-dir", action='append', metavar='<dir>',
+                       help="Load monitor definitions from <dir> (may be "
+                            "given more than once, default "
+                            "resources/monitor_defs)")
+   parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                       metavar='N',
+                       help="Number of worker processes (default: one per "
+                            "CPU)")
+   parser.add_argument("--max-concurrent", type=int, default=None,
+                       metavar='N',
+                       help="Splits to run at once (default: --workers)")
+   parser.add_argument("--max-queue", type=int, default=64, metavar='N',
+                       help="Requests that may be uploading or waiting for "
+                            "a free slot before new ones get a 503 "
+                            "(default 64)")
+   parser.add_argument("--max-body", type=int, default=256, metavar='MB',
+                       help="Largest image accepted (default 256)")
+   parser.add_argument("--dest-root", metavar='<dir>',
+                       help="Let clients write tiles with dest=, to paths "
+                            "inside <dir> only (default: dest is turned "
+                            "down)")
+   parser.add_argument('--quiet', '-q', action='store_true',
+                       help="Don't log every request")
+   parser.add_argument("--verbose", '-v', action='store_true',
+                       help='Verbose Output')
+   args = parser.parse_args()
+
+   if args.http is None and args.socket is None:
+      args.http = "8080"
+   if args.workers < 1:
+      parser.error("--workers must be at least 1")
+   if args.max_concurrent is None:
+      args.max_concurrent = args.workers
+   if args.max_concurrent < 1:
+      parser.error("--max-concurrent must be at least 1")
+   args.max_body *= 1024 * 1024
+   if args.dest_root is not None:
+      args.dest_root = os.path.realpath(os.path.expanduser(args.dest_root))
+      if not os.path.isdir(args.dest_root):
+         parser.error("--dest-root must be a directory")
+   if args.monitor_dir is None:
+      args.monitor_dir = [DEFAULT_MONITOR_DIR]
+   if args.verbose:
+      wallpaper_splitter.set_log_level(logging.DEBUG)
+   return args
+
+async def serve(opts, layouts):
+   """Start listening and serve forever"""
+   server = SplitServer(layouts, opts)
+   listeners = []
+   if opts.http is not None:
+      host, _, port = opts.http.rpartition(':')
+      listeners.append(await asyncio.start_server(
+         server.handle_connection, host or '127.0.0.1', int(port),
+         limit=MAX_LINE))
+      print("Listening on http://" + (host or '127.0.0.1') + ":" + port)
+   if opts.socket is not None:
+      listeners.append(await asyncio.start_unix_server(
+         server.handle_connection, os.path.expanduser(opts.socket),
+         limit=MAX_LINE))
+      print("Listening on", opts.socket)
+   try:
+      await asyncio.gather(*(l.serve_forever() for l in listeners))
+   finally:
+      server.pool.shutdown(wait=False, cancel_futures=True)
+
+def main():
+   """Command line entry point"""
+   opts = parse_cmdline()
+   layouts = load_layouts(opts.monitor_dir)
+   if not layouts:
+      sys.exit("No monitor definitions found")
+   print("Loaded layouts:", ", ".join(sorted(layouts)))
+   try:
+      asyncio.run(serve(opts, layouts))
+   except KeyboardInterrupt:
+      pass
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,4534 @@
+#!/usr/bin/env python
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+import argparse
+import collections
+import concurrent.futures
+import copy
+import cProfile
+import ctypes
+import functools
+import glob
+import hashlib
+import io
+import itertools
+import json
+import logging
+import math
+import mmap
+import operator
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tarfile
+import threading
+import time
+import traceback
+import warnings
+import zipfile
+import zlib
+
+try:
+   from PIL import Image, ImageChops, ImageDraw, ImageFilter, ImageSequence
+   from PIL import GifImagePlugin, TiffImagePlugin
+except:
+   sys.exit("Please install Pillow (https://pillow.readthedocs.org/)")
+
+try:
+   import numpy
+except ImportError:
+   # Only needed for --resample-engine numpy
+   numpy = None
+
+Logger = logging.getLogger('wallpaper_splitter')
+Terminal_width = None # Looked up once by get_terminal_width
+Worker_plan = None # LayoutPlan for the images a --jobs worker splits
+Trace_hooks = [] # Called with a TraceEvent as each stage of a split finishes
+Worker_events = [] # TraceEvents a --jobs worker hands back with its result
+Tile_sink = None # TileSink the tiles go to instead of files (--sink)
+Bomb_pixels = None # Image.MAX_IMAGE_PIXELS before lift_pixel_limit()
+MONITOR_SCALE = 2 # 8x16 for a ``normal'' cursor so use a vertical scale factor
+                  # of 2.  Only applies to Y coordinates.
+
+# Bump this whenever a change makes the same inputs give different tiles so
+# old cache entries stop matching.
+CACHE_VERSION = 1
+
+# Command line options that change what the tiles look like.  These go into
+# the cache key along with the source and the monitor definitions.
+CACHE_OPTIONS = ['left', 'right', 'left_padding', 'right_padding',
+                 'top', 'bottom', 'top_padding', 'bottom_padding',
+                 'auto_position', 'crop_only', 'draft', 'resample_engine',
+                 'strip_height', 'output_format', 'encoder_settings',
+                 'frames']
+
+# What split() uses for any tile option it is not given.  These match the
+# command line defaults.
+SPLIT_DEFAULTS = {"left": False, "right": False,
+                  "left_padding": None, "right_padding": None,
+                  "top": False, "bottom": False,
+                  "top_padding": None, "bottom_padding": None,
+                  "auto_position": False, "crop_only": False,
+                  "draft": True, "mmap": True,
+                  "resample_engine": 'tile', "strip_height": 0,
+                  "tile_threads": 0}
+
+# What --resample-engine can be
+RESAMPLE_ENGINES = ['tile', 'numpy']
+
+# inotify(7) bits used by --watch
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+
+# How far either side of a pixel each resampling filter reaches, in source
+# pixels before scaling.  Matches Pillow's filters.
+FILTER_SUPPORT = {Image.Resampling.NEAREST: 0.5,
+                  Image.Resampling.BILINEAR: 1.0,
+                  Image.Resampling.BICUBIC: 2.0,
+                  Image.Resampling.LANCZOS: 3.0}
+
+# --auto-position looks for detail in a copy of the source about this many
+# pixels on its longest side
+ENERGY_SIZE = 160
+
+# How much worse it is for --auto-position to put detail behind a bezel
+# than off the edge, relative to what showing it on a monitor is worth
+BEZEL_PENALTY = 0.5
+
+# --auto-position only moves off centre for a spot that shows this much
+# more, so a flat image stays where it always was
+AUTO_POSITION_MARGIN = 0.02
+
+# Monitor keys giving its physical size.  Set at the top of a monitor
+# definition they apply to every monitor that doesn't set its own.
+PHYSICAL_KEYS = ('dpi', 'size_mm', 'bezel_mm')
+
+MM_PER_INCH = 25.4
+
+# The monitor definitions that come with wallpaper-splitter
+DEFAULT_MONITOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   os.pardir, 'resources', 'monitor_defs')
+
+# --preview writes <image>_preview.png this wide
+PREVIEW_SUFFIX = '_preview'
+PREVIEW_WIDTH = 640
+PREVIEW_BACKGROUND = (32, 32, 32)
+PREVIEW_OUTLINE = (255, 192, 0)
+PREVIEW_MARGIN = 8
+
+# Output pixels per weight matrix for --resample-engine numpy.  Each block
+# only reads the source pixels its outputs reach, so the matrix products
+# stay small no matter how big the source is.
+NUMPY_BLOCK = 32
+
+# Modes --resample-engine numpy handles, anything else goes to Pillow
+NUMPY_MODES = ('L', 'RGB')
+
+# Pillow resamples 8 bit images in fixed point, the filter weights scaled
+# by 2 ** RESAMPLE_PRECISION.  --resample-engine numpy does the same so its
+# tiles come out the same.
+RESAMPLE_PRECISION = 22
+
+# It sums in float32 though.  Weights that are whole multiples of
+# 2 ** -EXACT_PRECISION keep every product and sum of 8 bit pixels within
+# float32's 24 bits, so those sums come out exact anyway.
+EXACT_PRECISION = 15
+
+# Image.save keyword arguments per output format for each --encoder-profile.
+# default leaves everything to Pillow.  fastest gives up some size for
+# encode time: no extra Huffman pass, zlib level 1 and the quickest WebP and
+# AVIF efforts.  smallest goes the other way.
+ENCODER_PROFILES = {
+   "default": {},
+   "fastest": {"JPEG": {"quality": 75, "optimize": False,
+                        "progressive": False, "subsampling": "4:2:0"},
+               "PNG": {"compress_level": 1},
+               "WEBP": {"quality": 80, "method": 0},
+               "AVIF": {"quality": 70, "speed": 10}},
+   "smallest": {"JPEG": {"quality": 75, "optimize": True,
+                         "progressive": True, "subsampling": "4:2:0"},
+                "PNG": {"compress_level": 9},
+                "WEBP": {"quality": 75, "method": 6},
+                "AVIF": {"quality": 60, "speed": 2},
+                "TIFF": {"compression": "tiff_adobe_deflate"}}}
+
+# What a profile may set for a format, so a typo is an error rather than
+# something Pillow quietly ignores.
+ENCODER_SETTINGS = ('quality', 'compress_level', 'optimize', 'progressive',
+                    'subsampling', 'method', 'speed', 'lossless',
+                    'compression')
+
+# Modes some output formats can not hold everything in.  Tiles in any other
+# mode are converted to RGB before they are written.
+OUTPUT_MODES = {"JPEG": ('1', 'L', 'RGB', 'CMYK'),
+                "PPM": ('1', 'L', 'I', 'RGB')}
+
+# Pillow knows several extensions for some formats.  Use the usual one.
+PREFERRED_EXTENSIONS = {"JPEG": ['.jpg'], "TIFF": ['.tif']}
+
+# Modes the strip decoder and MappedImage handle.  Palette and bilevel
+# images do not get resampled the same way so they always go through the
+# in-memory path.
+STRIP_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'I', 'F', 'I;16')
+
+# A headerless raw capture, e.g. capture.rgb, is described by a JSON file
+# next to it named capture.rgb.json.  See open_raw.
+RAW_SIDECAR = '.json'
+
+# What tiles of a raw capture are written as unless --output-format says
+# otherwise.  Uncompressed so a crop only run stays I/O bound.
+RAW_OUTPUT_FORMAT = 'TIFF'
+
+# Formats --frames can write an animation (or multi-page file) in
+ANIMATION_FORMATS = ('GIF', 'PNG', 'WEBP', 'TIFF', 'AVIF')
+
+# Sources whose frames decode on their own rather than on top of the one
+# before, so split_frames can cut several at once
+INDEPENDENT_FRAME_FORMATS = ('TIFF',)
+
+# How much of an archive --sink keeps in memory before writing it out
+SINK_BUFFER = 16 * 1024 * 1024
+
+# --dedupe-index hashes each source down to DHASH_SIZE rows of DHASH_SIZE
+# differences between neighbouring pixels, a DHASH_BITS bit number
+DHASH_SIZE = 8
+DHASH_BITS = DHASH_SIZE * DHASH_SIZE
+
+# How far apart the width/height of two sources can be and still count as
+# near-duplicates.  Past that the monitors would not get the same tiles.
+DEDUPE_ASPECT_TOLERANCE = 0.01
+
+class StdoutHandler(logging.StreamHandler):
+   """Log handler writing to whatever sys.stdout is at the time, so the
+      output split_image_worker captures includes the log messages."""
+
+   @property
+   def stream(self):
+      return sys.stdout
+
+   @stream.setter
+   def stream(self, value):
+      pass
+
+def set_log_level(level):
+   """Print log messages at level (logging.DEBUG for -v) and up to stdout
+      the way the messages have always looked"""
+   if not Logger.handlers:
+      Logger.addHandler(StdoutHandler())
+      Logger.propagate = False
+   Logger.setLevel(level)
+
+def log_debug(*args):
+   """Log a debug message to the screen.  The arguments are only turned
+      into a string if debug logging is on, but they are still built, so
+      call sites that compute them use Logger.debug with %-style arguments
+      or check Logger.isEnabledFor first."""
+   if Logger.isEnabledFor(logging.DEBUG):
+      Logger.debug(" ".join(str(arg) for arg in args))
+
+# One timed stage of splitting an image.  start and end are
+# time.perf_counter() values; counters holds bytes_read, bytes_written or
+# pixels_resampled when the stage has any.
+TraceEvent = collections.namedtuple('TraceEvent', ['stage', 'image', 'start',
+                                                   'end', 'counters', 'pid',
+                                                   'thread'])
+
+class TraceSpan(object):
+   """Times a stage and hands a TraceEvent to every one of Trace_hooks
+      when it is done.  Use trace_span() to get one."""
+   __slots__ = ('stage', 'image', 'counters', 'start')
+
+   def __init__(self, stage, image):
+      self.stage = stage
+      self.image = image
+      self.counters = {}
+
+   def __enter__(self):
+      self.start = time.perf_counter()
+      return self
+
+   def __exit__(self, *exc_info):
+      event = TraceEvent(self.stage, self.image, self.start,
+                         time.perf_counter(), self.counters, os.getpid(),
+                         threading.get_ident())
+      for hook in Trace_hooks:
+         hook(event)
+
+   def count(self, name, amount):
+      self.counters[name] = self.counters.get(name, 0) + amount
+
+class NullSpan(object):
+   """What trace_span() hands out when nobody is listening"""
+   __slots__ = ()
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *exc_info):
+      pass
+
+   def count(self, name, amount):
+      pass
+
+NULL_SPAN = NullSpan()
+
+def trace_span(stage, image=None):
+   """Context manager timing stage (decode, padding, crop, resample, ...)
+      of splitting image.  With no Trace_hooks installed this is a shared
+      object that does nothing, so tracing costs next to nothing when it
+      is off."""
+   if not Trace_hooks:
+      return NULL_SPAN
+   return TraceSpan(stage, image)
+
+class ImageProfile(object):
+   """Runs cProfile while entered and dumps the stats for image into
+      directory.  Use profile_image() to get one.  The file is named after
+      image plus a hash of its full path, so sources with the same name in
+      different directories get a file each."""
+
+   def __init__(self, directory, image):
+      path_hash = hashlib.sha256(
+         os.path.abspath(image).encode('utf-8', 'surrogateescape'))
+      self.filename = os.path.join(os.path.expanduser(directory),
+                                   os.path.basename(image) + "-" +
+                                   path_hash.hexdigest()[:12] + ".prof")
+      self.profiler = cProfile.Profile()
+
+   def __enter__(self):
+      self.profiler.enable()
+      return self
+
+   def __exit__(self, *exc_info):
+      self.profiler.disable()
+      self.profiler.dump_stats(self.filename)
+      log_debug("Wrote profile to", self.filename)
+
+def profile_image(opts, image):
+   """Context manager profiling the split of image if --profile is on"""
+   if opts.profile is None:
+      return NULL_SPAN
+   return ImageProfile(opts.profile, image)
+
+class ChromeTrace(object):
+   """Trace hook that writes the spans as a Chrome trace event file
+      (chrome://tracing, Perfetto) when closed."""
+
+   def __init__(self, filename):
+      self.filename = os.path.expanduser(filename)
+      self.events = []
+
+   def __call__(self, event):
+      args = dict(event.counters)
+      if event.image is not None:
+         args['image'] = event.image
+      self.events.append({"name": event.stage, "cat": "split", "ph": "X",
+                          "ts": event.start * 1e6,
+                          "dur": (event.end - event.start) * 1e6,
+                          "pid": event.pid, "tid": event.thread,
+                          "args": args})
+
+   def close(self):
+      with open(self.filename, 'w') as f:
+         json.dump({"traceEvents": self.events}, f)
+
+class PrometheusTextfile(object):
+   """Trace hook that keeps running totals per stage and writes them out
+      for the node_exporter textfile collector.  The file is rewritten at
+      most every interval seconds while splitting and again when closed."""
+
+   def __init__(self, filename, interval=10.0):
+      self.filename = os.path.expanduser(filename)
+      self.interval = interval
+      self.lock = threading.Lock()
+      self.seconds = collections.Counter()
+      self.calls = collections.Counter()
+      self.counters = collections.Counter()
+      self.written = time.monotonic()
+
+   def __call__(self, event):
+      with self.lock:
+         self.seconds[event.stage] += event.end - event.start
+         self.calls[event.stage] += 1
+         self.counters.update(event.counters)
+         due = time.monotonic() - self.written >= self.interval
+      if due:
+         self.close()
+
+   def close(self):
+      with self.lock:
+         lines = ["# HELP wallpaper_splitter_stage_seconds_total Time spent "
+                  "in each stage of splitting",
+                  "# TYPE wallpaper_splitter_stage_seconds_total counter"]
+         lines += ['wallpaper_splitter_stage_seconds_total{stage="%s"} %f'
+                   % (stage, self.seconds[stage])
+                   for stage in sorted(self.seconds)]
+         lines += ["# HELP wallpaper_splitter_stage_calls_total Times each "
+                   "stage ran",
+                   "# TYPE wallpaper_splitter_stage_calls_total counter"]
+         lines += ['wallpaper_splitter_stage_calls_total{stage="%s"} %d'
+                   % (stage, self.calls[stage])
+                   for stage in sorted(self.calls)]
+         for name in sorted(self.counters):
+            metric = "wallpaper_splitter_" + name + "_total"
+            lines += ["# TYPE " + metric + " counter",
+                      metric + " %d" % self.counters[name]]
+         # Write and rename so the collector never sees half a file
+         temp_file = self.filename + ".tmp"
+         with open(temp_file, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+         os.replace(temp_file, self.filename)
+         self.written = time.monotonic()
+
+def parse_cmdline():
+   """Do command line parsing stuff"""
+   parser = argparse.ArgumentParser(description = 'Wallpaper-Splitter')
+
+   # Base arguments
+   parser.add_argument('--monitor', '-m', required=True, action='append',
+                       metavar='<monitor_def_file.json>',
+                       help="Monitor Layout Definition JSON File, or a "
+                            "directory of them.  Give more than one to "
+                            "split every image for each layout; the tiles "
+                            "are then named <image>_<layout><suffix>")
+   parser.add_argument('--quiet', '-q', action='store_true',
+                       help="Quiet Output")
+   parser.add_argument("img_file", nargs='+',
+                       help='Image files, directories (searched recursively) '
+                            'or quoted glob patterns to convert')
+   parser.add_argument("--verbose", '-v', action='store_true',
+                       help='Verbose Output')
+
+   # Crop group
+   pos = parser.add_argument_group('Crop Padding')
+   leftright = pos.add_mutually_exclusive_group()
+   leftright.add_argument("--left", help="Left justify the cropped images",
+                          action='store_true')
+   leftright.add_argument("--right", help="Right justify the cropped images",
+                          action='store_true')
+   leftright.add_argument("--left-padding", help="Left Padding value",
+                          type=int, action='store')
+   leftright.add_argument("--right-padding", help="Right Padding value",
+                          type=int, action='store')
+
+   # Position mutually exclusive stuff
+   topbot = pos.add_mutually_exclusive_group()
+   topbot.add_argument("--top", help="Top justify the cropped images",
+                       action='store_true')
+   topbot.add_argument("--bottom", help="Bottom justify the cropped images",
+                        action='store_true')
+   topbot.add_argument("--top-padding", help="Top Padding value",
+                       type=int, action='store')
+   topbot.add_argument("--bottom-padding", help="Bottom Padding value",
+                       type=int, action='store')
+
+   pos.add_argument("--auto-position", action='store_true',
+                    help="Slide the monitors over the image to where they "
+                         "show the most detail and hide the least behind "
+                         "bezels.  Only along directions not fixed by the "
+                         "options above")
+
+   # Stuff I don't know where to put
+   steps = parser.add_argument_group('Step Selection')
+   steps.add_argument("--crop_only",
+                      help="Do not resize the output images.  Crop only",
+                      action='store_true')
+   steps.add_argument("--frames", action='store_true',
+                      help="Split every frame of animated GIF, PNG and "
+                           "WebP sources (and every page of multi-page "
+                           "TIFFs) into an animation per monitor instead "
+                           "of just the first")
+   steps.add_argument("--preview", action='store_true',
+                      help="Before splitting each image write a small "
+                           "<image>" + PREVIEW_SUFFIX + ".png showing the "
+                           "monitors on it and the tiles they will get")
+   steps.add_argument("--preview-only", action='store_true',
+                      help="Only write the --preview, no tiles")
+   steps.add_argument("--preview-width", type=int, default=PREVIEW_WIDTH,
+                      metavar='PIXELS',
+                      help="How wide the --preview is (default " +
+                           str(PREVIEW_WIDTH) + ")")
+
+   # Performance knobs
+   perf = parser.add_argument_group('Performance')
+   perf.add_argument("--jobs", '-j', type=int, default=1, metavar='N',
+                     help="Split N images at once using a pool of worker "
+                          "processes (default 1)")
+   perf.add_argument("--encode-threads", type=int, default=0, metavar='N',
+                     help="Write tiles on N background threads while the "
+                          "next image is decoded (default 0, write inline)")
+   perf.add_argument("--tile-threads", type=int, default=0, metavar='N',
+                     help="Cut, resize and write the tiles of each image "
+                          "on up to N threads at once, for when a single "
+                          "big image has to be done quickly (default 0, "
+                          "one tile at a time)")
+   perf.add_argument("--no-draft", dest='draft', action='store_false',
+                     help="Always decode the source at full resolution "
+                          "instead of letting the decoder shrink it first")
+   perf.add_argument("--no-mmap", dest='mmap', action='store_false',
+                     help="Decode uncompressed sources (PPM/PGM, BMP, TGA, "
+                          "single strip TIFF) whole instead of mapping "
+                          "them and reading each tile straight out of the "
+                          "file.  Raw captures are always mapped")
+   perf.add_argument("--strip-height", type=int, default=0, metavar='ROWS',
+                     help="Decode sources ROWS rows at a time instead of "
+                          "all at once so huge images fit in memory.  "
+                          "Works for uncompressed TIFF, PPM/PGM, BMP and "
+                          "other formats Pillow reads in separate tiles; "
+                          "anything else (PNG, JPEG, ...) is decoded whole, "
+                          "with a warning, and still held to Pillow's "
+                          "decompression bomb limit (default 0, off)")
+   perf.add_argument("--resample-engine",
+                     choices=RESAMPLE_ENGINES, default='tile',
+                     help="Resize each monitor with Pillow (tile, the "
+                          "default) or with matrix products in NumPy, "
+                          "which a multithreaded BLAS can spread over "
+                          "every core (numpy)")
+
+   # What the tiles are written as
+   output = parser.add_argument_group('Output')
+   output.add_argument("--output-format", type=parse_output_format,
+                       metavar='FORMAT',
+                       help="Write the tiles as FORMAT (jpeg, png, webp, "
+                            "avif, ...) instead of the format of the source")
+   output.add_argument("--encoder-profile", default='default',
+                       metavar='NAME|<file.json>',
+                       help="Encoder settings to write the tiles with: "
+                            "fastest, smallest, default (what Pillow "
+                            "does), or a JSON file of per format quality, "
+                            "compress_level, optimize, progressive, "
+                            "subsampling, method and speed settings")
+   output.add_argument("--sink", choices=['files'] + sorted(TILE_SINKS),
+                       default='files',
+                       help="Write the tiles of the whole batch into one "
+                            "--sink-file, a tar or zip archive or an atlas "
+                            "of tiles back to back with a JSON index of "
+                            "where each is, instead of a file per tile "
+                            "next to each image (files, the default)")
+   output.add_argument("--sink-file", metavar='<file>',
+                       help="The archive or atlas --sink writes")
+
+   # Where the images come from
+   inputs = parser.add_argument_group('Input')
+   inputs.add_argument("--watch", action='store_true',
+                       help="After splitting, keep watching the given "
+                            "directories and split new images as they "
+                            "show up")
+   inputs.add_argument("--poll-interval", type=float, default=2.0,
+                       metavar='SECONDS',
+                       help="How often --watch looks for new images when "
+                            "inotify is not available (default 2)")
+
+   # Output cache
+   cache = parser.add_argument_group('Output Cache')
+   cache.add_argument("--cache-dir", metavar='<dir>',
+                      help="Remember what has been split in <dir> and skip "
+                           "images whose source, monitors and options have "
+                           "not changed")
+   cache.add_argument("--cache-size", type=int, default=4096, metavar='MB',
+                      help="Evict the least recently used entries once the "
+                           "cache holds more than MB megabytes of tiles "
+                           "(default 4096)")
+
+   # Long batches
+   batch = parser.add_argument_group('Batch Jobs')
+   batch.add_argument("--manifest", metavar='<file.jsonl>',
+                      help="Record every image split, its tiles and their "
+                           "checksums in <file.jsonl> and skip the images "
+                           "it says are done when run again")
+   batch.add_argument("--dedupe-index", metavar='<file.jsonl>',
+                      help="Keep a perceptual hash of every image split in "
+                           "<file.jsonl> and skip images that are resized "
+                           "or re-encoded copies of one already split")
+   batch.add_argument("--dedupe-distance", type=int, default=4,
+                      metavar='BITS',
+                      help="How many bits of the " + str(DHASH_BITS) +
+                           " bit hash two images can differ in and still "
+                           "be copies (default 4)")
+   batch.add_argument("--dedupe-link", action='store_true',
+                      help="Give the copies --dedupe-index finds the tiles "
+                           "of the original, hard linked, instead of "
+                           "nothing")
+   batch.add_argument("--dedupe-report", metavar='<file.json>',
+                      help="Write every original in the --dedupe-index "
+                           "and the copies of it found to <file.json>")
+   batch.add_argument("--retries", type=int, default=0, metavar='N',
+                      help="Try an image that fails up to N more times "
+                           "before giving up on it (default 0)")
+   batch.add_argument("--retry-delay", type=float, default=1.0,
+                      metavar='SECONDS',
+                      help="Wait before the first retry, doubled for each "
+                           "one after that (default 1)")
+
+   # Where the time goes
+   instr = parser.add_argument_group('Instrumentation')
+   instr.add_argument("--trace", metavar='<file.json>',
+                      help="Time every stage (decode, padding, crop, "
+                           "resample, encode) and write the spans to "
+                           "<file.json> in Chrome trace event format")
+   instr.add_argument("--metrics-file", metavar='<file.prom>',
+                      help="Keep per stage time and bytes/pixel totals in "
+                           "<file.prom> for the Prometheus node_exporter "
+                           "textfile collector")
+   instr.add_argument("--profile", metavar='<dir>',
+                      help="Run each image under cProfile and dump the "
+                           "stats to <dir>/<image>-<path hash>.prof.  With "
+                           "--encode-threads the decode and encode happen "
+                           "on other threads and are not included")
+
+   # Now parse them dudes
+   args = parser.parse_args()
+
+   if args.jobs < 1:
+      parser.error("--jobs must be at least 1")
+   if args.encode_threads < 0:
+      parser.error("--encode-threads can not be negative")
+   if args.tile_threads < 0:
+      parser.error("--tile-threads can not be negative")
+   if args.retries < 0:
+      parser.error("--retries can not be negative")
+   if args.strip_height < 0:
+      parser.error("--strip-height can not be negative")
+   if not 0 <= args.dedupe_distance < DHASH_BITS:
+      parser.error("--dedupe-distance must be from 0 to " +
+                   str(DHASH_BITS - 1))
+   if args.dedupe_index is None and (args.dedupe_link or
+                                     args.dedupe_report is not None):
+      parser.error("--dedupe-link and --dedupe-report need --dedupe-index")
+   if args.resample_engine == 'numpy' and numpy is None:
+      parser.error("--resample-engine numpy needs NumPy installed")
+   if args.preview_width < 1:
+      parser.error("--preview-width must be at least 1")
+   if args.preview_only:
+      args.preview = True
+   if args.sink == 'files':
+      if args.sink_file is not None:
+         parser.error("--sink-file needs a --sink other than files")
+   elif args.sink_file is None:
+      parser.error("--sink " + args.sink + " needs a --sink-file")
+   else:
+      # These all expect to find the tiles on disk
+      clashes = [flag for flag, value in
+                 [("--cache-dir", args.cache_dir is not None),
+                  ("--manifest", args.manifest is not None),
+                  ("--dedupe-link", args.dedupe_link),
+                  ("--frames", args.frames), ("--watch", args.watch)]
+                 if value]
+      if clashes:
+         parser.error("--sink " + args.sink + " can not be used with " +
+                      ", ".join(clashes))
+   try:
+      args.encoder_settings = encoder_settings(args.encoder_profile)
+   except (OSError, ValueError) as e:
+      parser.error("Unable to load encoder profile: " + str(e))
+   if args.strip_height > 0:
+      # Strips are for sources far past Pillow's decompression bomb limit
+      lift_pixel_limit()
+      if args.auto_position:
+         print("WARNING: --auto-position needs the whole image and is "
+               "ignored for images decoded in strips")
+   if args.watch and not any(os.path.isdir(os.path.expanduser(f))
+                             for f in args.img_file):
+      parser.error("--watch needs at least one directory to watch")
+   if args.cache_dir is not None:
+      try:
+         os.makedirs(os.path.expanduser(args.cache_dir), exist_ok=True)
+      except OSError as e:
+         parser.error("Unable to create cache directory: " + str(e))
+   if args.profile is not None:
+      try:
+         os.makedirs(os.path.expanduser(args.profile), exist_ok=True)
+      except OSError as e:
+         parser.error("Unable to create profile directory: " + str(e))
+
+   if args.verbose:
+      set_log_level(logging.DEBUG)
+
+   log_debug(args)
+   return args
+
+def monitor_extent(monitor):
+   """The [width, height] monitor takes up in the layout.  Its resolution
+      unless compile_layout stretched it to match its physical size."""
+   return monitor.get('extent', monitor['resolution'])
+
+def layout_pair(value, label, minimum):
+   """Check value is a [x, y] of ints no smaller than minimum"""
+   if not isinstance(value, list) or len(value) != 2 or \
+      not all(isinstance(v, int) and not isinstance(v, bool) and
+              v >= minimum for v in value):
+      raise ValueError(label + " must be two whole numbers of at least " +
+                       str(minimum) + ", not " + json.dumps(value))
+   return value
+
+def physical_numbers(value, count, label, positive=True):
+   """Check value is a number, or a list of count numbers, that are above
+      zero (at least zero unless positive).  Returns them as a list."""
+   values = value if isinstance(value, list) else [value] * count
+   if len(values) != count or \
+      not all(isinstance(v, (int, float)) and not isinstance(v, bool) and
+              (v > 0 if positive else v >= 0) for v in values):
+      raise ValueError(label + " must be " + ("positive" if positive else
+                       "non-negative") + " numbers, not " + json.dumps(value))
+   return [float(v) for v in values]
+
+def find_overlaps(rects):
+   """Pairs of indexes into rects ([left, upper, right, lower] each) that
+      overlap.  Sweeps across from the left keeping the rects the sweep
+      line is inside of, so only rects sharing some columns get compared.
+      Rects that just touch don't overlap."""
+   overlaps = []
+   active = []
+   for idx in sorted(range(len(rects)), key=lambda i: rects[i][0]):
+      left, upper, right, lower = rects[idx]
+      active = [other for other in active if rects[other][2] > left]
+      for other in active:
+         if rects[other][1] < lower and upper < rects[other][3]:
+            overlaps.append((other, idx))
+      active.append(idx)
+   return overlaps
+
+def seam_gaps(rects, bezels, growth, axis, density):
+   """Work out how far apart the seams between monitors need to be pushed
+      along axis (0 across, 1 down) to make room for the bezels and for
+      monitors bigger than their resolution.  rects are
+      the monitors as [left, upper, right, lower], bezels their
+      [left, top, right, bottom] in mm and growth how much bigger than
+      their resolution they are in the layout.  density is layout pixels
+      per mm.  Returns a sorted list of (seam position, gap)."""
+   near, far = axis, axis + 2
+   starts = {}
+   for idx, rect in enumerate(rects):
+      starts.setdefault(rect[near], []).append(idx)
+
+   gaps = {}
+   for idx, rect in enumerate(rects):
+      # Anything past a monitor has to make way for it growing.  Only the
+      # monitors starting right where it ends share a seam, and bezels,
+      # with it.
+      gap = growth[idx][axis]
+      for other in starts.get(rect[far], []):
+         if rects[other][1 - axis] < rect[3 - axis] and \
+            rect[1 - axis] < rects[other][3 - axis]:
+            gap = max(gap, growth[idx][axis] +
+                      (bezels[idx][far] + bezels[other][near]) * density)
+      gaps[rect[far]] = max(gaps.get(rect[far], 0.0), gap)
+   return sorted(gaps.items())
+
+class CompiledLayout(list):
+   """The monitors compile_layout returns.  Only a list of this type is
+      taken as already compiled; nothing read from a file can be one."""
+
+def compile_layout(definition):
+   """Check over a monitor definition (the parsed JSON file) and work out
+      the layout its monitors make.  Returns the monitors, copied, with an
+      'extent' each, as a CompiledLayout.  If the definition gives
+      physical sizes the monitors are stretched to match and moved apart
+      to leave room for their bezels.  Raises ValueError if something is
+      wrong with it."""
+   if not isinstance(definition, dict) or \
+      not isinstance(definition.get('monitors'), list) or \
+      not definition['monitors']:
+      raise ValueError("Monitor definition has no monitors")
+   if isinstance(definition['monitors'], CompiledLayout):
+      # Bezel gaps already opened up, doing it again would move them twice
+      return CompiledLayout(dict(monitor)
+                            for monitor in definition['monitors'])
+
+   monitors = []
+   labels = []
+   suffixes = {}
+   for idx, monitor in enumerate(definition['monitors']):
+      if not isinstance(monitor, dict):
+         raise ValueError("Monitor " + str(idx + 1) + " is not an object")
+      monitor = dict(monitor)
+      for key in PHYSICAL_KEYS:
+         if key in definition:
+            monitor.setdefault(key, definition[key])
+      monitor.setdefault('name', "Monitor " + str(idx + 1))
+      label = "Monitor " + str(idx + 1) + " (" + str(monitor['name']) + ")"
+      layout_pair(monitor.get('resolution'), label + " resolution", 1)
+      layout_pair(monitor.get('upper_left'), label + " upper_left", 0)
+      suffix = monitor.get('suffix')
+      if not isinstance(suffix, str) or not suffix:
+         raise ValueError(label + " needs a suffix for its tiles")
+      if suffix in suffixes:
+         raise ValueError(label + " has the same suffix as " +
+                          suffixes[suffix])
+      suffixes[suffix] = label
+      monitors.append(monitor)
+      labels.append(label)
+
+   rects = [monitor['upper_left'] +
+            [monitor['upper_left'][0] + monitor['resolution'][0],
+             monitor['upper_left'][1] + monitor['resolution'][1]]
+            for monitor in monitors]
+   overlaps = find_overlaps(rects)
+   if overlaps:
+      first, second = overlaps[0]
+      raise ValueError(labels[first] + " overlaps " + labels[second])
+
+   if not any(key in monitor for monitor in monitors
+              for key in PHYSICAL_KEYS):
+      for monitor in monitors:
+         monitor['extent'] = list(monitor['resolution'])
+      return CompiledLayout(monitors)
+
+   # Lay everything out at the density of the densest monitor so none of
+   # them has to be upscaled from the source more than the rest
+   densities = []
+   bezels = []
+   for monitor, label in zip(monitors, labels):
+      width, height = monitor['resolution']
+      if 'size_mm' in monitor:
+         size = physical_numbers(monitor['size_mm'], 2, label + " size_mm")
+         densities.append((width / size[0], height / size[1]))
+      elif 'dpi' in monitor:
+         dpi = physical_numbers(monitor['dpi'], 1, label + " dpi")[0]
+         densities.append((dpi / MM_PER_INCH, dpi / MM_PER_INCH))
+      else:
+         raise ValueError(label + " needs a dpi or size_mm as other "
+                          "monitors give their physical size")
+      bezels.append(physical_numbers(monitor.get('bezel_mm', 0), 4,
+                                     label + " bezel_mm", positive=False))
+   density = (max(d[0] for d in densities), max(d[1] for d in densities))
+
+   growth = []
+   for monitor, monitor_density in zip(monitors, densities):
+      extent = [max(monitor['resolution'][axis],
+                    int(round(monitor['resolution'][axis] * density[axis] /
+                              monitor_density[axis])))
+                for axis in (0, 1)]
+      growth.append([extent[axis] - monitor['resolution'][axis]
+                     for axis in (0, 1)])
+      monitor['extent'] = extent
+
+   gaps = [seam_gaps(rects, bezels, growth, axis, density[axis])
+           for axis in (0, 1)]
+   for monitor in monitors:
+      monitor['upper_left'] = [
+         monitor['upper_left'][axis] +
+         int(round(sum(gap for seam, gap in gaps[axis]
+                       if seam <= monitor['upper_left'][axis])))
+         for axis in (0, 1)]
+      log_debug(monitor['name'], "covers", monitor['extent'], "at",
+                monitor['upper_left'], "of the layout")
+
+   rects = [monitor['upper_left'] +
+            [monitor['upper_left'][0] + monitor['extent'][0],
+             monitor['upper_left'][1] + monitor['extent'][1]]
+            for monitor in monitors]
+   overlaps = find_overlaps(rects)
+   if overlaps:
+      first, second = overlaps[0]
+      raise ValueError(labels[first] + " overlaps " + labels[second] +
+                       " once sized to match the others")
+   return CompiledLayout(monitors)
+
+def parse_monitor(monitor_file):
+   """Make certain the monitors file looks good and return the monitor
+      section of it."""
+   # Handle them ~'s
+   real_file = os.path.expanduser(monitor_file)
+   if not os.path.isfile(real_file):
+      sys.exit("Unable to find " + monitor_file)
+
+   j = []
+   with open(real_file, 'r') as f:
+      j = json.load(f)
+
+   if not isinstance(j, dict) or "monitors" not in j:
+      sys.exit("Your JSON file appears to be not-well-formatted.")
+   try:
+      return compile_layout(j)
+   except ValueError as e:
+      sys.exit(monitor_file + ": " + str(e))
+
+def parse_monitors(monitor_files):
+   """Read the monitor definitions named by monitor_files, each a file or
+      a directory of .json files.  A single definition is returned as it
+      is.  With more than one, the monitors of all of them are returned
+      together, each tagged with the 'layout' it came from (the file name
+      without .json) and with that added to its suffix so the tiles of
+      different layouts don't collide."""
+   definitions = []
+   for monitor_file in monitor_files:
+      real_file = os.path.expanduser(monitor_file)
+      if os.path.isdir(real_file):
+         definitions += [os.path.join(real_file, name)
+                         for name in sorted(os.listdir(real_file))
+                         if name.endswith('.json')]
+      else:
+         definitions.append(monitor_file)
+   if not definitions:
+      sys.exit("No monitor definitions found in " + ", ".join(monitor_files))
+   if len(definitions) == 1:
+      return parse_monitor(definitions[0])
+
+   monitors = []
+   names = set()
+   for definition in definitions:
+      name = os.path.basename(definition)
+      if name.endswith('.json'):
+         name = name[:-len('.json')]
+      if name in names:
+         sys.exit("More than one monitor definition is called " + name)
+      names.add(name)
+      for monitor in parse_monitor(definition):
+         monitor = dict(monitor)
+         monitor['layout'] = name
+         monitor['suffix'] = "_" + name + monitor['suffix']
+         monitors.append(monitor)
+   return monitors
+
+def layout_groups(monitors):
+   """Break monitors (see parse_monitors) up by layout.  Returns a list of
+      (layout name, monitors); the name is None if there is just one."""
+   groups = collections.OrderedDict()
+   for monitor in monitors:
+      groups.setdefault(monitor.get('layout'), []).append(monitor)
+   return list(groups.items())
+
+def get_terminal_width():
+   """Return the width of the terminal.  80 if things go south.  Only
+      looked up the first time; every image's preview uses the same."""
+   global Terminal_width
+   if Terminal_width is None:
+      Terminal_width = shutil.get_terminal_size((80, 24)).columns
+   return Terminal_width
+
+def find_monitor_extremes(monitors):
+   """Return the max width and max height of the monitors.
+
+      We have to base this on both the position and the resolution
+      and return the absolute extremes those give us."""
+
+   max_width = 0
+   max_height = 0
+   assert len(monitors) > 0
+   for monitor in monitors:
+      right_edge = monitor["upper_left"][0] + monitor_extent(monitor)[0]
+      if right_edge > max_width:
+         log_debug("Monitor", monitor["name"], "gives new max right edge",
+                   right_edge)
+         max_width = right_edge
+      top_edge = monitor["upper_left"][1] + monitor_extent(monitor)[1]
+      if top_edge > max_height:
+         log_debug("Monitor", monitor["name"], "gives new max height",
+                   top_edge)
+         max_height = top_edge
+   log_debug("Monitor maximums:", [max_width, max_height])
+   return max_width, max_height
+
+
+def calculate_scale(monitors, output_width=None, output_height=None,
+                    extremes=None):
+   """Calculate the Desired Monitor Layout.  output_width or output_height
+      could be limiting factor.  extremes is what find_monitor_extremes
+      returns for monitors if the caller already has it."""
+
+   # The basic idea here is to look at our monitors, find out how many
+   # pixels there are in the X and the Y direction, and then figure out
+   # which one will "bump" up against the output_* variables first.
+   # After we figure that out, we can calculate the scale factor and the
+   # "other" output_*.
+
+   # We have to bump into SOMETHING first.
+   assert output_width is not None or output_height is not None
+
+   # We are either WIDTH or HEIGHT limited
+   limiting_factor = None
+   output_ratio = None
+
+   # Find the extremes and the monitor ratio
+   if extremes is None:
+      extremes = find_monitor_extremes(monitors)
+   monitor_width, monitor_height = extremes
+   monitor_ratio = float(monitor_height) / float(monitor_width)
+
+   # Find the input limiting factors
+   if output_width is None:
+      limiting_factor = 'HEIGHT'
+      scale_factor = float(output_height) / float(monitor_height)
+      output_width = int(monitor_width * scale_factor)
+   elif output_height is None:
+      limiting_factor = 'WIDTH'
+      scale_factor = float(output_width) / float(monitor_width)
+      output_height = int(monitor_height * scale_factor)
+   else:
+      # We have to fit in a specified width and height
+      output_ratio = float(output_height) / float(output_width)
+      if (output_ratio < monitor_ratio):
+         limiting_factor = 'HEIGHT'
+         scale_factor = float(output_height) / float(monitor_height)
+      else:
+         limiting_factor = 'WIDTH'
+         scale_factor = float(output_width) / float(monitor_width)
+
+   if output_ratio is None:
+      output_ratio = float(output_height) / float(output_width)
+
+   ret = {"output_width": output_width,
+          "output_height": output_height,
+          "monitor_width": monitor_width,
+          "monitor_height": monitor_height,
+          "scale_factor": scale_factor,
+          "limiting_factor": limiting_factor,
+          "monitor_ratio": monitor_ratio,
+          "output_ratio": output_ratio}
+   log_debug("Using scale of:", ret)
+   return ret
+
+def pixel_to_terminal(layout, pixel_location,
+                      term_offset=None, pixel_offset=None):
+   """Convert pixels to terminal locations.  Apply pixel_offset
+      before conversion and term_offset (terminal_offset) after
+      conversion."""
+   pixel_x, pixel_y = pixel_location
+
+   # Apply pixel offset
+   if pixel_offset is not None:
+      pixel_x += pixel_offset[0]
+      pixel_y += pixel_offset[1]
+
+   # Subtrace 1 to bump everything down into lower cell
+   term_x = int((pixel_x - 1) * layout['scale_factor'])
+   term_y = int(((pixel_y - 1) * layout['scale_factor']) / MONITOR_SCALE)
+
+   # Apply terminal offset
+   if term_offset is not None:
+      term_x += term_offset[0]
+      term_y += term_offset[1]
+
+   Logger.debug("%s becomes %s with term_offset %s and pixel_offset %s "
+                "using scale factor of %s", pixel_location, (term_x, term_y),
+                term_offset, pixel_offset, layout['scale_factor'])
+
+   # Keep things in check.  This can crop things slightly but fixes
+   # small rounding errors.
+   if term_x >= layout['output_width']:
+      term_x = layout['output_width'] - 1
+
+   if term_y >= int(layout['output_height'] / MONITOR_SCALE):
+      term_y = int((layout['output_height'] / MONITOR_SCALE) - 1)
+
+   return term_x, term_y
+
+def add_horiz_line(v_buf, v_1, v_2, arrows=False, title=None):
+   """Draw a horizonal line from v_1 to v_2 in v_buf.  Turn it into
+      an arrow if arrows is True.  Add a title on the line if title
+      is given."""
+   # Horizontal line has same Y component
+   log_debug("Drawing horiz line from", v_1, "to", v_2)
+   assert v_1[1] == v_2[1]
+   x_1 = v_1[0]
+   x_2 = v_2[0]
+   y = v_1[1]
+
+   v_buf[x_1, y] = '+'
+   v_buf[x_2, y] = '+'
+   if x_1 > x_2:
+      t = x_2
+      x_2 = x_1
+      x_1 = t
+
+   text = {}
+   if title is not None:
+      center = x_2 - x_1
+      center_with_offset = int((center - len(title)) / 2)
+      for x in range(0, len(title)):
+         text[center_with_offset + x] = title[x]
+
+   for x in range(x_1+1, x_2):
+      if v_buf[x, y] == '+':
+         # Don't draw over other corners
+         continue
+      try:
+         if (x == (x_1 + 1) and arrows):
+            v_buf[x, y] = '<'
+         elif (x == (x_2 - 1) and arrows):
+            v_buf[x, y] = '>'
+         elif x in text:
+            v_buf[x, y] = text[x]
+         else:
+            v_buf[x, y] = '-'
+      except:
+         print("Unable to set[", x, ",", y, "]")
+         raise
+
+def add_vert_line(v_buf, v_1, v_2, arrows = False, title=None):
+   """Draw a veritcal line from v_1 to v_2 in v_buf.  Turn it into
+      an arrow if arrows is True.  Add a title on the line if title
+      is given."""
+   # I should be able to combine this with the above function but
+   # they are not _that_ similar.
+   log_debug("Drawing vertical line from", v_1," to", v_2)
+   assert v_1[0] == v_2[0]
+   y_1 = v_1[1]
+   y_2 = v_2[1]
+   x = v_1[0]
+
+   v_buf[x, y_1] = '+'
+   v_buf[x, y_2] = '+'
+   if y_1 > y_2:
+      t = y_2
+      y_2 = y_1
+      y_1 = t
+
+   text = {}
+   if title is not None:
+      center = y_2 - y_1
+      center_with_offset = int((center - len(title)) / 2)
+      for y in range(0, len(title)):
+         text[center_with_offset + y] = title[y]
+   for y in range(y_1+1, y_2):
+      if v_buf[x, y] == '+':
+         # Don't draw over other corners
+         continue
+      try:
+         if (y == (y_1 + 1) and arrows):
+            v_buf[x, y] = '^'
+         elif (y == (y_2 - 1) and arrows):
+            v_buf[x, y] = 'V'
+         elif y in text:
+            v_buf[x, y] = text[y]
+         else:
+            v_buf[x, y] = '|'
+      except:
+         print("Unable to set[", x, ",", y, "]")
+         raise
+
+def add_text(v_buf, monitor, layout, text, location):
+   """Add text at location in v_buf providing there is enough room.
+      location needs to be in terminal units"""
+   required_term_spaces = len(text)
+   available_term_spaces = monitor_extent(monitor)[0] * \
+                           layout['scale_factor']
+   log_debug(text, "requires", required_term_spaces, "terminal spaces;",
+             available_term_spaces, " terminal spaces available")
+   if required_term_spaces <= available_term_spaces:
+      v_buf.write(location[0], location[1], text)
+
+def add_overall_pixel_scales(v_buf, layout):
+   """This adds axis to our output that shows what the size of the layout is"""
+   add_horiz_line(v_buf,
+                  [0, v_buf.rows - 1],
+                  [v_buf.columns - 1, v_buf.rows - 1],
+                  arrows = True,
+                  title = str(layout['monitor_width']))
+   add_vert_line(v_buf,
+                 [v_buf.columns - 1, 0],
+                 [v_buf.columns - 1, v_buf.rows - 1],
+                 arrows = True,
+                 title = str(layout['monitor_height']))
+
+class VidBuffer(object):
+   """The terminal the layout gets drawn on, addressed as v_buf[x, y].
+
+      Stored row by row as a list of one character strings with the
+      newlines already in place, so printing it is one join and one
+      write, and monitor names keep whatever characters they have."""
+   __slots__ = ('columns', 'rows', 'stride', 'data')
+
+   def __init__(self, columns, rows):
+      self.columns = columns
+      self.rows = rows
+      self.stride = columns + 1
+      self.data = list((' ' * columns + '\n') * rows)
+
+   def offset(self, x, y):
+      if not (0 <= x < self.columns and 0 <= y < self.rows):
+         raise IndexError("[" + str(x) + ", " + str(y) + "] is off the "
+                          "video buffer")
+      return y * self.stride + x
+
+   def __getitem__(self, location):
+      return self.data[self.offset(*location)]
+
+   def __setitem__(self, location, char):
+      self.data[self.offset(*location)] = char
+
+   def write(self, x, y, text):
+      """Put text on row y starting at column x"""
+      start = self.offset(x, y)
+      self.offset(x + len(text) - 1, y)
+      self.data[start:start + len(text)] = text
+
+def print_to_vid_buffer(v_buf, layout, monitor, pixel_offset=None):
+   """Print the monitor into the v_buf.  Add text about the monitor
+      onto the monitor added to the v_buf."""
+
+   # Calculate where all the four corners are in terminal space
+   # by translating from pixel space.
+   extent = monitor_extent(monitor)
+   upper_left = pixel_to_terminal(layout,
+                                  monitor['upper_left'],
+                                  pixel_offset=pixel_offset)
+   upper_right = pixel_to_terminal(layout,
+                                   [monitor['upper_left'][0] + extent[0],
+                                    monitor['upper_left'][1]],
+                                   pixel_offset=pixel_offset)
+   lower_left = pixel_to_terminal(layout,
+                                  [monitor['upper_left'][0],
+                                   monitor['upper_left'][1] + extent[1]],
+                                  pixel_offset=pixel_offset)
+   lower_right = pixel_to_terminal(layout,
+                                   [monitor['upper_left'][0] + extent[0],
+                                    monitor['upper_left'][1] + extent[1]],
+                                   pixel_offset=pixel_offset)
+
+   # Draw the lines representing the monitor
+   add_horiz_line(v_buf, upper_left, upper_right)
+   add_horiz_line(v_buf, lower_left, lower_right)
+   add_vert_line(v_buf, upper_left, lower_left)
+   add_vert_line(v_buf, upper_right, lower_right)
+
+   # Add some monitor descriptions as text
+   add_text(v_buf,
+            monitor,
+            layout,
+            monitor['name'],
+            pixel_to_terminal(layout,
+                              monitor['upper_left'],
+                              term_offset=[1,1],
+                              pixel_offset=pixel_offset))
+   add_text(v_buf,
+            monitor,
+            layout,
+            "{0}x{1}".format(*monitor['resolution']),
+            pixel_to_terminal(layout,
+                              monitor['upper_left'],
+                              term_offset=[1,2],
+                              pixel_offset=pixel_offset))
+
+def print_vid_buffer(v_buf):
+   """Print the video buffer to the console"""
+   log_debug("Video buffer is", v_buf.columns, "columns", v_buf.rows, "rows")
+   sys.stdout.write("".join(v_buf.data))
+   sys.stdout.flush()
+
+def display_layout(layout, monitors, left_padding=0, top_padding=0):
+   """Print some output of what the monitor layout looks like"""
+
+   # Allocate the Video Buffer.  The output in this case is the terminal.
+   terminal_width = layout['output_width']
+   terminal_height = int(layout['output_height'] / MONITOR_SCALE)
+   log_debug("Terminal output is:", [terminal_width, terminal_height])
+
+   # Need to add 1 to the width and height to have room for the axis
+   vid_buffer = VidBuffer(terminal_width + 1, terminal_height + 1)
+
+   # Now that we have a video buffer add all the monitors to it
+   for monitor in monitors:
+      print_to_vid_buffer(vid_buffer, layout, monitor,
+                          pixel_offset=[left_padding, top_padding])
+
+   # Add the axis
+   add_overall_pixel_scales(vid_buffer, layout)
+   print_vid_buffer(vid_buffer)
+
+def open_image(image):
+   """Open an image at image and return the PIL open version, or a
+      MappedImage if it is a raw capture"""
+   if not os.path.isfile(image):
+      print("Warning:", image, "does not exist.  Skipping...")
+      return None
+   if is_raw_capture(image):
+      return open_raw(image)
+   f = open(image, 'rb')
+   img = Image.open(f)
+   if Bomb_pixels is not None and not can_stream(img):
+      try:
+         check_pixel_limit(img.size)
+      except Image.DecompressionBombError:
+         img.close()
+         raise
+   return img
+
+def lift_pixel_limit():
+   """Let Image.open take sources past Pillow's decompression bomb limit
+      so they can be decoded in strips.  The limit is kept in Bomb_pixels
+      and open_image still holds sources that would be decoded whole to
+      it."""
+   global Bomb_pixels
+   if Image.MAX_IMAGE_PIXELS is not None:
+      Bomb_pixels = Image.MAX_IMAGE_PIXELS
+      Image.MAX_IMAGE_PIXELS = None
+
+def check_pixel_limit(size):
+   """What Image.open does with an image of size when Bomb_pixels is
+      the limit: raise DecompressionBombError past twice the limit and
+      warn past it."""
+   pixels = size[0] * size[1]
+   if pixels > 2 * Bomb_pixels:
+      raise Image.DecompressionBombError(
+         "Image size ({0} pixels) exceeds limit of {1} pixels and can not "
+         "be decoded in strips, could be decompression bomb DOS "
+         "attack.".format(pixels, 2 * Bomb_pixels))
+   if pixels > Bomb_pixels:
+      warnings.warn("Image size ({0} pixels) exceeds limit of {1} pixels "
+                    "and can not be decoded in strips, could be "
+                    "decompression bomb DOS attack.".format(pixels,
+                                                            Bomb_pixels),
+                    Image.DecompressionBombWarning)
+
+def draft_image(img, output_layout, opts):
+   """Ask the decoder to hand us a reduced size version of img if the
+      monitors are going to shrink it anyway.  Only some formats (JPEG)
+      support this and it has to happen before the image is loaded.
+
+      The smallest decode that still covers every monitor's resolution is
+      the source scaled down by the layout scale_factor.  The decoder picks
+      a size at least that big (JPEG can do 1/2, 1/4 and 1/8).
+
+      Returns the [x, y] ratio of the decoded size to the original size."""
+   scale_factor = output_layout['scale_factor']
+   if not opts.draft or opts.crop_only or scale_factor < 2:
+      return [1.0, 1.0]
+
+   img_width, img_height = img.size
+   requested = (int(math.ceil(img_width / scale_factor)),
+                int(math.ceil(img_height / scale_factor)))
+   img.draft(img.mode, requested)
+   if img.size == (img_width, img_height):
+      log_debug("Decoder can not reduce", img.format, "images")
+      return [1.0, 1.0]
+
+   Logger.debug("Decoding %s image at %s for a requested %s",
+                [img_width, img_height], img.size, requested)
+   return [float(img.size[0]) / img_width, float(img.size[1]) / img_height]
+
+def extension_for(fmt):
+   """File extension to write tiles in fmt with"""
+   extensions = [ext for ext, name in Image.registered_extensions().items()
+                 if name == fmt]
+   for preferred in PREFERRED_EXTENSIONS.get(fmt, []) + ['.' + fmt.lower()]:
+      if preferred in extensions:
+         return preferred
+   return extensions[0] if extensions else '.' + fmt.lower()
+
+def output_filename(image, monitor, output_format=None):
+   """Return the name of the tile written for monitor when splitting image.
+      It keeps the extension of image unless output_format is given."""
+   extension = image[image.rfind('.'):]
+   if output_format is None and \
+      extension.lower() not in Image.registered_extensions():
+      # A raw capture.  Pillow can not write those.
+      output_format = RAW_OUTPUT_FORMAT
+   if output_format is not None:
+      extension = extension_for(output_format)
+   return image[:image.rfind('.')] + monitor['suffix'] + extension
+
+def parse_output_format(value):
+   """argparse type for --output-format.  Takes a Pillow format name or a
+      file extension (jpg, webp, ...) and returns the format name."""
+   Image.init()
+   fmt = Image.registered_extensions().get('.' + value.lower().lstrip('.'),
+                                           value.upper())
+   if fmt not in Image.SAVE:
+      raise argparse.ArgumentTypeError("Pillow can not write " + value)
+   return fmt
+
+def encoder_settings(profile):
+   """Work out the Image.save keyword arguments for each format from an
+      encoder profile.  profile is the name of one of ENCODER_PROFILES, a
+      JSON file mapping format names to settings, or such a dict already
+      loaded.  A profile file may say "extends": "<name>" to start from a
+      built in one.  Raises ValueError if it sets anything that is not in
+      ENCODER_SETTINGS."""
+   if isinstance(profile, str):
+      if profile in ENCODER_PROFILES:
+         profile = ENCODER_PROFILES[profile]
+      else:
+         with open(os.path.expanduser(profile), 'r') as f:
+            profile = json.load(f)
+   if not isinstance(profile, dict):
+      raise ValueError("An encoder profile maps formats to settings")
+   profile = dict(profile)
+   base = profile.pop('extends', 'default')
+   if base not in ENCODER_PROFILES:
+      raise ValueError("Unknown encoder profile to extend: " + str(base))
+   settings = dict((fmt, dict(values))
+                   for fmt, values in ENCODER_PROFILES[base].items())
+   for fmt, values in profile.items():
+      fmt = fmt.upper()
+      if not isinstance(values, dict):
+         raise ValueError("The " + fmt + " encoder settings must be an "
+                          "object")
+      unknown = set(values) - set(ENCODER_SETTINGS)
+      if unknown:
+         raise ValueError("Unknown " + fmt + " encoder setting(s): " +
+                          ", ".join(sorted(unknown)))
+      settings.setdefault(fmt, {}).update(values)
+   return settings
+
+def encode_tile(tile, fp, fmt, settings=None):
+   """Encode tile as fmt into fp, a file name or file object, with what
+      settings (from encoder_settings) has for fmt"""
+   fmt = fmt.upper()
+   modes = OUTPUT_MODES.get(fmt)
+   if modes is not None and tile.mode not in modes:
+      tile = tile.convert('RGB')
+   tile.save(fp, format=fmt, **(settings or {}).get(fmt, {}))
+
+def file_sha256(filename):
+   """Return the sha256 of the contents of filename in hex"""
+   digest = hashlib.sha256()
+   with open(filename, 'rb') as f:
+      for chunk in iter(lambda: f.read(1 << 20), b''):
+         digest.update(chunk)
+   return digest.hexdigest()
+
+def save_tile(tile, filename, settings=None):
+   """Write tile to filename in the format its extension says, using the
+      encoder settings for that format.  It is encoded into a temporary
+      file next to filename and renamed into place, so a crash never leaves
+      half a tile where whatever is watching the directory could pick it
+      up."""
+   tmp = filename + ".tmp" + str(os.getpid())
+   fmt = Image.registered_extensions().get(filename[filename.rfind('.'):]
+                                           .lower())
+   try:
+      encode_tile(tile, tmp, fmt, settings)
+      os.replace(tmp, filename)
+   except BaseException:
+      if os.path.exists(tmp):
+         os.remove(tmp)
+      raise
+
+def store_tile(tile, filename, settings=None):
+   """Write tile to filename, or put it in the --sink under that name if
+      there is one.  Returns how many bytes it came to."""
+   if Tile_sink is None:
+      save_tile(tile, filename, settings)
+      return os.path.getsize(filename)
+   return Tile_sink.add_tile(tile, filename, settings)
+
+def member_name(filename):
+   """The name the tile for filename goes by in an archive: relative to
+      the current directory, unless it is outside it"""
+   name = os.path.relpath(filename)
+   if name == os.pardir or name.startswith(os.pardir + os.sep):
+      name = os.path.abspath(filename).lstrip(os.sep)
+   return name.replace(os.sep, '/')
+
+class TileSink(object):
+   """Puts the tiles of a whole batch into one file instead of a file per
+      tile next to each source (--sink), for filesystems where creating
+      files costs more than encoding them.
+
+      Tiles are encoded in memory and appended to the file through a
+      SINK_BUFFER sized buffer, so it is written in big sequential chunks
+      and only flushed when close() is called at the end of the batch.
+      Like save_tile it is written to a temporary file and renamed into
+      place.  Tiles can be added from several threads at once.
+      Subclasses say how each tile is stored."""
+
+   def __init__(self, filename):
+      self.filename = os.path.expanduser(filename)
+      self.tmp = self.filename + ".tmp" + str(os.getpid())
+      self.fp = open(self.tmp, 'wb', buffering=SINK_BUFFER)
+      self.lock = threading.Lock()
+
+   def add_tile(self, tile, filename, settings=None):
+      """Encode tile in the format filename's extension says and add it
+         as filename.  Returns how many bytes it came to."""
+      fmt = Image.registered_extensions().get(filename[filename.rfind('.'):]
+                                              .lower())
+      buf = io.BytesIO()
+      encode_tile(tile, buf, fmt, settings)
+      self.add_data(filename, buf.getvalue())
+      return buf.tell()
+
+   def add_data(self, filename, data):
+      """Add the already encoded tile data as filename"""
+      with self.lock:
+         self.write(member_name(filename), data)
+
+   def write(self, name, data):
+      raise NotImplementedError
+
+   def finish(self):
+      """Write whatever goes after the last tile"""
+
+   def close(self):
+      try:
+         self.finish()
+         self.fp.close()
+         os.replace(self.tmp, self.filename)
+      except BaseException:
+         self.abort()
+         raise
+
+   def abort(self):
+      """Throw away what has been written"""
+      self.fp.close()
+      if os.path.exists(self.tmp):
+         os.remove(self.tmp)
+
+class TarSink(TileSink):
+   """Tiles as the members of a tar file"""
+
+   def __init__(self, filename):
+      TileSink.__init__(self, filename)
+      self.tar = tarfile.open(fileobj=self.fp, mode='w',
+                              format=tarfile.PAX_FORMAT)
+
+   def write(self, name, data):
+      info = tarfile.TarInfo(name)
+      info.size = len(data)
+      info.mtime = int(time.time())
+      self.tar.addfile(info, io.BytesIO(data))
+
+   def finish(self):
+      self.tar.close()
+
+class ZipSink(TileSink):
+   """Tiles as the members of a zip file.  They are stored as they are;
+      they were compressed when they were encoded."""
+
+   def __init__(self, filename):
+      TileSink.__init__(self, filename)
+      self.zip = zipfile.ZipFile(self.fp, 'w', zipfile.ZIP_STORED)
+
+   def write(self, name, data):
+      self.zip.writestr(name, data)
+
+   def finish(self):
+      self.zip.close()
+
+class AtlasSink(TileSink):
+   """Tiles back to back in one file, with a JSON index beside it
+      (<file>.json) giving the offset and length of each.  A client can
+      map the file and slice any tile straight out of it."""
+
+   def __init__(self, filename):
+      TileSink.__init__(self, filename)
+      self.tiles = {}
+      self.offset = 0
+
+   def write(self, name, data):
+      self.fp.write(data)
+      self.tiles[name] = {"offset": self.offset, "length": len(data)}
+      self.offset += len(data)
+
+   def close(self):
+      TileSink.close(self)
+      # Only once the tiles it points at are in place
+      index = self.filename + ".json"
+      tmp = index + ".tmp" + str(os.getpid())
+      with open(tmp, 'w') as f:
+         json.dump({"atlas": os.path.basename(self.filename),
+                    "bytes": self.offset, "tiles": self.tiles}, f,
+                   indent=1, sort_keys=True)
+      os.replace(tmp, index)
+
+class CollectSink(TileSink):
+   """What a --jobs worker puts the tiles in when there is a --sink.  It
+      keeps them for take() to hand back to the parent, which adds them
+      to the real one."""
+
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.tiles = []
+
+   def add_data(self, filename, data):
+      with self.lock:
+         self.tiles.append((filename, data))
+
+   def take(self):
+      """The (filename, data) of every tile added since the last call"""
+      with self.lock:
+         tiles, self.tiles = self.tiles, []
+      return tiles
+
+   def close(self):
+      pass
+
+   def abort(self):
+      self.tiles = []
+
+TILE_SINKS = {"tar": TarSink, "zip": ZipSink, "atlas": AtlasSink}
+
+def cache_key(monitors, opts, image):
+   """Work out the cache key for splitting image.  The key covers the
+      contents of the source, the monitor definitions and every option that
+      changes the tiles, so anything that would give different output gives
+      a different key."""
+   settings = {"version": CACHE_VERSION,
+               "source": file_sha256(image),
+               "monitors": monitors,
+               "extension": image[image.rfind('.'):].lower(),
+               "options": dict((name, getattr(opts, name))
+                               for name in CACHE_OPTIONS)}
+   canonical = json.dumps(settings, sort_keys=True, separators=(',', ':'))
+   return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def cache_entry_dir(opts, key):
+   """Where the cache keeps the entry for key"""
+   return os.path.join(os.path.expanduser(opts.cache_dir), key[:2], key)
+
+def link_or_copy(src, dst):
+   """Make dst the same file as src.  Hard link it if we can, otherwise
+      copy it.  dst is replaced atomically if it already exists."""
+   tmp = dst + ".tmp" + str(os.getpid())
+   try:
+      os.link(src, tmp)
+   except OSError:
+      shutil.copyfile(src, tmp)
+   os.replace(tmp, dst)
+
+def cache_restore(monitors, opts, image, key):
+   """Put the tiles for image back from the cache if key is in it.  Tiles
+      that are already the cached file are left alone, anything else is
+      hard linked into place.  Returns True on a cache hit."""
+   entry_dir = cache_entry_dir(opts, key)
+   entry_file = os.path.join(entry_dir, "entry.json")
+   try:
+      with open(entry_file, 'r') as f:
+         entry = json.load(f)
+   except (OSError, ValueError):
+      return False
+
+   tiles = entry['tiles']
+   if len(tiles) != len(monitors):
+      return False
+   for monitor, tile in zip(monitors, tiles):
+      cached = os.path.join(entry_dir, tile)
+      output = output_filename(image, monitor, opts.output_format)
+      if not os.path.isfile(cached):
+         log_debug("Cache entry", key, "is missing", tile)
+         return False
+      if os.path.exists(output) and os.path.samefile(output, cached):
+         continue
+      log_debug("Restoring", output, "from the cache")
+      link_or_copy(cached, output)
+
+   # Touch the entry so the eviction knows it was recently used
+   os.utime(entry_file, None)
+   Logger.debug("%s is up to date in the cache (%s)", image, key)
+   return True
+
+def cache_store(monitors, opts, image, key):
+   """Add the tiles just written for image to the cache under key.  The
+      entry is built off to the side and renamed into place so a reader
+      never sees half of one."""
+   if key is None:
+      return
+   entry_dir = cache_entry_dir(opts, key)
+   if os.path.isdir(entry_dir):
+      return
+   tmp_dir = entry_dir + ".tmp" + str(os.getpid())
+   os.makedirs(tmp_dir, exist_ok=True)
+   try:
+      tiles = []
+      size = 0
+      for idx, monitor in enumerate(monitors):
+         output = output_filename(image, monitor, opts.output_format)
+         tile = "tile" + str(idx) + output[output.rfind('.'):]
+         link_or_copy(output, os.path.join(tmp_dir, tile))
+         size += os.path.getsize(output)
+         tiles.append(tile)
+      with open(os.path.join(tmp_dir, "entry.json"), 'w') as f:
+         json.dump({"image": image, "tiles": tiles, "bytes": size}, f)
+      os.rename(tmp_dir, entry_dir)
+      log_debug("Cached", image, "as", key)
+   except OSError as e:
+      # Somebody else stored the same thing first, or the cache is
+      # unwritable.  Either way the tiles are fine.
+      Logger.debug("Unable to cache %s: %s", image, e)
+   finally:
+      if os.path.isdir(tmp_dir):
+         shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def cache_evict(opts):
+   """Throw out least recently used cache entries until the cache holds no
+      more than opts.cache_size megabytes of tiles."""
+   cache_dir = os.path.expanduser(opts.cache_dir)
+   limit = opts.cache_size * 1024 * 1024
+   entries = []
+   total = 0
+   for bucket in os.listdir(cache_dir):
+      bucket_dir = os.path.join(cache_dir, bucket)
+      if not os.path.isdir(bucket_dir):
+         continue
+      for key in os.listdir(bucket_dir):
+         entry_file = os.path.join(bucket_dir, key, "entry.json")
+         try:
+            with open(entry_file, 'r') as f:
+               size = json.load(f)['bytes']
+            entries.append((os.path.getmtime(entry_file), size,
+                            os.path.join(bucket_dir, key)))
+         except (OSError, ValueError, KeyError):
+            continue
+         total += size
+
+   log_debug("Cache holds", len(entries), "entries,", total, "bytes")
+   entries.sort()
+   for _, size, entry_dir in entries:
+      if total <= limit:
+         break
+      log_debug("Evicting", entry_dir)
+      shutil.rmtree(entry_dir, ignore_errors=True)
+      total -= size
+
+class Manifest(object):
+   """Append-only JSON lines record of the sources a batch has split, so
+      an interrupted run can pick up where it left off.
+
+      Every line says what happened to one source: whether it was split,
+      the tiles written with their sha256, the size and mtime of the
+      source and how long it took.  The last line for a source wins.  A
+      source is skipped if its last record says it was done, it has not
+      changed since and its tiles are all still there.  Anything else,
+      failures included, gets split again.  The tiles are looked for with
+      the extension output_format gives them, if it is not None."""
+
+   def __init__(self, filename, output_format=None):
+      self.filename = os.path.expanduser(filename)
+      self.output_format = output_format
+      self.lock = threading.Lock()
+      self.records = {}
+      self.skipped = 0
+      clean_end = True
+      try:
+         with open(self.filename, 'r') as f:
+            for line in f:
+               clean_end = line.endswith('\n')
+               try:
+                  record = json.loads(line)
+                  self.records[record['source']] = record
+               except (ValueError, KeyError, TypeError):
+                  # Cut short by a crash
+                  Logger.debug("Ignoring bad manifest line: %s",
+                               line.strip())
+      except FileNotFoundError:
+         pass
+      self.file = open(self.filename, 'a')
+      if not clean_end:
+         self.file.write('\n')
+
+   def is_done(self, image):
+      """Was image split by an earlier run and is it still up to date?"""
+      record = self.records.get(os.path.abspath(image))
+      if record is None or record['status'] != 'done':
+         return False
+      try:
+         stat = os.stat(image)
+      except OSError:
+         return False
+      if record['source_stat'] != [stat.st_size, stat.st_mtime_ns]:
+         return False
+      return all(os.path.isfile(tile['file']) for tile in record['tiles'])
+
+   def unfinished(self, images):
+      """Yield the images that are not already done"""
+      for image in images:
+         if self.is_done(image):
+            log_debug("Skipping", image, "- already done")
+            self.skipped += 1
+         else:
+            yield image
+
+   def record(self, monitors, image, seconds, error=None):
+      """Add a line for image.  error is None if all of its tiles were
+         written, otherwise the traceback of what went wrong."""
+      if not os.path.isfile(image):
+         # open_image already complained about it
+         return
+      stat = os.stat(image)
+      record = {"source": os.path.abspath(image),
+                "status": "done" if error is None else "failed",
+                "source_stat": [stat.st_size, stat.st_mtime_ns],
+                "seconds": round(seconds, 3),
+                "time": round(time.time(), 3)}
+      if error is None:
+         record['tiles'] = []
+         for monitor in monitors:
+            output = os.path.abspath(output_filename(image, monitor,
+                                                     self.output_format))
+            record['tiles'].append({"file": output,
+                                    "sha256": file_sha256(output)})
+      else:
+         record['error'] = error.strip().splitlines()[-1]
+      line = json.dumps(record)
+      with self.lock:
+         self.file.write(line + '\n')
+         self.file.flush()
+         os.fsync(self.file.fileno())
+         self.records[record['source']] = record
+
+   def close(self):
+      self.file.close()
+
+def image_dhash(image):
+   """Difference hash of image: shrunk to DHASH_SIZE + 1 by DHASH_SIZE
+      grey pixels, one bit per pair of neighbours saying whether the left
+      one is brighter.  Re-encoding or resizing a picture leaves it within
+      a few bits of the original.  Only needs a reduced size decode.
+      Returns (hash, [width, height]), or None if image can not be read."""
+   try:
+      opened = img = open_image(image)
+   except (OSError, Image.DecompressionBombError):
+      return None
+   if img is None:
+      return None
+   try:
+      size = list(img.size)
+      if not isinstance(img, MappedImage):
+         img.draft('L', (DHASH_SIZE * 8, DHASH_SIZE * 8))
+         if img.mode in ('1', 'P', 'PA'):
+            img = img.convert('RGB')
+      small = img.resize((DHASH_SIZE + 1, DHASH_SIZE),
+                         Image.Resampling.BOX, (0, 0) + img.size)
+      pixels = small.convert('L').tobytes()
+   except (OSError, ValueError) as e:
+      Logger.debug("Unable to hash %s: %s", image, e)
+      return None
+   finally:
+      if img is not opened:
+         img.close()
+      opened.close()
+   value = 0
+   for row in range(DHASH_SIZE):
+      for col in range(DHASH_SIZE):
+         left = pixels[row * (DHASH_SIZE + 1) + col]
+         value = (value << 1) | (left > pixels[row * (DHASH_SIZE + 1) +
+                                               col + 1])
+   return value, size
+
+def hamming(a, b):
+   """How many bits a and b differ in"""
+   return bin(a ^ b).count('1')
+
+class HashIndex(object):
+   """Finds every hash within distance bits of a DHASH_BITS bit hash
+      without looking at the rest (multi-index hashing).
+
+      Each hash is cut into distance + 1 pieces and each piece position
+      gets its own dict.  Two hashes within distance bits of each other
+      must agree exactly on at least one piece, so a search only compares
+      the hashes that share a piece with the one looked for: a dict lookup
+      per piece and a few dozen comparisons, however big the index."""
+
+   def __init__(self, distance):
+      self.distance = distance
+      count = distance + 1
+      self.pieces = [(DHASH_BITS * i // count,
+                      (1 << (DHASH_BITS * (i + 1) // count -
+                             DHASH_BITS * i // count)) - 1)
+                     for i in range(count)]
+      self.tables = [{} for _ in self.pieces]
+
+   def add(self, value, item):
+      for (shift, mask), table in zip(self.pieces, self.tables):
+         table.setdefault((value >> shift) & mask, []).append((value, item))
+
+   def search(self, value):
+      """(bits, item) for everything within distance bits of value,
+         closest first"""
+      found = {}
+      for (shift, mask), table in zip(self.pieces, self.tables):
+         for other, item in table.get((value >> shift) & mask, ()):
+            if item not in found:
+               bits = hamming(value, other)
+               if bits <= self.distance:
+                  found[item] = bits
+      return sorted((bits, item) for item, bits in found.items())
+
+class DuplicateIndex(object):
+   """Perceptual hashes (image_dhash) of the sources a batch has split, kept
+      in a JSON lines file, so copies of a picture that have been
+      re-encoded or resized are only split once.
+
+      Each line records a source, its hash and size, and for a
+      near-duplicate the source it is a copy of and how many bits apart
+      they are.  The last line for a source wins.  A source is a
+      near-duplicate of one split before if their hashes are within
+      opts.dedupe_distance bits, they have the same shape and that source's
+      tiles for monitors are still there (or it is being split in this
+      same run and has not failed).  Near-duplicates are skipped; with
+      opts.dedupe_link the tiles of the original are linked under their
+      names at the end by settle(), which also hands back the ones whose
+      original failed so they can be split after all."""
+
+   def __init__(self, filename, monitors, opts):
+      self.filename = os.path.expanduser(filename)
+      self.monitors = monitors
+      self.opts = opts
+      self.index = HashIndex(opts.dedupe_distance)
+      self.records = {}
+      self.fresh = set()
+      # Originals that failed to split this run
+      self.failed = set()
+      self.pending = []
+      self.skipped = 0
+      clean_end = True
+      try:
+         with open(self.filename, 'r') as f:
+            for line in f:
+               clean_end = line.endswith('\n')
+               try:
+                  record = json.loads(line)
+                  record['dhash'] = int(record['dhash'], 16)
+                  self.records[record['source']] = record
+               except (ValueError, KeyError, TypeError):
+                  Logger.debug("Ignoring bad dedupe index line: %s",
+                               line.strip())
+      except FileNotFoundError:
+         pass
+      for source, record in self.records.items():
+         if 'duplicate_of' not in record:
+            self.index.add(record['dhash'], source)
+      self.file = open(self.filename, 'a')
+      if not clean_end:
+         self.file.write('\n')
+
+   def tiles(self, source):
+      return [output_filename(source, monitor, self.opts.output_format)
+              for monitor in self.monitors]
+
+   def original_of(self, source, value, size):
+      """The (bits, original) source is a near-duplicate of, or None"""
+      for _, original in self.index.search(value):
+         record = self.records[original]
+         # The index also has the hashes later lines replaced
+         bits = hamming(record['dhash'], value)
+         if original == source or 'duplicate_of' in record or \
+            original in self.failed or bits > self.opts.dedupe_distance:
+            continue
+         width, height = record['size']
+         if abs(float(width) / height - float(size[0]) / size[1]) > \
+            DEDUPE_ASPECT_TOLERANCE * float(width) / height:
+            continue
+         if original in self.fresh or \
+            all(os.path.isfile(tile) for tile in self.tiles(original)):
+            return bits, original
+      return None
+
+   def write(self, record):
+      previous = self.records.get(record['source'])
+      self.records[record['source']] = record
+      if previous is not None and \
+         all(previous.get(key) == record.get(key)
+             for key in ('dhash', 'size', 'duplicate_of')):
+         return
+      line = dict(record, dhash="{0:016x}".format(record['dhash']),
+                  time=round(time.time(), 3))
+      self.file.write(json.dumps(line) + '\n')
+      self.file.flush()
+
+   def is_duplicate(self, image):
+      """Is image a near-duplicate of a source already split?  If not it
+         is added to the index as one that is about to be."""
+      start = time.monotonic()
+      hashed = image_dhash(image)
+      if hashed is None:
+         # Let the split complain about it
+         return False
+      value, size = hashed
+      source = os.path.abspath(image)
+      found = self.original_of(source, value, size)
+      if Logger.isEnabledFor(logging.DEBUG):
+         Logger.debug("Hashed %s in %s seconds", image,
+                      time.monotonic() - start)
+      record = {"source": source, "dhash": value, "size": size}
+      if found is None:
+         previous = self.records.get(source)
+         if previous is None or previous['dhash'] != value or \
+            'duplicate_of' in previous:
+            self.index.add(value, source)
+         self.write(record)
+         self.fresh.add(source)
+         return False
+
+      bits, original = found
+      record['duplicate_of'] = original
+      record['distance'] = bits
+      self.write(record)
+      self.skipped += 1
+      self.pending.append((image, original))
+      if not self.opts.quiet:
+         print("Near-duplicate:", image, "of", original,
+               "(" + str(bits) + " bits apart)")
+      return True
+
+   def unique(self, images):
+      """Yield the images that are not near-duplicates"""
+      for image in images:
+         if not self.is_duplicate(image):
+            yield image
+
+   def forget(self, images):
+      """Stop taking images, which failed to split, for originals"""
+      for image in images:
+         source = os.path.abspath(image)
+         self.fresh.discard(source)
+         self.failed.add(source)
+
+   def settle(self, failures=()):
+      """Sort out the near-duplicates found since the last call, forgetting
+         the originals in failures first.  With opts.dedupe_link the tiles
+         of their originals are linked under their names.  Returns the
+         near-duplicates whose original failed or has no tiles to link,
+         which need splitting after all: unique() now lets the first of
+         each bunch through as the new original."""
+      self.forget(failures)
+      retry = []
+      pending, self.pending = self.pending, []
+      for image, original in pending:
+         if original in self.failed:
+            retry.append(image)
+            continue
+         if not self.opts.dedupe_link:
+            continue
+         tiles = self.tiles(original)
+         if not all(os.path.isfile(tile) for tile in tiles):
+            print("WARNING: Not linking", image, "-", original,
+                  "has no tiles", file=sys.stderr)
+            self.forget([original])
+            retry.append(image)
+            continue
+         for monitor, tile in zip(self.monitors, tiles):
+            linked = image[:image.rfind('.')] + monitor['suffix'] + \
+                     tile[tile.rfind('.'):]
+            if os.path.exists(linked) and os.path.samefile(linked, tile):
+               continue
+            log_debug("Linking", linked, "to", tile)
+            link_or_copy(tile, linked)
+      self.skipped -= len(retry)
+      return retry
+
+   def clusters(self):
+      """Every source with near-duplicates, mapped to a list of them and
+         how many bits apart they are"""
+      clusters = {}
+      for source, record in sorted(self.records.items()):
+         if 'duplicate_of' in record:
+            clusters.setdefault(record['duplicate_of'], []).append(
+               {"source": source, "distance": record['distance']})
+      return clusters
+
+   def write_report(self, filename):
+      """Write the clusters as JSON to filename"""
+      with open(os.path.expanduser(filename), 'w') as f:
+         json.dump({"clusters": self.clusters()}, f, indent=1,
+                   sort_keys=True)
+
+   def close(self):
+      self.file.close()
+
+def with_retries(opts, image, func, *args, **kwds):
+   """Return func(*args, **kwds).  If it raises, try again up to
+      opts.retries more times, waiting opts.retry_delay seconds before the
+      first retry and twice as long before each one after that.  image is
+      what the warnings are about."""
+   delay = opts.retry_delay
+   for attempt in range(opts.retries):
+      try:
+         return func(*args, **kwds)
+      except Exception as e:
+         print("WARNING: Unable to split", image + ":", repr(e) + ".",
+               "Trying again in", delay, "seconds", file=sys.stderr)
+         time.sleep(delay)
+         delay *= 2
+   return func(*args, **kwds)
+
+class TileEncoder(object):
+   """Encode and write tiles on a pool of threads.
+
+      Pillow drops the GIL while it encodes so the tiles of one image can
+      be written while the next one is cropped and resized.  At most two
+      tiles per thread are queued up, after that save() blocks, so memory
+      stays bounded no matter how far ahead the producer gets.  settings
+      are the encoder settings to write them with.
+
+      The tiles still to be written are counted per image so when_done()
+      can say when all of an image's are on disk."""
+
+   def __init__(self, threads, settings=None):
+      self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+      self.settings = settings
+      self.slots = threading.BoundedSemaphore(threads * 2)
+      self.lock = threading.Lock()
+      self.failures = []
+      self.outstanding = {}
+      self.errors = {}
+      self.callbacks = {}
+
+   def save(self, image, tile, filename):
+      """Queue tile up to be written to filename.  image is the source it
+         came from and is what gets reported if the write fails."""
+      self.slots.acquire()
+      with self.lock:
+         self.outstanding[image] = self.outstanding.get(image, 0) + 1
+      try:
+         self.pool.submit(self._save, image, tile, filename)
+      except BaseException:
+         self.slots.release()
+         self._written(image)
+         raise
+
+   def _save(self, image, tile, filename):
+      try:
+         with trace_span("encode", image) as span:
+            span.count('bytes_written',
+                       store_tile(tile, filename, self.settings))
+      except Exception:
+         print("ERROR: Unable to write", filename, file=sys.stderr)
+         error = traceback.format_exc()
+         with self.lock:
+            self.failures.append((image, filename, error))
+            self.errors.setdefault(image, error)
+      finally:
+         self.slots.release()
+         self._written(image)
+
+   def _written(self, image):
+      with self.lock:
+         self.outstanding[image] -= 1
+         if self.outstanding[image] > 0:
+            return
+         del self.outstanding[image]
+         callback = self.callbacks.pop(image, None)
+         error = self.errors.pop(image, None)
+      if callback is not None:
+         callback(error)
+
+   def when_done(self, image, callback):
+      """Call callback once every tile queued for image so far has been
+         written, on whichever thread writes the last one (or this one if
+         they already are).  It is passed the traceback of the first tile
+         that could not be written, or None."""
+      with self.lock:
+         if image in self.outstanding:
+            self.callbacks[image] = callback
+            return
+         error = self.errors.pop(image, None)
+      callback(error)
+
+   def close(self):
+      """Wait for every queued tile to be written.  Returns a list of
+         (image, filename, traceback) for the ones that could not be."""
+      self.pool.shutdown(wait=True)
+      return self.failures
+
+def tile_suffixes(monitors, monitor_files=()):
+   """The suffixes our own outputs can end in: those of monitors, the
+      preview's, and those of every monitor definition next to the
+      monitor_files (see parse_monitors) or in DEFAULT_MONITOR_DIR, as
+      they are named split on their own or with other layouts.  Tiles
+      left by an earlier run with another layout are then not taken for
+      images to split."""
+   suffixes = set(monitor['suffix'] for monitor in monitors)
+   suffixes.add(PREVIEW_SUFFIX)
+   directories = set([DEFAULT_MONITOR_DIR])
+   for monitor_file in monitor_files:
+      real_file = os.path.expanduser(monitor_file)
+      directories.add(real_file if os.path.isdir(real_file)
+                      else os.path.dirname(real_file) or os.curdir)
+   for directory in directories:
+      try:
+         names = [name for name in os.listdir(directory)
+                  if name.endswith('.json')]
+      except OSError:
+         continue
+      for name in names:
+         try:
+            with open(os.path.join(directory, name), 'r') as f:
+               definition = json.load(f)
+            for monitor in definition['monitors']:
+               suffixes.add(monitor['suffix'])
+               suffixes.add("_" + name[:-len('.json')] + monitor['suffix'])
+         except (OSError, ValueError, KeyError, TypeError) as e:
+            Logger.debug("No tile suffixes from %s: %s", name, e)
+   return sorted((suffix for suffix in suffixes
+                  if isinstance(suffix, str) and suffix), key=len,
+                 reverse=True)
+
+def is_tile(suffixes, path):
+   """Is path one of our own outputs?  It is if it ends in one of the
+      suffixes (see tile_suffixes) and the image it came from is sitting
+      next to it.  With --output-format that image can have any
+      extension."""
+   dot = path.rfind('.')
+   stem, ext = path[:dot], path[dot:]
+   extensions = Image.registered_extensions()
+   for suffix in suffixes:
+      if not stem.endswith(suffix):
+         continue
+      source = stem[:-len(suffix)]
+      if os.path.isfile(source + ext):
+         return True
+      for other in glob.iglob(glob.escape(source) + '.*'):
+         if (other[len(source):].lower() in extensions and
+             os.path.isfile(other)) or is_raw_capture(other):
+            return True
+   return False
+
+def is_split_candidate(suffixes, path):
+   """Should a file found in a directory or by a glob be split?"""
+   if path.rfind('.') <= path.rfind(os.sep):
+      return False
+   if path[path.rfind('.'):].lower() not in Image.registered_extensions() \
+      and not is_raw_capture(path):
+      return False
+   return os.path.isfile(path) and not is_tile(suffixes, path)
+
+def iter_images(suffixes, img_files):
+   """Yield the images to split named by img_files.  Directories are walked
+      recursively and glob patterns expanded as we go, so the first image
+      is handed out before the rest have been found.  Anything found this
+      way that is not an image, or is one of our own tiles (ending in one
+      of the suffixes, see tile_suffixes), is skipped.  Plain file names
+      are always passed through as given."""
+   seen = set()
+   Image.init()
+   for img_file in img_files:
+      path = os.path.expanduser(img_file)
+      if os.path.isdir(path):
+         found = walk_images(path)
+      elif glob.has_magic(path):
+         found = glob.iglob(path, recursive=True)
+      else:
+         yield img_file
+         continue
+      for image in found:
+         if image in seen or not is_split_candidate(suffixes, image):
+            continue
+         seen.add(image)
+         yield image
+
+def walk_images(directory):
+   """Yield every file under directory in a stable order"""
+   for root, dirs, files in os.walk(directory):
+      dirs.sort()
+      for name in sorted(files):
+         yield os.path.join(root, name)
+
+def inotify_watch(directories):
+   """Watch directories (and everything under them) with inotify.  Returns
+      a generator yielding the path of each file once it has been written
+      or moved in.  Raises OSError if inotify is not available."""
+   libc = ctypes.CDLL(None, use_errno=True)
+   if not hasattr(libc, 'inotify_init1'):
+      raise OSError("inotify is not available")
+   fd = libc.inotify_init1(os.O_CLOEXEC)
+   if fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+   watches = {}
+   mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+   def add_watches(directory):
+      for root, _, _ in os.walk(directory):
+         wd = libc.inotify_add_watch(fd, os.fsencode(root), mask)
+         if wd < 0:
+            print("WARNING: Unable to watch", root, file=sys.stderr)
+         else:
+            watches[wd] = root
+
+   for directory in directories:
+      add_watches(directory)
+
+   def events():
+      header = struct.Struct('iIII')
+      try:
+         while True:
+            data = os.read(fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+               wd, event, _, length = header.unpack_from(data, offset)
+               name = data[offset + header.size:
+                           offset + header.size + length].rstrip(b'\0')
+               offset += header.size + length
+               if event & IN_Q_OVERFLOW:
+                  print("WARNING: Missed some file events", file=sys.stderr)
+                  continue
+               if wd not in watches:
+                  continue
+               path = os.path.join(watches[wd], os.fsdecode(name))
+               if event & IN_ISDIR:
+                  # A new directory.  Watch it and pick up anything that
+                  # landed in it before the watch was in place.
+                  add_watches(path)
+                  for found in walk_images(path):
+                     yield found
+               elif event & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                  yield path
+      finally:
+         os.close(fd)
+   return events()
+
+def poll_watch(directories, interval):
+   """Poll directories every interval seconds.  Yields the path of each
+      new or changed file once its size and modification time have held
+      still between two polls, so half written files are not picked up."""
+   def scan():
+      found = {}
+      for directory in directories:
+         for path in walk_images(directory):
+            try:
+               st = os.stat(path)
+            except OSError:
+               continue
+            found[path] = (st.st_size, st.st_mtime)
+      return found
+
+   done = scan()
+   previous = done
+   while True:
+      time.sleep(interval)
+      current = scan()
+      for path, stamp in current.items():
+         if done.get(path) != stamp and previous.get(path) == stamp:
+            done[path] = stamp
+            yield path
+      previous = current
+
+def watch_images(monitors, opts, plan, manifest=None, dedupe=None):
+   """Split new images as they appear under the directories in
+      opts.img_file until interrupted.  Returns the images that failed."""
+   directories = [os.path.expanduser(f) for f in opts.img_file
+                  if os.path.isdir(os.path.expanduser(f))]
+   try:
+      events = inotify_watch(directories)
+   except OSError as e:
+      log_debug("Falling back to polling:", e)
+      events = poll_watch(directories, opts.poll_interval)
+
+   if not opts.quiet:
+      print("Watching", ", ".join(directories), "for new images")
+   suffixes = tile_suffixes(monitors, opts.monitor)
+   failures = []
+   processed = 0
+   try:
+      for image in events:
+         if not is_split_candidate(suffixes, image):
+            continue
+         if manifest is not None and manifest.is_done(image):
+            continue
+         # Split after all if its original turns out to have no tiles
+         if dedupe is not None and dedupe.is_duplicate(image) and \
+            (not dedupe.settle() or dedupe.is_duplicate(image)):
+            continue
+         if not opts.quiet:
+            print("Processing: ", image)
+         failed = len(failures)
+         split_and_record(monitors, opts, image, plan, manifest, failures)
+         if dedupe is not None:
+            dedupe.forget(failures[failed:])
+         processed += 1
+         if opts.cache_dir is not None and processed % 100 == 0:
+            cache_evict(opts)
+   except KeyboardInterrupt:
+      pass
+   return failures
+
+def split_and_record(monitors, opts, image, plan, manifest, failures):
+   """Split image, retrying if asked to, cache its tiles and add it to the
+      manifest (if there is one).  If it can't be split it is reported and
+      added to failures."""
+   start = time.monotonic()
+   error = None
+   try:
+      key = with_retries(opts, image, split_image, monitors, opts, image,
+                         plan=plan)
+      cache_store(monitors, opts, image, key)
+   except Exception:
+      error = traceback.format_exc()
+      print("ERROR: Unable to split", image, file=sys.stderr)
+      sys.stderr.write(error)
+      failures.append(image)
+   if manifest is not None:
+      manifest.record(monitors, image, time.monotonic() - start, error)
+
+def split_batch(monitors, opts, images, plan, manifest):
+   """Split the images the way opts says to.  Returns those that failed."""
+   if opts.jobs > 1:
+      return split_images_parallel(monitors, opts, images, manifest)
+   if opts.encode_threads > 0:
+      return split_images_pipelined(monitors, opts, images, plan, manifest)
+   failures = []
+   # Main iterator over the supplied image parameters
+   for image in images:
+      if not opts.quiet:
+         print("Processing: ", image)
+      split_and_record(monitors, opts, image, plan, manifest, failures)
+   return failures
+
+def split_images(monitors, opts):
+   """Split apart the images"""
+   global Tile_sink
+   images = iter_images(tile_suffixes(monitors, opts.monitor), opts.img_file)
+   plan = LayoutPlan(monitors, opts)
+   manifest = None
+   if opts.manifest is not None:
+      manifest = Manifest(opts.manifest, opts.output_format)
+      images = manifest.unfinished(images)
+   dedupe = None
+   if opts.dedupe_index is not None:
+      dedupe = DuplicateIndex(opts.dedupe_index, monitors, opts)
+      images = dedupe.unique(images)
+   if opts.sink != 'files':
+      Tile_sink = TILE_SINKS[opts.sink](opts.sink_file)
+   try:
+      failures = split_batch(monitors, opts, images, plan, manifest)
+
+      if manifest is not None and manifest.skipped and not opts.quiet:
+         print("Skipped", manifest.skipped, "images the manifest says are",
+               "already done")
+      if dedupe is not None:
+         # Only now are the originals' tiles all on disk
+         retry = dedupe.settle(failures)
+         while retry:
+            if not opts.quiet:
+               print("Splitting", len(retry), "near-duplicates of images",
+                     "that failed")
+            failed = split_batch(monitors, opts, dedupe.unique(retry), plan,
+                                 manifest)
+            failures += failed
+            retry = dedupe.settle(failed)
+         if dedupe.skipped and not opts.quiet:
+            print("Skipped", dedupe.skipped, "near-duplicates of images",
+                  "already split")
+      if opts.cache_dir is not None:
+         cache_evict(opts)
+      if opts.watch:
+         failures += watch_images(monitors, opts, plan, manifest, dedupe)
+      if Tile_sink is not None:
+         with trace_span("encode"):
+            Tile_sink.close()
+         if not opts.quiet:
+            print("Tiles written to", opts.sink_file)
+   except BaseException:
+      if Tile_sink is not None:
+         Tile_sink.abort()
+      raise
+   finally:
+      Tile_sink = None
+      if manifest is not None:
+         manifest.close()
+      if dedupe is not None:
+         if opts.dedupe_report is not None:
+            dedupe.write_report(opts.dedupe_report)
+         dedupe.close()
+   log_debug("Layout plan used", plan.hits, "times,", plan.misses,
+             "source sizes compiled")
+   return failures
+
+def split_image_loaded(monitors, opts, image, loaded, encoder, plan):
+   """split_image for an image load_image may already be running for.
+      loaded is an iterator over the Future of that load.  The first call
+      uses it up; a retry after that loads the image again itself."""
+   loading = next(loaded, None)
+   if loading is not None:
+      source = loading.result()
+   else:
+      source = load_image(monitors, opts, image, plan)
+   if source is None:
+      return None
+   return split_image(monitors, opts, image, source=source, encoder=encoder)
+
+def split_images_pipelined(monitors, opts, images, plan, manifest=None):
+   """Split apart the images with decode, crop/resize and encode running
+      at the same time.
+
+      The next image is opened and decoded on a background thread while
+      the current one is cropped and resized on this one, and the tiles
+      are handed to a TileEncoder to be written.  Only one image is
+      decoded ahead so at most two sources are in memory at once."""
+   failures = []
+
+   def written(image, key, start, error):
+      # Record the image as soon as its tiles are on disk, so a crash
+      # later in the batch doesn't lose it
+      if error is None:
+         cache_store(monitors, opts, image, key)
+      if manifest is not None:
+         manifest.record(monitors, image, time.monotonic() - start, error)
+
+   encoder = TileEncoder(opts.encode_threads, opts.encoder_settings)
+   images = iter(images)
+   image = next(images, None)
+   with concurrent.futures.ThreadPoolExecutor(max_workers=1) as decoder:
+      if image is not None:
+         next_source = decoder.submit(load_image, monitors, opts, image,
+                                      plan)
+      while image is not None:
+         loading = next_source
+         following = next(images, None)
+         if following is not None:
+            next_source = decoder.submit(load_image, monitors, opts,
+                                         following, plan)
+         if not opts.quiet:
+            print("Processing: ", image)
+         start = time.monotonic()
+         try:
+            key = with_retries(opts, image, split_image_loaded, monitors,
+                               opts, image, iter([loading]), encoder, plan)
+            encoder.when_done(image, functools.partial(written, image, key,
+                                                       start))
+         except Exception:
+            error = traceback.format_exc()
+            print("ERROR: Unable to split", image, file=sys.stderr)
+            sys.stderr.write(error)
+            failures.append(image)
+            if manifest is not None:
+               manifest.record(monitors, image, time.monotonic() - start,
+                               error)
+         image = following
+
+   for image, filename, error in encoder.close():
+      sys.stderr.write(error)
+      if image not in failures:
+         failures.append(image)
+   return failures
+
+def init_worker(log_level, max_image_pixels, bomb_pixels, monitors, opts,
+                tracing, collect=False):
+   """Process pool initializer.  Carry the verbosity and the image size
+      limit over to the worker since it will not have run parse_cmdline,
+      and compile the layout once for every image the worker splits.  If
+      tracing, the worker collects its TraceEvents for the parent to hand
+      to its own hooks.  If collect, so it does with the tiles, for the
+      parent's --sink."""
+   global Worker_plan, Tile_sink, Bomb_pixels
+   set_log_level(log_level)
+   Image.MAX_IMAGE_PIXELS = max_image_pixels
+   Bomb_pixels = bomb_pixels
+   Worker_plan = LayoutPlan(monitors, opts)
+   Trace_hooks[:] = [Worker_events.append] if tracing else []
+   # Not the parent's, whatever fork left behind
+   Tile_sink = CollectSink() if collect else None
+
+def split_image_worker(monitors, opts, image):
+   """Run split_image in a worker process.  Everything split_image prints
+      is captured and handed back so the parent can print it in input
+      order instead of interleaving the output of all the workers.
+
+      Returns (output, error, elapsed_seconds, trace_events, tiles).  error
+      is None on success, otherwise the formatted traceback.  tiles are the
+      (filename, data) of the tiles if they go to a --sink."""
+   start = time.monotonic()
+   del Worker_events[:]
+   buf = io.StringIO()
+   saved_stdout = sys.stdout
+   sys.stdout = buf
+   error = None
+   encoder = None
+   if opts.encode_threads > 0:
+      encoder = TileEncoder(opts.encode_threads, opts.encoder_settings)
+   try:
+      key = with_retries(opts, image, split_image, monitors, opts, image,
+                         encoder=encoder, plan=Worker_plan)
+   except BaseException:
+      # sys.exit() lands here too.  Report it rather than killing the worker.
+      error = traceback.format_exc()
+   finally:
+      if encoder is not None:
+         write_errors = [e for _, _, e in encoder.close()]
+         if write_errors and error is None:
+            error = "".join(write_errors)
+      if error is None:
+         cache_store(monitors, opts, image, key)
+      sys.stdout = saved_stdout
+   tiles = []
+   if Tile_sink is not None:
+      tiles = Tile_sink.take()
+   return buf.getvalue(), error, time.monotonic() - start, \
+          list(Worker_events), tiles if error is None else []
+
+def report_split_result(monitors, opts, image, result, failures, manifest):
+   """Print what a worker did for image, remember it if it failed and add
+      it to the manifest.  Returns how long the worker spent on it."""
+   output, error, elapsed, events, tiles = result
+   for event in events:
+      for hook in Trace_hooks:
+         hook(event)
+   for filename, data in tiles:
+      Tile_sink.add_data(filename, data)
+   if not opts.quiet:
+      print("Processing: ", image)
+   sys.stdout.write(output)
+   if error is not None:
+      print("ERROR: Unable to split", image, file=sys.stderr)
+      sys.stderr.write(error)
+      failures.append(image)
+   if manifest is not None:
+      manifest.record(monitors, image, elapsed, error)
+   log_debug("Split", image, "in", elapsed, "seconds")
+   return elapsed
+
+def worker_pool(monitors, opts):
+   """The pool of opts.jobs worker processes split_images_parallel uses"""
+   return concurrent.futures.ProcessPoolExecutor(
+      max_workers=opts.jobs, initializer=init_worker,
+      initargs=(Logger.level, Image.MAX_IMAGE_PIXELS, Bomb_pixels, monitors,
+                opts, bool(Trace_hooks), Tile_sink is not None))
+
+def split_images_parallel(monitors, opts, images, manifest=None):
+   """Split apart the images using a pool of opts.jobs worker processes.
+
+      Only a bounded number of images are in flight at any time so memory
+      use stays proportional to opts.jobs and not to the number of images.
+      Results are reported in the order the images were given regardless
+      of which worker finishes first.
+
+      If a worker dies (killed for running out of memory, say) the pool
+      is started again and the images that were in flight are each run
+      again on their own, so only the one that takes its worker down with
+      it is reported as failed and the rest of the batch carries on."""
+   # Two per worker keeps every worker busy while the parent is printing.
+   max_in_flight = opts.jobs * 2
+   pending = collections.deque()
+   # In flight when a worker died, to run one at a time
+   suspects = collections.deque()
+   images = iter(images)
+   failures = []
+   processed = 0
+   busy = 0.0
+   start = time.monotonic()
+
+   def submit(image):
+      try:
+         return pool.submit(split_image_worker, monitors, opts, image)
+      except concurrent.futures.process.BrokenProcessPool as e:
+         # A worker already died, dealt with when it is this one's turn
+         future = concurrent.futures.Future()
+         future.set_exception(e)
+         return future
+
+   pool = worker_pool(monitors, opts)
+   try:
+      while True:
+         if suspects:
+            if not pending:
+               image = suspects.popleft()
+               pending.append((image, True, submit(image)))
+         elif len(pending) < max_in_flight:
+            image = next(images, None)
+            if image is not None:
+               pending.append((image, False, submit(image)))
+               continue
+         if not pending:
+            break
+
+         # Wait on the oldest to keep things in order
+         done_image, alone, future = pending.popleft()
+         try:
+            result = future.result()
+         except concurrent.futures.process.BrokenProcessPool as e:
+            pool.shutdown()
+            pool = worker_pool(monitors, opts)
+            if not alone:
+               # Any of them could have done it
+               suspects.extend([done_image] +
+                               [image for image, _, _ in pending])
+               pending.clear()
+               continue
+            result = ("", "A worker process died splitting it: " +
+                      str(e) + "\n", 0.0, [], [])
+         except Exception:
+            result = ("", traceback.format_exc(), 0.0, [], [])
+         busy += report_split_result(monitors, opts, done_image, result,
+                                     failures, manifest)
+         processed += 1
+   finally:
+      pool.shutdown()
+
+   if opts.quiet:
+      # Just what went wrong, where --quiet still lets errors through
+      for image in failures:
+         print("Failed:", image, file=sys.stderr)
+      return failures
+   elapsed = time.monotonic() - start
+   rate = processed / elapsed if elapsed > 0 else 0.0
+   speedup = busy / elapsed if elapsed > 0 else 0.0
+   print("")
+   print("Split", processed, "images in", "{0:.2f}s".format(elapsed),
+         "({0:.2f} images/s, {1:.1f}x speedup with".format(rate, speedup),
+         opts.jobs, "jobs);", len(failures), "failed")
+   for image in failures:
+      print("   Failed:", image)
+   return failures
+
+def calculate_padding(monitors, opts, output_layout, img_size):
+   """Calculate padding values for the 4 images of the monitors overlayed
+      onto the image based off what the user wants done."""
+
+   # Easy reference variables
+   img_width, img_height = img_size
+   scale_factor = output_layout['scale_factor']
+
+   # How much space is left to play with?
+   vert_remainder = int(img_height - (output_layout['monitor_height'] * scale_factor))
+   horz_remainder = int(img_width -  (output_layout['monitor_width'] * scale_factor))
+   log_debug("vertical_remainder:  ", vert_remainder)
+   log_debug("horizontal_remainder:", horz_remainder)
+
+   if opts.left:
+      # All pixels from the left!
+      left_padding = 0
+      right_padding = horz_remainder
+   elif opts.right:
+      # All pixels from the right!
+      left_padding = horz_remainder
+      right_padding = 0
+   elif opts.left_padding is not None:
+      if opts.left_padding <= horz_remainder:
+         left_padding = opts.left_padding
+         right_padding = horz_remainder - left_padding
+      else:
+         print("WARNING: left_padding value of", opts.left_padding,
+               "> padding pixels of", horz_remainder, "(ignoring)")
+         left_padding = int(horz_remainder / 2)
+         right_padding = left_padding
+   elif opts.right_padding is not None:
+      if opts.right_padding <= horz_remainder:
+         right_padding = opts.right_padding
+         left_padding = horz_remainder - right_padding
+      else:
+         print("WARNING: right_padding value of", opts.right_padding,
+               "> padding pixels of", horz_remainder, "(ignoring)")
+         left_padding = int(horz_remainder / 2)
+         right_padding = left_padding
+   else:
+      # Center it
+      left_padding = int(horz_remainder / 2)
+      right_padding = left_padding
+
+   if opts.top:
+      # All pixels from the top!
+      top_padding = 0
+      bottom_padding = vert_remainder
+   elif opts.bottom:
+      # All pixels from the bottom!
+      top_padding = vert_remainder
+      bottom_padding = 0
+   elif opts.top_padding is not None:
+      if opts.top_padding <= vert_remainder:
+         top_padding = opts.top_padding
+         bottom_padding = vert_remainder - top_padding
+      else:
+         print("WARNING: top_padding value of", opts.top_padding,
+               "> padding pixels of", vert_remainder, "(ignoring)")
+         top_padding = int(vert_remainder / 2)
+         bottom_padding = top_padding
+   elif opts.bottom_padding is not None:
+      if opts.bottom_padding <= vert_remainder:
+         bottom_padding = opts.bottom_padding
+         top_padding = vert_remainder - bottom_padding
+      else:
+         print("WARNING: bottom_padding value of", opts.bottom_padding,
+               "> padding pixels of", vert_remainder, "(ignoring)")
+         top_padding = int(vert_remainder / 2)
+         bottom_padding = top_padding
+   else:
+      #Center it
+      top_padding = int(vert_remainder / 2)
+      bottom_padding = top_padding
+
+   log_debug("left_padding:", left_padding)
+   log_debug("right_padding:", right_padding)
+   log_debug("top_padding:", top_padding)
+   log_debug("bottom_padding:", bottom_padding)
+   return left_padding, right_padding, top_padding, bottom_padding
+
+class EnergyMap(object):
+   """Where the detail in a source is, for --auto-position.
+
+      The source is shrunk to about ENERGY_SIZE pixels on its longest side
+      and the gradient magnitude (|Sobel x| + |Sobel y|) of that is kept as
+      a summed area table, so the detail inside any box is four lookups."""
+
+   SOBEL_X = ImageFilter.Kernel((3, 3), [-1, 0, 1, -2, 0, 2, -1, 0, 1],
+                                scale=8, offset=128)
+   SOBEL_Y = ImageFilter.Kernel((3, 3), [-1, -2, -1, 0, 0, 0, 1, 2, 1],
+                                scale=8, offset=128)
+   MAGNITUDE = [abs(value - 128) for value in range(256)]
+
+   def __init__(self, img, img_size):
+      factor = max(1, max(img.size) // ENERGY_SIZE)
+      if isinstance(img, MappedImage):
+         thumb = img.reduce(factor).convert('L')
+      else:
+         # Averaging 4x4 samples per cell is plenty to find the detail and
+         # far quicker than averaging every pixel
+         step = min(factor, 4)
+         thumb = img.resize((max(1, img.size[0] // factor * step),
+                             max(1, img.size[1] // factor * step)),
+                            Image.Resampling.NEAREST)
+         thumb = thumb.convert('L').reduce(step)
+      edges = ImageChops.add(thumb.filter(self.SOBEL_X).point(self.MAGNITUDE),
+                             thumb.filter(self.SOBEL_Y).point(self.MAGNITUDE))
+      # The filters leave the outermost pixels as they were, not an edge
+      energy = Image.new('L', edges.size)
+      energy.paste(edges.crop((1, 1, edges.size[0] - 1, edges.size[1] - 1)),
+                   (1, 1))
+      self.width, self.height = energy.size
+      # Map full size source pixels to the table
+      self.x_scale = float(self.width) / img_size[0]
+      self.y_scale = float(self.height) / img_size[1]
+
+      data = energy.tobytes()
+      row = [0] * (self.width + 1)
+      self.table = [row]
+      for y in range(self.height):
+         line = data[y * self.width:(y + 1) * self.width]
+         row = list(map(operator.add, row,
+                        itertools.accumulate(line, initial=0)))
+         self.table.append(row)
+
+   def total(self, box):
+      """The detail inside box, in full size source pixels"""
+      left = min(max(int(round(box[0] * self.x_scale)), 0), self.width)
+      upper = min(max(int(round(box[1] * self.y_scale)), 0), self.height)
+      right = min(max(int(round(box[2] * self.x_scale)), 0), self.width)
+      lower = min(max(int(round(box[3] * self.y_scale)), 0), self.height)
+      return self.table[lower][right] - self.table[upper][right] - \
+             self.table[lower][left] + self.table[upper][left]
+
+def auto_padding(monitors, opts, output_layout, img_size, energy,
+                 left_padding, top_padding):
+   """Slide the monitors over the image from left_padding, top_padding to
+      where they show the most of energy (an EnergyMap), counting detail
+      left behind the bezels against them.  Directions the padding
+      options fix stay put.  Returns the new left_padding, top_padding."""
+   scale_factor = output_layout['scale_factor']
+   layout_width = output_layout['monitor_width'] * scale_factor
+   layout_height = output_layout['monitor_height'] * scale_factor
+
+   def candidates(fixed, remainder, step, current):
+      if fixed or remainder <= 0:
+         return [current]
+      return sorted(set(list(range(0, remainder, step)) + [remainder]))
+
+   # One table cell at a time is as fine as the map can tell apart
+   lefts = candidates(opts.left or opts.right or
+                      opts.left_padding is not None or
+                      opts.right_padding is not None,
+                      int(img_size[0] - layout_width),
+                      max(1, int(1.0 / energy.x_scale)), left_padding)
+   tops = candidates(opts.top or opts.bottom or
+                     opts.top_padding is not None or
+                     opts.bottom_padding is not None,
+                     int(img_size[1] - layout_height),
+                     max(1, int(1.0 / energy.y_scale)), top_padding)
+
+   def score(left, top):
+      shown = sum(energy.total(crop_box(monitor, scale_factor, left, top))
+                  for monitor in monitors)
+      covered = energy.total((left, top, left + layout_width,
+                              top + layout_height))
+      return shown - BEZEL_PENALTY * (covered - shown)
+
+   start = score(left_padding, top_padding)
+   best = max(((score(left, top), left, top)
+               for left in lefts for top in tops),
+              key=lambda option: (option[0],
+                                  -abs(option[1] - left_padding) -
+                                  abs(option[2] - top_padding)))
+   if best[0] <= start + abs(start) * AUTO_POSITION_MARGIN:
+      Logger.debug("Auto position keeps %s", [left_padding, top_padding])
+      return left_padding, top_padding
+   Logger.debug("Auto position moves %s to %s for %s over %s",
+                [left_padding, top_padding], best[1:], best[0], start)
+   return best[1], best[2]
+
+def show_projection(monitors, output_layout, opts, image,
+                    img_width, img_height, left_padding, top_padding):
+   """Perform a few atrocities to show the user what the cropping will
+      approximately look like"""
+   # Make a fake monitor and use it.  Set the overall size of the monitor
+   # to the width and height of the background image.  This will generate
+   # a scale for us that tells us what scale factor we need to use to display
+   # everything on the terminal overlayed on the actual image.
+   fake_monitor = [{"name": "Background Image",
+                    "resolution": [img_width, img_height],
+                    "upper_left": [0,0]}]
+
+   # Subtrack one from the terminal width for axis room.
+   layout = calculate_scale(fake_monitor,
+                            output_width=get_terminal_width() - 1)
+
+   # Here is the fun part.  We have a scale factor for using with our image
+   # but now we want to show that scale factor to the user which means we
+   # need to scale our output scale factor by the terminal scale factor to
+   # make it display properly on the terminal.
+   layout['scale_factor'] = output_layout['scale_factor'] * layout['scale_factor']
+
+   # Our padding is also borked up because we need to handle that MONITOR_SCALE
+   # thing.  left and right padding is fine.  Scale the MONITOR_SCALE by
+   # the output scale and apply that to the padding.
+   top_padding = int(top_padding * (MONITOR_SCALE * output_layout['scale_factor']))
+   print("")
+   if 'layout' in monitors[0]:
+      print("Projection of", monitors[0]['layout'], "onto", image + ":")
+   else:
+      print("Projection of monitor definition file onto", image + ":")
+   display_layout(layout, monitors,
+                  left_padding=left_padding, top_padding=top_padding)
+
+def preview_thumbnail(img, mapped, width):
+   """Shrink img to width pixels across, or less if it is smaller.  Read
+      every few rows of mapped (what map_image gave for img, or None) if
+      we have it, otherwise let the decoder hand over a reduced image and
+      shrink that in place with Image.thumbnail.  Returns it in RGB."""
+   img_width, img_height = img.size
+   width = min(width, img_width)
+   size = (width, max(1, int(round(img_height * width / float(img_width)))))
+   if mapped is not None:
+      thumb = mapped.reduce(max(1, img_width // width)).convert('RGB')
+      thumb.thumbnail(size)
+      return thumb
+   img.draft('RGB', size)
+   img.thumbnail(size)
+   return img.convert('RGB')
+
+def preview_projection(thumb, boxes):
+   """The monitors outlined on thumb, darkening what none of them show.
+      boxes are the crop boxes scaled to thumb."""
+   projection = thumb.point(lambda value: value // 3)
+   draw = ImageDraw.Draw(projection)
+   for box in boxes:
+      projection.paste(thumb.crop(box), box[:2])
+      draw.rectangle([box[0], box[1], box[2] - 1, box[3] - 1],
+                     outline=PREVIEW_OUTLINE)
+   return projection
+
+def preview_desk(thumb, monitors, extremes, boxes, width):
+   """The monitors as they are arranged, width pixels across, each showing
+      its part of thumb.  boxes are the crop boxes scaled to thumb."""
+   scale = float(width) / extremes[0]
+   desk = Image.new('RGB', (width, max(1, int(round(extremes[1] * scale)))),
+                    PREVIEW_BACKGROUND)
+   draw = ImageDraw.Draw(desk)
+   for monitor, box in zip(monitors, boxes):
+      extent = monitor_extent(monitor)
+      left = int(round(monitor['upper_left'][0] * scale))
+      upper = int(round(monitor['upper_left'][1] * scale))
+      right = int(round((monitor['upper_left'][0] + extent[0]) * scale))
+      lower = int(round((monitor['upper_left'][1] + extent[1]) * scale))
+      size = (max(1, right - left), max(1, lower - upper))
+      desk.paste(thumb.crop(box).resize(size, Image.Resampling.BILINEAR),
+                 (left, upper))
+      draw.rectangle([left, upper, left + size[0] - 1, upper + size[1] - 1],
+                     outline=PREVIEW_BACKGROUND)
+      draw.text((left + 3, upper + 2), monitor['name'],
+                fill=PREVIEW_OUTLINE)
+   return desk
+
+def make_preview(img, monitors, opts, plan=None, image=None,
+                 width=PREVIEW_WIDTH):
+   """A quick look at how monitors fall across the opened image img, for
+      when the tiles would take too long to wait for: img with the
+      monitors outlined on it and under that the monitors as they are
+      arranged, each showing a low resolution version of its tile.  A
+      pair for every layout if plan (a LayoutPlan) has several.
+
+      The padding comes from plan the same way it does for the tiles, so
+      with --auto-position the tiles split later with that plan land where
+      the preview shows.  img is shrunk in place (see preview_thumbnail)
+      and is no good for splitting afterwards.  Returns the RGB preview,
+      width pixels across unless img is narrower."""
+   img_size = img.size
+   if plan is None:
+      plan = LayoutPlan(monitors, opts, max_sizes=1)
+   layouts = plan.layouts or [plan]
+   with trace_span("padding", image):
+      size_plans = [layout.for_size(*img_size) for layout in layouts]
+
+   with trace_span("decode", image):
+      mapped = img if isinstance(img, MappedImage) else None
+      if mapped is None and opts.mmap:
+         mapped = map_image(img)
+      # Where the tiles won't be auto positioned, see prepare_source
+      streamed = mapped is None and opts.strip_height > 0 and can_stream(img)
+      thumb = preview_thumbnail(img, mapped, width)
+      if mapped is not None and mapped is not img:
+         mapped.close()
+   x_scale = float(thumb.size[0]) / img_size[0]
+   y_scale = float(thumb.size[1]) / img_size[1]
+
+   if opts.auto_position and not streamed:
+      # The thumbnail is bigger than the EnergyMap needs anyway
+      with trace_span("padding", image):
+         size_plans = [layout.auto_position(
+                          size_plan, img_size, source_id(image),
+                          lambda: EnergyMap(thumb, img_size))
+                       for layout, size_plan in zip(layouts, size_plans)]
+
+   panels = []
+   for layout, size_plan in zip(layouts, size_plans):
+      boxes = [(int(round(box[0] * x_scale)), int(round(box[1] * y_scale)),
+                int(round(box[2] * x_scale)), int(round(box[3] * y_scale)))
+               for box in size_plan.boxes]
+      panels.append(preview_projection(thumb, boxes))
+      panels.append(preview_desk(thumb, layout.monitors, layout.extremes,
+                                 boxes, thumb.size[0]))
+   preview = Image.new('RGB', (thumb.size[0],
+                               sum(panel.size[1] for panel in panels) +
+                               PREVIEW_MARGIN * (len(panels) - 1)),
+                       PREVIEW_BACKGROUND)
+   top = 0
+   for panel in panels:
+      preview.paste(panel, (0, top))
+      top += panel.size[1] + PREVIEW_MARGIN
+   return preview
+
+def write_preview(monitors, opts, image, plan=None):
+   """Write the make_preview of image next to it as <image>_preview.png.
+      Returns the file name or None if image could not be opened."""
+   with trace_span("open", image):
+      img = open_image(image)
+   if img is None:
+      return None
+   try:
+      preview = make_preview(img, monitors, opts, plan, image,
+                             opts.preview_width)
+   finally:
+      img.close()
+   filename = output_filename(image, {"suffix": PREVIEW_SUFFIX}, 'PNG')
+   with trace_span("encode", image) as span:
+      # Small enough that compressing harder isn't worth the wait
+      preview.save(filename, 'PNG', compress_level=1)
+      span.count('bytes_written', os.path.getsize(filename))
+   if not opts.quiet:
+      print("Preview: ", filename)
+   return filename
+
+def choose_resample(target_width, source_width):
+   """Pick the resampling filter for going from source_width pixels to
+      target_width pixels.  Returns the filter and its name."""
+   if target_width < source_width:
+      # We are shrinking.  ANTIALIAS works better going down
+      return Image.Resampling.LANCZOS, "Resampling.LANCZOS"
+   return Image.BICUBIC, "BICUBIC"
+
+def filter_kernel(resample, x):
+   """Pillow's resampling filter resample evaluated at the distances x
+      (a NumPy array, in filter units) from the pixel centre"""
+   x = numpy.abs(x)
+   if resample == Image.Resampling.BILINEAR:
+      return numpy.where(x < 1.0, 1.0 - x, 0.0)
+   if resample == Image.Resampling.BICUBIC:
+      a = -0.5
+      return numpy.where(x < 1.0, ((a + 2.0) * x - (a + 3.0)) * x * x + 1.0,
+                         numpy.where(x < 2.0,
+                                     (((x - 5.0) * x + 8.0) * x - 4.0) * a,
+                                     0.0))
+   if resample == Image.Resampling.LANCZOS:
+      return numpy.where(x < 3.0, numpy.sinc(x) * numpy.sinc(x / 3.0), 0.0)
+   raise ValueError("No NumPy version of resampling filter " + str(resample))
+
+def resample_weights(in_size, out_size, resample):
+   """Work out the weights Pillow uses to resample in_size pixels to
+      out_size pixels along one axis.  Returns a list of blocks
+      (in_start, in_end, out_start, out_end, weights, margins): output
+      pixels out_start to out_end are the weights matrix times input
+      pixels in_start to in_end.  The weights are Pillow's fixed point
+      ones, whole multiples of 2 ** -RESAMPLE_PRECISION, which float32
+      holds exactly.  margins is how far a float32 sum of each output can
+      be from the exact one, 0 where the weights allow no error (see
+      EXACT_PRECISION).  See NUMPY_BLOCK."""
+   # Same as precompute_coeffs in Pillow's Resample.c
+   scale = float(in_size) / out_size
+   filterscale = max(scale, 1.0)
+   support = FILTER_SUPPORT[resample] * filterscale
+   centers = (numpy.arange(out_size) + 0.5) * scale
+   first = numpy.maximum(numpy.trunc(centers - support + 0.5),
+                         0).astype(int)
+   last = numpy.minimum(numpy.trunc(centers + support + 0.5),
+                        in_size).astype(int)
+
+   blocks = []
+   for out_start in range(0, out_size, NUMPY_BLOCK):
+      out_end = min(out_start + NUMPY_BLOCK, out_size)
+      in_start = int(first[out_start:out_end].min())
+      in_end = int(last[out_start:out_end].max())
+      taps = numpy.arange(in_start, in_end)[numpy.newaxis, :]
+      centre = centers[out_start:out_end, numpy.newaxis]
+      weights = filter_kernel(resample, (taps - centre + 0.5) / filterscale)
+      # Each output only uses the taps in its own window
+      inside = (taps >= first[out_start:out_end, numpy.newaxis]) & \
+               (taps < last[out_start:out_end, numpy.newaxis])
+      weights = numpy.where(inside, weights, 0.0)
+      total = weights.sum(axis=1, keepdims=True)
+      weights /= numpy.where(total == 0.0, 1.0, total)
+      # Rounded away from zero, as normalize_coeffs_8bpc does
+      weights *= 1 << RESAMPLE_PRECISION
+      weights = numpy.trunc(weights + numpy.where(weights < 0.0, -0.5, 0.5))
+      weights /= 1 << RESAMPLE_PRECISION
+      # Each of a row's taps is rounded twice, multiplied and added, by
+      # no more than 2 ** -24 of the biggest the sum could be.  Adding
+      # the half for rounding is out by another 2 ** -16 of a pixel at
+      # most.  Doubled to be safe.
+      margins = (255.0 * numpy.abs(weights).sum(axis=1, keepdims=True) *
+                 (weights != 0.0).sum(axis=1, keepdims=True) * 2.0 ** -23 +
+                 2.0 ** -16) * 2.0
+      exact = weights * (1 << EXACT_PRECISION)
+      margins[(exact == numpy.trunc(exact)).all(axis=1)] = 0.0
+      blocks.append((in_start, in_end, out_start, out_end,
+                     weights.astype(numpy.float32),
+                     margins.astype(numpy.float32)))
+   return blocks
+
+def resample_pass(pixels, blocks, out_size):
+   """Resample the first axis of the uint8 array pixels to out_size with
+      the weights blocks from resample_weights.  Every other axis (the
+      rows or columns and the channels) is flattened into one, so each
+      block is a single matrix product however many channels there are.
+      Rounds and clips the result to uint8 the way Pillow does after each
+      pass.
+
+      The products are float32, twice as fast as float64 and half the
+      memory.  Pillow sums in exact fixed point though, and float32 can
+      be out by enough to put a sum that lands (nearly) on a rounding
+      boundary on the wrong side of it.  The few sums that close are done
+      again in float64, which is exact for these weights, so the rounding
+      is Pillow's."""
+   shape = pixels.shape
+   pixels = numpy.ascontiguousarray(pixels, numpy.float32).reshape(
+      shape[0], -1)
+   out = numpy.empty((out_size, pixels.shape[1]), numpy.float32)
+   scratch = numpy.empty((NUMPY_BLOCK, pixels.shape[1]), numpy.float32)
+   for in_start, in_end, out_start, out_end, matrix, margins in blocks:
+      sums = out[out_start:out_end]
+      numpy.matmul(matrix, pixels[in_start:in_end], out=sums)
+      sums += 0.5
+      # How far from the nearest whole number, i.e. rounding boundary
+      distance = scratch[:out_end - out_start]
+      numpy.rint(sums, out=distance)
+      distance -= sums
+      numpy.abs(distance, out=distance)
+      close = numpy.flatnonzero(distance < margins)
+      numpy.floor(sums, out=sums)
+      if len(close):
+         rows, columns = numpy.divmod(close, sums.shape[1])
+         exact = numpy.einsum('ij,ji->i', matrix[rows].astype(numpy.float64),
+                              pixels[in_start:in_end, columns].astype(
+                                 numpy.float64))
+         sums[rows, columns] = numpy.floor(exact + 0.5)
+   numpy.clip(out, 0.0, 255.0, out=out)
+   return out.astype(numpy.uint8).reshape((out_size,) + shape[1:])
+
+def resize_numpy(img, size, resample, plan=None):
+   """img.resize(size, resample) done with NumPy.  The filter is applied
+      one axis at a time, each as a few matrix products over every row (or
+      column) and channel at once.  The weights come from plan (a
+      LayoutPlan) so they are only worked out once per size, or are worked
+      out here if there is no plan.
+
+      Like Pillow it goes across before down, with the same fixed point
+      weights and rounding to 8 bits in between, so the tiles are
+      Pillow's.  Only the filter itself is evaluated by NumPy instead of
+      C, which can move a weight by one unit in the last place and so a
+      pixel by one level, rarely."""
+   weights = plan.resample_weights if plan is not None else resample_weights
+   width, height = img.size
+   out_width, out_height = size
+   if out_width != width:
+      # Across first.  Pillow turns the image on its side faster than
+      # NumPy can, after which each column is a row of (height, channels)
+      pixels = numpy.asarray(img.transpose(Image.Transpose.TRANSPOSE))
+      pixels = resample_pass(pixels, weights(width, out_width, resample),
+                             out_width).swapaxes(0, 1)
+   else:
+      # (height, width) or (height, width, channels)
+      pixels = numpy.asarray(img)
+   if out_height != height:
+      pixels = resample_pass(pixels, weights(height, out_height, resample),
+                             out_height)
+   return Image.fromarray(numpy.ascontiguousarray(pixels))
+
+# Everything LayoutPlan works out for one source size
+SizePlan = collections.namedtuple('SizePlan', ['output_layout', 'left_padding',
+                                               'top_padding', 'boxes',
+                                               'filters'])
+
+class LayoutPlan(object):
+   """The monitor layout compiled for splitting lots of images.
+
+      The scale, padding, crop boxes and resample filters only depend on
+      the monitors, the padding options and the size of the source, so
+      they are worked out once per source size and remembered.  The
+      max_sizes most recently used sizes are kept.  Safe to share between
+      threads.
+
+      If monitors hold more than one layout (see parse_monitors) there is
+      a LayoutPlan per layout in layouts, otherwise layouts is None."""
+   __slots__ = ('monitors', 'opts', 'extremes', 'max_sizes', 'sizes',
+                'lock', 'hits', 'misses', 'layouts', 'weights', 'positions')
+
+   def __init__(self, monitors, opts, max_sizes=64):
+      self.monitors = monitors
+      self.opts = opts
+      self.layouts = None
+      groups = layout_groups(monitors)
+      if len(groups) > 1:
+         self.layouts = [LayoutPlan(group, opts, max_sizes)
+                         for _, group in groups]
+         self.extremes = None
+      else:
+         self.extremes = find_monitor_extremes(monitors)
+      self.max_sizes = max_sizes
+      self.sizes = collections.OrderedDict()
+      self.weights = collections.OrderedDict()
+      self.positions = collections.OrderedDict()
+      self.lock = threading.Lock()
+      self.hits = 0
+      self.misses = 0
+
+   def for_size(self, img_width, img_height):
+      """Return the SizePlan for a img_width x img_height source"""
+      key = (img_width, img_height)
+      with self.lock:
+         plan = self.sizes.get(key)
+         if plan is not None:
+            self.sizes.move_to_end(key)
+            self.hits += 1
+            return plan
+         self.misses += 1
+
+      plan = self.compile(img_width, img_height)
+      with self.lock:
+         self.sizes[key] = plan
+         while len(self.sizes) > self.max_sizes:
+            self.sizes.popitem(last=False)
+      return plan
+
+   def resample_weights(self, in_size, out_size, resample):
+      """resample_weights(), remembered for the monitors of the
+         max_sizes most recently used source sizes"""
+      key = (in_size, out_size, resample)
+      with self.lock:
+         blocks = self.weights.get(key)
+         if blocks is not None:
+            self.weights.move_to_end(key)
+            return blocks
+
+      blocks = resample_weights(in_size, out_size, resample)
+      with self.lock:
+         self.weights[key] = blocks
+         while len(self.weights) > self.max_sizes * len(self.monitors) * 2:
+            self.weights.popitem(last=False)
+      return blocks
+
+   def compile(self, img_width, img_height):
+      """Work out the SizePlan for a img_width x img_height source"""
+      # Figure out how we have to scale it to fit our monitors onto it
+      output_layout = calculate_scale(self.monitors,
+                                      output_width=img_width,
+                                      output_height=img_height,
+                                      extremes=self.extremes)
+
+      # Figure out our padding
+      left_padding, _, top_padding, _ = \
+         calculate_padding(self.monitors, self.opts, output_layout,
+                           (img_width, img_height))
+      return self.place(output_layout, left_padding, top_padding)
+
+   def place(self, output_layout, left_padding, top_padding):
+      """The SizePlan for the monitors at left_padding, top_padding"""
+      boxes = []
+      filters = []
+      for monitor in self.monitors:
+         box = crop_box(monitor, output_layout['scale_factor'],
+                        left_padding, top_padding)
+         boxes.append(box)
+         filters.append(choose_resample(monitor['resolution'][0],
+                                        box[2] - box[0]))
+      return SizePlan(output_layout, left_padding, top_padding, boxes,
+                      filters)
+
+   def auto_position(self, size_plan, img_size, source_id, energy):
+      """size_plan (from for_size) for an img_size source moved by
+         auto_padding.  energy is a function returning the EnergyMap of the
+         source, only called if the position is not remembered.  Positions
+         are remembered by source_id for the max_sizes most recent sources,
+         if it is not None."""
+      with self.lock:
+         position = self.positions.get(source_id)
+         if position is not None:
+            self.positions.move_to_end(source_id)
+      if position is None:
+         position = auto_padding(self.monitors, self.opts,
+                                 size_plan.output_layout, img_size,
+                                 energy(), size_plan.left_padding,
+                                 size_plan.top_padding)
+         if source_id is not None:
+            with self.lock:
+               self.positions[source_id] = position
+               while len(self.positions) > self.max_sizes:
+                  self.positions.popitem(last=False)
+      if position == (size_plan.left_padding, size_plan.top_padding):
+         return size_plan
+      return self.place(size_plan.output_layout, *position)
+
+def crop_box(monitor, scale_factor, left_padding, top_padding,
+             x_ratio=1.0, y_ratio=1.0):
+   """Return the [left, upper, right, lower] box monitor covers in the
+      source.  x_ratio and y_ratio are the size of the decoded source
+      relative to the full size one (see draft_image)."""
+   left = left_padding + int(monitor['upper_left'][0] * scale_factor)
+   upper = top_padding + int(monitor['upper_left'][1] * scale_factor)
+   extent = monitor_extent(monitor)
+   right = left + int(extent[0] * scale_factor)
+   lower = upper + int(extent[1] * scale_factor)
+   if x_ratio != 1.0 or y_ratio != 1.0:
+      left = int(round(left * x_ratio))
+      upper = int(round(upper * y_ratio))
+      right = int(round(right * x_ratio))
+      lower = int(round(lower * y_ratio))
+   return [left, upper, right, lower]
+
+def map_tiles(func, items, threads):
+   """Call func(idx, item) for each of items, on up to threads threads if
+      that is more than one.  The source they cut from is only read, and
+      Pillow lets go of the GIL while it crops, resizes and encodes, so
+      the tiles of one image come out about as many times faster.  Yields
+      (item, result) pairs in order, or as they finish if threaded."""
+   if threads <= 1 or len(items) <= 1:
+      for idx, item in enumerate(items):
+         yield item, func(idx, item)
+      return
+   with concurrent.futures.ThreadPoolExecutor(
+         max_workers=min(threads, len(items))) as pool:
+      futures = dict((pool.submit(func, idx, item), item)
+                     for idx, item in enumerate(items))
+      for future in concurrent.futures.as_completed(futures):
+         yield futures[future], future.result()
+
+def tile_threads_note(threads, count):
+   """How map_tiles went about count tiles, for the debug log"""
+   threads = min(threads, count)
+   if threads <= 1:
+      return "one at a time"
+   return "on " + str(threads) + " threads"
+
+def split_tiles(img, monitors, opts, boxes, filters=None, image=None,
+                memo=None, plan=None):
+   """Crop and resize img once per monitor.  boxes are the crop boxes for
+      each monitor and filters the (filter, name) to resize each with, or
+      None to pick them here.  image is the file img came from, for
+      tracing.  memo, if given, is a dict of tiles already made from img
+      by box and size to reuse and add to.  plan is the LayoutPlan that
+      keeps the weights for --resample-engine numpy.  Yields (monitor,
+      tile) pairs, as they are done with --tile-threads."""
+   use_numpy = opts.resample_engine == 'numpy' and img.mode in NUMPY_MODES
+
+   def cut(idx, monitor):
+      """The tile for monitor and how long resampling it took"""
+      # Break out each individual monitors crop from the main image.
+      left, upper, right, lower = boxes[idx]
+      if memo is not None:
+         key = ('tile', tuple(boxes[idx]), tuple(monitor['resolution']),
+                opts.crop_only)
+         if key in memo:
+            log_debug("Reusing the tile cut from", boxes[idx],
+                      "for another layout")
+            return memo[key], 0.0
+      if Logger.isEnabledFor(logging.DEBUG):
+         Logger.debug("Cropping image at: %s -> %s",
+                      [left, upper, right, lower],
+                      (right - left, lower - upper))
+      with trace_span("crop", image):
+         cropped_image = img.crop(box=[left,upper,right,lower])
+
+      # Scale if needed
+      resample_time = 0.0
+      if not opts.crop_only:
+         # Maybe we got lucky and don't need to do anything
+         if monitor['resolution'] != cropped_image.size:
+            if filters is not None:
+               alg, alg_name = filters[idx]
+            else:
+               alg, alg_name = choose_resample(monitor['resolution'][0],
+                                               cropped_image.size[0])
+            Logger.debug("Resizing %s image to: %s (%s)",
+                         cropped_image.size, monitor['resolution'], alg_name)
+            start = time.perf_counter()
+            with trace_span("resample", image) as span:
+               if use_numpy:
+                  resized_image = resize_numpy(cropped_image,
+                                               monitor['resolution'], alg,
+                                               plan)
+               else:
+                  resized_image = cropped_image.resize(
+                     monitor['resolution'], resample=alg)
+               span.count('pixels_resampled',
+                          resized_image.size[0] * resized_image.size[1])
+            resample_time = time.perf_counter() - start
+         else:
+            log_debug("Output image already in correct size.  Skipping resize")
+            resized_image = cropped_image
+      else:
+         resized_image = cropped_image
+      if memo is not None:
+         memo[key] = resized_image
+      return resized_image, resample_time
+
+   resample_time = 0.0
+   for monitor, (tile, seconds) in map_tiles(cut, monitors,
+                                             opts.tile_threads):
+      resample_time += seconds
+      yield monitor, tile
+   if Logger.isEnabledFor(logging.DEBUG):
+      Logger.debug("Resampled %s tiles %s in %s seconds", len(monitors),
+                   tile_threads_note(opts.tile_threads, len(monitors)),
+                   resample_time)
+
+def raw_row_bytes(mode, rawmode, width):
+   """How many bytes a row of width pixels takes up in rawmode.  None if
+      Pillow can not tell us."""
+   try:
+      return len(Image.new(mode, (width, 1)).tobytes('raw', rawmode))
+   except (ValueError, OSError):
+      return None
+
+def raw_tile_args(tile):
+   """Return (rawmode, stride, orientation) for a raw decoder tile"""
+   args = tile[3]
+   if not isinstance(args, tuple):
+      args = (args,)
+   args = tuple(args) + (0, 1)[len(args) - 1:]
+   return args[:3]
+
+def can_stream(img):
+   """Can img be decoded a strip at a time?  It can if it has not been
+      loaded yet and is either made up of several independently coded
+      tiles (TIFF strips and tiles) or is one big uncompressed tile (PPM,
+      BMP, uncompressed TIFF) we can read rows out of directly.  PNG and
+      JPEG are one compressed stream that Pillow can only decode in one
+      go, so they can not."""
+   if img.mode not in STRIP_MODES or not getattr(img, 'tile', None) or \
+      not hasattr(Image, '_getdecoder'):
+      return False
+   if len(img.tile) > 1:
+      return True
+   tile = img.tile[0]
+   if tile[0] != 'raw':
+      return False
+   rawmode, _, _ = raw_tile_args(tile)
+   return raw_row_bytes(img.mode, rawmode, tile[1][2] - tile[1][0]) \
+          is not None
+
+def is_raw_capture(path):
+   """Is path a headerless raw capture?  It is if Pillow does not know its
+      extension and it has a RAW_SIDECAR describing it."""
+   return path[path.rfind('.'):].lower() not in \
+          Image.registered_extensions() and \
+          os.path.isfile(path + RAW_SIDECAR)
+
+class MappedImage(object):
+   """An uncompressed source mapped into memory instead of decoded.
+
+      Stands in for the PIL Image as far as cropping goes.  crop() hands
+      Pillow a memoryview of the rows the box covers and Pillow reads the
+      pixels straight out of the page cache.  Modes Pillow stores the way
+      the file does (L, RGBA, CMYK, ...) are not copied at all until the
+      tile is resized or encoded; anything else (RGB, BGR) is unpacked once,
+      into the tile.  Nothing outside the crop boxes is ever touched."""
+
+   def __init__(self, fileno, mode, size, offset, rawmode, stride=0,
+                orientation=1, fmt=None):
+      self.mode = mode
+      self.size = size
+      self.format = fmt
+      self.offset = offset
+      self.rawmode = rawmode
+      self.orientation = orientation
+      self.pixel_bytes = raw_row_bytes(mode, rawmode, 1)
+      self.stride = stride or raw_row_bytes(mode, rawmode, size[0])
+      if self.offset + self.stride * size[1] > os.fstat(fileno).st_size:
+         raise ValueError("Image file is too short for its size")
+      self.map = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+   def load(self):
+      """Nothing to decode"""
+
+   def crop(self, box):
+      """The part of the image in box, as a PIL Image.  Like Image.crop
+         whatever is outside the image comes back black."""
+      left, upper, right, lower = box
+      width, height = self.size
+      inside = (max(left, 0), max(upper, 0), min(right, width),
+                min(lower, height))
+      if inside != tuple(box):
+         tile = Image.new(self.mode, (right - left, lower - upper))
+         if inside[0] < inside[2] and inside[1] < inside[3]:
+            tile.paste(self.crop(inside), (inside[0] - left,
+                                           inside[1] - upper))
+         return tile
+
+      if self.orientation < 0:
+         # Stored bottom up, so the box starts at its last row
+         first = height - lower
+      else:
+         first = upper
+      start = self.offset + first * self.stride + left * self.pixel_bytes
+      data = memoryview(self.map)[start:]
+      size = (right - left, lower - upper)
+      args = ('raw', self.rawmode, self.stride, self.orientation)
+      if len(data) >= size[1] * self.stride:
+         return Image.frombuffer(self.mode, size, data, *args)
+      # The last row of the file is short of a full stride after the box.
+      # Mapping it needs all of it, unpacking does not.
+      return Image.frombytes(self.mode, size, data, *args)
+
+   def resize(self, size, resample, box):
+      """Image.resize of the part of the image in box (floats allowed).
+         Only the pixels the filter reaches from inside box are read."""
+      reach = [FILTER_SUPPORT[resample] * max((box[2] - box[0]) / size[0],
+                                              1.0),
+               FILTER_SUPPORT[resample] * max((box[3] - box[1]) / size[1],
+                                              1.0)]
+      region = (max(int(math.floor(box[0] - reach[0])) - 1, 0),
+                max(int(math.floor(box[1] - reach[1])) - 1, 0),
+                min(int(math.ceil(box[2] + reach[0])) + 1, self.size[0]),
+                min(int(math.ceil(box[3] + reach[1])) + 1, self.size[1]))
+      return self.crop(region).resize(size, resample=resample,
+                                      box=(box[0] - region[0],
+                                           box[1] - region[1],
+                                           box[2] - region[0],
+                                           box[3] - region[1]))
+
+   def reduce(self, factor):
+      """A copy of the image factor times smaller each way, for a quick
+         look at it.  Unlike Image.reduce only every factor-th row is read,
+         the columns are averaged."""
+      rows = self.size[1] // factor
+      start = self.offset
+      if self.orientation < 0:
+         start += (self.size[1] - rows * factor) * self.stride
+      sample = Image.frombuffer(self.mode, (self.size[0], rows),
+                                memoryview(self.map)[start:], 'raw',
+                                self.rawmode, self.stride * factor,
+                                self.orientation)
+      return sample.reduce((factor, 1))
+
+   def close(self):
+      """Let go of the mapping.  Tiles still looking at it keep it alive."""
+      self.map = None
+
+def map_image(img):
+   """Map img into memory if it is one uncompressed block of pixels we can
+      crop straight out of (PPM/PGM, BMP, TGA, single strip TIFF).  Returns
+      a MappedImage or None."""
+   if img.mode not in STRIP_MODES or not getattr(img, 'tile', None) or \
+      len(img.tile) != 1 or img.tile[0][0] != 'raw' or \
+      tuple(img.tile[0][1]) != (0, 0) + img.size:
+      return None
+   rawmode, stride, orientation = raw_tile_args(img.tile[0])
+   pixel_bytes = raw_row_bytes(img.mode, rawmode, 1)
+   if pixel_bytes is None or pixel_bytes * 2 != \
+      raw_row_bytes(img.mode, rawmode, 2):
+      # Pixels that do not start on a byte boundary
+      return None
+   try:
+      fileno = img.fp.fileno()
+   except (AttributeError, OSError, ValueError):
+      # Not a file, e.g. split() handed bytes
+      return None
+   try:
+      return MappedImage(fileno, img.mode, img.size, img.tile[0][2],
+                         rawmode, stride, orientation, img.format)
+   except (OSError, ValueError) as e:
+      log_debug("Unable to map", img, "-", e)
+      return None
+
+def open_raw(image):
+   """Open the headerless raw capture image.  image + RAW_SIDECAR is a JSON
+      object giving its width and height and optionally its mode (default
+      RGB), rawmode (how the file stores that mode, default the same, e.g.
+      BGR), offset (bytes to skip at the start), stride (bytes from one row
+      to the next, default no padding) and orientation (-1 if the rows are
+      stored bottom up).  Returns a MappedImage."""
+   with open(image + RAW_SIDECAR, 'r') as f:
+      header = json.load(f)
+   mode = header.get('mode', 'RGB')
+   rawmode = header.get('rawmode', mode)
+   if mode not in STRIP_MODES or raw_row_bytes(mode, rawmode, 1) is None:
+      raise ValueError("Unsupported raw mode " + mode + "/" + rawmode)
+   with open(image, 'rb') as f:
+      return MappedImage(f.fileno(), mode,
+                         (int(header['width']), int(header['height'])),
+                         int(header.get('offset', 0)), rawmode,
+                         int(header.get('stride', 0)),
+                         int(header.get('orientation', 1)), 'RAW')
+
+def strip_bands(img, strip_height):
+   """Break img up into bands of rows to decode one at a time.  Returns a
+      list of (top, bottom, tiles) where tiles are the entries of img.tile
+      that land in the band.  Bands follow the tile boundaries in the file
+      and are merged until they are at least strip_height rows."""
+   width, height = img.size
+   if len(img.tile) == 1:
+      tile = img.tile[0]
+      return [(top, min(top + strip_height, height), [tile])
+              for top in range(0, height, strip_height)]
+
+   rows = {}
+   for tile in img.tile:
+      extents = tile[1]
+      rows.setdefault((extents[1], extents[3]), []).append(tile)
+   bands = []
+   for top, bottom in sorted(rows):
+      if bands and bands[-1][1] - bands[-1][0] < strip_height and \
+         bands[-1][1] == top:
+         bands[-1] = (bands[-1][0], bottom, bands[-1][2] + rows[(top, bottom)])
+      else:
+         bands.append((top, bottom, list(rows[(top, bottom)])))
+   return bands
+
+def feed_decoder(decoder, fp, offset, length=None):
+   """Feed decoder from fp starting at offset until it is done, the same
+      way ImageFile.load does.  length limits how much is read."""
+   fp.seek(offset)
+   if decoder.pulls_fd:
+      decoder.setfd(fp)
+      decoder.decode(b"")
+      return
+   data = b""
+   remaining = length
+   while True:
+      block = 65536 if remaining is None else min(65536, remaining)
+      chunk = fp.read(block) if block > 0 else b""
+      if remaining is not None:
+         remaining -= len(chunk)
+      if not chunk and not data:
+         raise OSError("image file is truncated")
+      data += chunk
+      consumed, err = decoder.decode(data)
+      if consumed < 0:
+         if err < 0:
+            raise OSError("decoder error " + str(err))
+         break
+      data = data[consumed:]
+      if not chunk and consumed == 0:
+         raise OSError("image file is truncated")
+
+def get_decoder(mode, name, args, extra=()):
+   """Pillow's decoder name for mode.  Pillow has no public way to decode
+      part of a file, so this is the private Image._getdecoder that
+      ImageFile.load calls.  Raises OSError if Pillow has changed it."""
+   try:
+      return Image._getdecoder(mode, name, args, extra)
+   except (AttributeError, TypeError) as e:
+      raise OSError("Unable to decode in strips with Pillow " +
+                    Image.__version__ + " (" + repr(e) + "), try without "
+                    "--strip-height")
+
+def decode_band(img, band, window, row, left):
+   """Decode one band (see strip_bands) of img into window, with the top
+      of the band at window row row and image column left at window
+      column 0.  Tiles wholly outside the columns window covers are not
+      decoded at all and the parts of the rest outside them are dropped."""
+   top, bottom, tiles = band
+   right = left + window.size[0]
+   for tile in tiles:
+      name, extents, offset = tile[0], tile[1], tile[2]
+      tx0, ty0, tx1, ty1 = extents
+      if tx1 <= left or tx0 >= right:
+         continue
+      row0 = max(ty0, top)
+      row1 = min(ty1, bottom)
+      # The same calls ImageFile.load makes, just pointed at our window
+      if name == 'raw':
+         # Uncompressed so only read the rows we need.
+         rawmode, stride, orientation = raw_tile_args(tile)
+         if stride == 0:
+            stride = raw_row_bytes(img.mode, rawmode, tx1 - tx0)
+         if orientation < 0:
+            # Stored bottom up
+            skip = ty1 - row1
+         else:
+            skip = row0 - ty0
+         decoder = get_decoder(img.mode, 'raw',
+                               (rawmode, stride, orientation))
+         if (tx0, tx1) == (left, right):
+            decoder.setimage(window.im, (0, row + row0 - top, right - left,
+                                         row + row1 - top))
+            piece = None
+         else:
+            # The decoder fills whole rows of the tile
+            piece = Image.new(img.mode, (tx1 - tx0, row1 - row0))
+            decoder.setimage(piece.im, (0, 0, tx1 - tx0, row1 - row0))
+            piece_top = row0
+         feed_decoder(decoder, img.fp, offset + skip * stride,
+                      (row1 - row0) * stride)
+      else:
+         piece = Image.new(img.mode, (tx1 - tx0, ty1 - ty0))
+         decoder = get_decoder(img.mode, name, tile[3],
+                               getattr(img, 'decoderconfig', ()))
+         decoder.setimage(piece.im, (0, 0, tx1 - tx0, ty1 - ty0))
+         feed_decoder(decoder, img.fp, offset)
+         decoder.cleanup()
+         piece_top = ty0
+      if piece is not None:
+         x0 = max(tx0, left)
+         window.paste(piece.crop((x0 - tx0, row0 - piece_top,
+                                  min(tx1, right) - tx0,
+                                  row1 - piece_top)),
+                      (x0 - left, row + row0 - top))
+
+def strip_regions(img_size, monitors, opts, scale_factor, left_padding,
+                  top_padding):
+   """Describe every region split_tiles would resize, in a form
+      split_tiles_strips can work through a band at a time.  Each region
+      has the monitor it is for, the box its filters are clamped to, the
+      floating point box to resample and the output size."""
+   regions = []
+   for monitor in monitors:
+      box = crop_box(monitor, scale_factor, left_padding, top_padding)
+      crop_size = (box[2] - box[0], box[3] - box[1])
+      size = crop_size if opts.crop_only else tuple(monitor['resolution'])
+      regions.append({"clamp": box, "box": box, "size": size,
+                      "resample": size != crop_size, "monitor": monitor})
+
+   for region in regions:
+      box = region['box']
+      width, height = region['size']
+      region['y_scale'] = float(box[3] - box[1]) / height
+      if region['resample']:
+         region['alg'], _ = choose_resample(width, box[2] - box[0])
+         region['support'] = FILTER_SUPPORT[region['alg']] * \
+                             max(region['y_scale'], 1.0)
+      else:
+         region['support'] = 0.0
+      region['next_row'] = 0
+      region['tile'] = None
+   return regions
+
+def region_rows(region, first, last):
+   """Which source rows are needed to make output rows [first, last) of
+      region.  Padded a little beyond the filter support and clamped to
+      the region, so resampling just these rows gives the same answer as
+      resampling the whole thing."""
+   top = region['box'][1]
+   y_scale = region['y_scale']
+   support = region['support']
+   lower = int(math.floor(top + first * y_scale - support)) - 1
+   upper = int(math.ceil(top + last * y_scale + support)) + 1
+   return (max(lower, region['clamp'][1]), min(upper, region['clamp'][3]))
+
+def split_tiles_strips(img, monitors, opts, scale_factor, left_padding,
+                       top_padding, image=None):
+   """Split img without ever decoding all of it.  The source is read a band
+      of rows at a time (see strip_bands) and each region gets the output
+      rows resampled that the rows decoded so far are enough for.  Only
+      the rows and columns some region still needs are kept, so memory is
+      the band height plus the filter overlap times the width the monitors
+      cover, plus the finished tiles.  Yields (monitor, tile) pairs as
+      tiles finish.
+
+      Filters are clamped to the same edges as the in-memory paths, but
+      each band is resampled on its own rather than the whole tile in
+      one go, so pixels can round differently.  The tiles are within one
+      level of split_tiles, not identical."""
+   regions = strip_regions(img.size, monitors, opts, scale_factor,
+                           left_padding, top_padding)
+   # Only the columns some region reads are decoded and kept
+   left = max(min(region['clamp'][0] for region in regions), 0)
+   right = min(max(region['clamp'][2] for region in regions), img.size[0])
+   # The rows still needed, from window_top down, with room below for the
+   # next band.  It is only reallocated when a band does not fit.
+   window = None
+   window_top = 0
+   resample_time = 0.0
+   bands = strip_bands(img, opts.strip_height)
+   log_debug("Decoding", img.size, "image in", len(bands), "bands, columns",
+             left, "to", right)
+   for band in bands:
+      band_top, band_bottom, _ = band
+      if window is None or band_bottom - window_top > window.size[1]:
+         grown = Image.new(img.mode, (right - left, band_bottom - window_top))
+         if window is not None:
+            grown.paste(window.crop((0, 0, right - left,
+                                     band_top - window_top)), (0, 0))
+         window = grown
+      with trace_span("decode", image):
+         decode_band(img, band, window, band_top - window_top, left)
+
+      keep_from = band_bottom
+      for region in regions:
+         width, height = region['size']
+         first = region['next_row']
+         if first >= height:
+            continue
+         if region['tile'] is None:
+            region['tile'] = Image.new(img.mode, (width, height))
+
+         # How far can we get with the rows we have?
+         low, high = first, height
+         while low < high:
+            mid = (low + high + 1) // 2
+            if region_rows(region, first, mid)[1] <= band_bottom:
+               low = mid
+            else:
+               high = mid - 1
+         last = low
+         if last > first:
+            clamp = region['clamp']
+            box = region['box']
+            row0, row1 = region_rows(region, first, last)
+            rows = window.crop((clamp[0] - left, row0 - window_top,
+                                clamp[2] - left, row1 - window_top))
+            if region['resample']:
+               y_scale = region['y_scale']
+               start = time.perf_counter()
+               with trace_span("resample", image) as span:
+                  part = rows.resize((width, last - first),
+                                     resample=region['alg'],
+                                     box=(box[0] - clamp[0],
+                                          box[1] + first * y_scale - row0,
+                                          box[2] - clamp[0],
+                                          box[1] + last * y_scale - row0))
+                  span.count('pixels_resampled', width * (last - first))
+               resample_time += time.perf_counter() - start
+            else:
+               with trace_span("crop", image):
+                  part = rows.crop((box[0] - clamp[0],
+                                    box[1] + first - row0,
+                                    box[2] - clamp[0],
+                                    box[1] + last - row0))
+            region['tile'].paste(part, (0, first))
+            region['next_row'] = last
+
+         if region['next_row'] >= height:
+            yield region['monitor'], region['tile']
+            region['tile'] = None
+         else:
+            keep_from = min(keep_from,
+                            region_rows(region, region['next_row'],
+                                        region['next_row'] + 1)[0])
+
+      # Move the rows still needed up to the top, over the ones nobody
+      # needs any more, for the next band to go in after them
+      if keep_from > window_top:
+         if keep_from < band_bottom:
+            window.paste(window.crop((0, keep_from - window_top,
+                                      right - left,
+                                      band_bottom - window_top)), (0, 0))
+         window_top = keep_from
+   log_debug("Resampled", len(monitors), "tiles in strips in",
+             resample_time, "seconds")
+
+def load_image(monitors, opts, image, plan=None):
+   """Open and decode image and work out where the monitors land on it,
+      using plan (a LayoutPlan for monitors and opts) if one is given.
+
+      This is everything split_image needs to do before it can start
+      cropping, pulled out so it can run ahead on another thread.  Returns
+      a dict describing the source or None if there is no image or its
+      tiles could be restored from the cache.  With --preview the preview
+      is written first."""
+   if opts.preview:
+      write_preview(monitors, opts, image, plan)
+      if opts.preview_only:
+         return None
+
+   key = None
+   if opts.cache_dir is not None and os.path.isfile(image):
+      key = cache_key(monitors, opts, image)
+      if cache_restore(monitors, opts, image, key):
+         return None
+
+   with trace_span("open", image) as span:
+      img = open_image(image)
+      if img is not None:
+         span.count('bytes_read', os.path.getsize(image))
+   if img is None:
+      # I didn't want to process that image anyway.
+      return None
+
+   if opts.frames and getattr(img, 'n_frames', 1) > 1:
+      fmt = Image.registered_extensions().get(
+         os.path.splitext(output_filename(image, monitors[0],
+                                          opts.output_format))[1].lower())
+      if fmt in ANIMATION_FORMATS:
+         # Decoded a frame at a time by split_frames
+         return {"frames": img, "format": fmt, "cache_key": key}
+      print("WARNING: Can not write", fmt, "animations, only splitting the",
+            "first frame of", image)
+
+   source = prepare_source(img, monitors, opts, plan, image)
+   source['cache_key'] = key
+   return source
+
+def source_id(image):
+   """What a LayoutPlan remembers things about the source file image
+      under: its path, size and mtime.  None if image is not a file."""
+   if image is None:
+      return None
+   try:
+      stat = os.stat(image)
+   except OSError:
+      return None
+   return (os.path.abspath(image), stat.st_size, stat.st_mtime_ns)
+
+def prepare_source(img, monitors, opts, plan=None, image=None):
+   """Work out where the monitors land on the opened image img and decode
+      it (unless it is going to be decoded in strips).  Returns the dict
+      split_image and make_tiles expect.  image is only used for messages."""
+   # Figure out how big our image is
+   img_width, img_height = img.size
+
+   # Where do the monitors land on something that size?
+   if plan is None:
+      plan = LayoutPlan(monitors, opts, max_sizes=1)
+   with trace_span("padding", image):
+      if plan.layouts is None:
+         size_plans = [plan.for_size(img_width, img_height)]
+      else:
+         size_plans = [layout.for_size(img_width, img_height)
+                       for layout in plan.layouts]
+
+   # Everything above is in terms of the full size image.  If the decoder
+   # can give us a smaller one the crop boxes get scaled to match.
+   mapped = None
+   if isinstance(img, MappedImage):
+      mapped = img
+   elif opts.mmap:
+      with trace_span("decode", image):
+         mapped = map_image(img)
+   streamed = mapped is None and opts.strip_height > 0 and can_stream(img)
+   if mapped is not None:
+      # The tiles are read out of the file as they are cropped
+      log_debug("Mapped", image or img, "into memory")
+      img = mapped
+      x_ratio, y_ratio = 1.0, 1.0
+   elif streamed:
+      # split_tiles_strips decodes it as it goes
+      x_ratio, y_ratio = 1.0, 1.0
+   else:
+      if opts.strip_height > 0:
+         print("WARNING: Can not decode", image or img, "in strips,",
+               "loading it whole")
+      # Decode once for every layout.  The one with the smallest scale
+      # needs the most pixels.
+      finest = min(size_plans,
+                   key=lambda size_plan: size_plan.output_layout[
+                      'scale_factor'])
+      with trace_span("decode", image):
+         x_ratio, y_ratio = draft_image(img, finest.output_layout, opts)
+         img.load()
+
+   if opts.auto_position and not streamed:
+      # One look at the image does for every layout
+      energy_maps = []
+      def energy():
+         if not energy_maps:
+            energy_maps.append(EnergyMap(img, (img_width, img_height)))
+         return energy_maps[0]
+      with trace_span("padding", image):
+         size_plans = [layout.auto_position(size_plan,
+                                            (img_width, img_height),
+                                            source_id(image), energy)
+                       for layout, size_plan in
+                       zip(plan.layouts or [plan], size_plans)]
+
+   sources = []
+   for layout, size_plan in zip(plan.layouts or [plan], size_plans):
+      sources.append({"img": img,
+                      "plan": layout,
+                      "image": image,
+                      "streamed": streamed,
+                      "img_width": img_width,
+                      "img_height": img_height,
+                      "output_layout": size_plan.output_layout,
+                      "size_plan": size_plan,
+                      "left_padding": size_plan.left_padding,
+                      "top_padding": size_plan.top_padding,
+                      "x_ratio": x_ratio,
+                      "y_ratio": y_ratio,
+                      "cache_key": None})
+   if plan.layouts is None:
+      return sources[0]
+
+   # One source for every layout, all sharing the decoded image
+   source = dict(sources[0])
+   source['layouts'] = [(layout.monitors, layout_source) for layout,
+                        layout_source in zip(plan.layouts, sources)]
+   return source
+
+def make_tiles(monitors, opts, source, memo=None):
+   """Cut the tiles for every monitor out of source (see prepare_source)
+      with whichever engine opts ask for.  Yields (monitor, tile) pairs,
+      not necessarily in monitor order.  memo is handed to the engine to
+      share tiles between layouts (see make_layout_tiles)."""
+   if 'layouts' in source:
+      return make_layout_tiles(opts, source)
+
+   img = source['img']
+   left_padding = source['left_padding']
+   top_padding = source['top_padding']
+   scale_factor = source['output_layout']['scale_factor']
+
+   image = source['image']
+
+   if source['streamed']:
+      return split_tiles_strips(img, monitors, opts, scale_factor,
+                                left_padding, top_padding, image)
+
+   x_ratio, y_ratio = source['x_ratio'], source['y_ratio']
+   if x_ratio == 1.0 and y_ratio == 1.0:
+      return split_tiles(img, monitors, opts, source['size_plan'].boxes,
+                         source['size_plan'].filters, image, memo,
+                         source['plan'])
+   boxes = [crop_box(monitor, scale_factor, left_padding, top_padding,
+                     x_ratio, y_ratio) for monitor in monitors]
+   return split_tiles(img, monitors, opts, boxes, image=image, memo=memo,
+                      plan=source['plan'])
+
+def make_layout_tiles(opts, source):
+   """make_tiles for a source covering several layouts.  Every layout cuts
+      its tiles out of the one decoded image on its own thread (Pillow lets
+      go of the GIL while it resizes).  A region of the source that more
+      than one layout resizes to the same size is only resized once; the
+      layouts share the result through a memo.  Sources decoded in strips
+      read the file as they go so their layouts take turns instead."""
+   layouts = source['layouts']
+   memo = {}
+   if source['streamed']:
+      for monitors, layout_source in layouts:
+         for tile in make_tiles(monitors, opts, layout_source, memo):
+            yield tile
+      return
+
+   def layout_tiles(monitors, layout_source):
+      return list(make_tiles(monitors, opts, layout_source, memo))
+
+   threads = min(len(layouts), os.cpu_count() or 1)
+   with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+      futures = [pool.submit(layout_tiles, monitors, layout_source)
+                 for monitors, layout_source in layouts]
+      for future in concurrent.futures.as_completed(futures):
+         for tile in future.result():
+            yield tile
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def png_chunks(data):
+   """The (type, data) chunks of the PNG file in data"""
+   offset = len(PNG_SIGNATURE)
+   while offset < len(data):
+      length, kind = struct.unpack_from(">I4s", data, offset)
+      yield kind, data[offset + 8:offset + 8 + length]
+      offset += length + 12
+
+def write_png_chunk(fp, kind, data):
+   fp.write(struct.pack(">I", len(data)) + kind + data +
+            struct.pack(">I", zlib.crc32(kind + data)))
+
+class AnimationWriter(object):
+   """Writes the tiles one monitor gets from every frame of a source as an
+      animation (or multi-page TIFF) in fmt, a frame at a time, so only
+      the frame being split is ever in memory.
+
+      GIF, APNG and TIFF frames go straight to the file as they are added.
+      Pillow only writes WebP and AVIF animations from a sequence of
+      frames, so for those the tiles are spooled to a deflated TIFF next
+      to the output, which the encoder reads back a page at a time on
+      close().  count is the number of frames to come, which APNG needs
+      up front.  Like save_tile the animation is written to a temporary
+      file and renamed into place."""
+
+   def __init__(self, filename, fmt, settings=None, loop=None, count=0):
+      self.filename = filename
+      self.fmt = fmt
+      self.settings = (settings or {}).get(fmt, {})
+      self.loop = loop
+      self.count = count
+      self.tmp = filename + ".tmp" + str(os.getpid())
+      self.spool = None
+      self.durations = []
+      self.sequence = 0
+      if fmt in ('GIF', 'PNG'):
+         self.fp = open(self.tmp, 'wb')
+      elif fmt == 'TIFF':
+         self.fp = TiffImagePlugin.AppendingTiffWriter(self.tmp, new=True)
+      else:
+         self.spool = self.tmp + ".frames"
+         self.fp = TiffImagePlugin.AppendingTiffWriter(self.spool, new=True)
+
+   def add(self, tile, duration):
+      """Add tile as the next frame, shown for duration ms"""
+      if self.fmt == 'GIF':
+         self.add_gif(tile, duration)
+      elif self.fmt == 'PNG':
+         self.add_png(tile, duration)
+      elif self.fmt == 'TIFF':
+         tile.save(self.fp, format='TIFF', **self.settings)
+         self.fp.newFrame()
+      else:
+         tile.save(self.fp, format='TIFF', compression='tiff_adobe_deflate')
+         self.fp.newFrame()
+      self.durations.append(duration)
+
+   def add_gif(self, tile, duration):
+      frame = tile.convert('P', palette=Image.Palette.ADAPTIVE)
+      params = {"duration": duration, "include_color_table": True}
+      if tile.mode == 'RGBA':
+         # The adaptive palette keeps alpha; GIF only has one transparent
+         # colour
+         for rgba, index in frame.palette.colors.items():
+            if rgba[3] == 0:
+               params['transparency'] = index
+               break
+      if len(self.durations) == 0:
+         info = {"duration": duration}
+         if self.loop is not None:
+            info['loop'] = self.loop
+         header, _ = GifImagePlugin.getheader(frame, None, info)
+         self.fp.write(b"".join(header))
+      self.fp.write(b"".join(GifImagePlugin.getdata(frame, **params)))
+
+   def add_png(self, tile, duration):
+      # Every frame is a full tile, so its image data can be lifted from
+      # a PNG of the tile as it is: IDAT for the first frame, renumbered
+      # as fdAT for the rest
+      buf = io.BytesIO()
+      tile.save(buf, format='PNG', **self.settings)
+      chunks = list(png_chunks(buf.getvalue()))
+      if len(self.durations) == 0:
+         self.fp.write(PNG_SIGNATURE)
+         write_png_chunk(self.fp, b"IHDR", chunks[0][1])
+         # No loop count means play once, as a GIF without one does;
+         # num_plays 0 would be forever
+         plays = 1 if self.loop is None else self.loop
+         write_png_chunk(self.fp, b"acTL",
+                         struct.pack(">II", self.count, plays))
+      write_png_chunk(self.fp, b"fcTL", struct.pack(
+         ">IIIIIHHBB", self.sequence, tile.width, tile.height, 0, 0,
+         min(duration, 0xffff), 1000, 0, 0))
+      self.sequence += 1
+      for kind, data in chunks:
+         if kind != b"IDAT":
+            continue
+         if len(self.durations) == 0:
+            write_png_chunk(self.fp, b"IDAT", data)
+         else:
+            write_png_chunk(self.fp, b"fdAT",
+                            struct.pack(">I", self.sequence) + data)
+            self.sequence += 1
+
+   def close(self):
+      """Finish the animation off and move it into place"""
+      try:
+         if self.fmt == 'GIF':
+            self.fp.write(b";")
+         elif self.fmt == 'PNG':
+            write_png_chunk(self.fp, b"IEND", b"")
+         self.fp.close()
+         self.fp = None
+         if self.spool is not None:
+            # Pillow's default loop of 0 would play forever, see add_png
+            options = dict(self.settings)
+            options['loop'] = 1 if self.loop is None else self.loop
+            with Image.open(self.spool) as frames:
+               frames.save(self.tmp, format=self.fmt, save_all=True,
+                           duration=self.durations, **options)
+            os.remove(self.spool)
+         os.replace(self.tmp, self.filename)
+      except BaseException:
+         self.abort()
+         raise
+
+   def abort(self):
+      """Throw away what has been written"""
+      if self.fp is not None:
+         self.fp.close()
+         self.fp = None
+      for name in (self.tmp, self.spool):
+         if name is not None and os.path.exists(name):
+            os.remove(name)
+
+def animation_mode(img):
+   """The mode to split every frame of img in.  Frames can change mode
+      part way through (GIF goes from P to RGB after the first) but the
+      frames of each tile's animation have to match."""
+   if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+      return 'RGBA'
+   if img.mode in ('1', 'L'):
+      return 'L'
+   return 'RGB'
+
+def split_frames(monitors, opts, image, img, fmt, plan=None):
+   """Split every frame of the animated or multi-page img into an
+      animation per monitor in fmt (see AnimationWriter), keeping the
+      frame durations and how many times it loops.
+
+      Frames of GIF, APNG and WebP each build on the one before so they
+      are decoded one after another, and each is only held while it is
+      cut up.  The crop boxes and filters are worked out once for the
+      first frame and reused for the rest.  The tiles of a frame are cut
+      and added to their animations on up to --tile-threads threads.
+
+      The pages of a TIFF (see INDEPENDENT_FRAME_FORMATS) stand alone, so
+      with --tile-threads they are instead decoded and cut that many at a
+      time, each thread opening image for itself, and handed to the
+      animations in order."""
+   if plan is None:
+      plan = LayoutPlan(monitors, opts, max_sizes=1)
+   layouts = plan.layouts or [plan]
+   img_size = img.size
+   with trace_span("padding", image):
+      size_plans = [layout.for_size(*img_size) for layout in layouts]
+   mode = animation_mode(img)
+   loop = img.info.get('loop')
+   frame_count = img.n_frames
+   if not opts.quiet:
+      print("Splitting", frame_count, "frames of", image)
+   by_frame = opts.tile_threads > 1 and \
+              img.format in INDEPENDENT_FRAME_FORMATS and \
+              image is not None and os.path.isfile(image)
+   if by_frame:
+      # One thread per frame rather than per tile
+      frame_opts = copy.copy(opts)
+      frame_opts.tile_threads = 0
+   else:
+      frame_opts = opts
+
+   def cut(frame_img):
+      tiles = []
+      memo = {}
+      for layout, size_plan in zip(layouts, size_plans):
+         tiles += split_tiles(frame_img, layout.monitors, frame_opts,
+                              size_plan.boxes, size_plan.filters, image,
+                              memo, layout)
+      return tiles
+
+   def cut_page(index):
+      with Image.open(image) as page:
+         page.seek(index)
+         with trace_span("decode", image):
+            frame_img = page.convert(mode)
+         duration = int(round(page.info.get('duration', 0)))
+      return cut(frame_img), duration
+
+   # The tiles come back for the monitors of the plan, which need not be
+   # the same objects as monitors (a --jobs worker has its own)
+   plan_monitors = [monitor for layout in layouts
+                    for monitor in layout.monitors]
+   writers = dict((id(monitor),
+                   AnimationWriter(output_filename(image, monitor,
+                                                   opts.output_format),
+                                   fmt, opts.encoder_settings, loop,
+                                   frame_count))
+                  for monitor in plan_monitors)
+
+   def add_frame(index, tiles, duration):
+      def add(idx, item):
+         monitor, tile = item
+         with trace_span("encode", image):
+            writers[id(monitor)].add(tile, duration)
+
+      for _ in map_tiles(add, tiles, opts.tile_threads):
+         pass
+      log_debug("Split frame", index, "shown for", duration, "ms")
+
+   try:
+      for index, frame in enumerate(ImageSequence.Iterator(img)):
+         with trace_span("decode", image):
+            frame_img = frame.convert(mode)
+         # Only known once the frame has been loaded
+         duration = int(round(frame.info.get('duration', 0)))
+         if index == 0 and opts.auto_position:
+            with trace_span("padding", image):
+               size_plans = [layout.auto_position(
+                                size_plan, img_size, source_id(image),
+                                lambda: EnergyMap(frame_img, img_size))
+                             for layout, size_plan in
+                             zip(layouts, size_plans)]
+         add_frame(index, cut(frame_img), duration)
+         if by_frame:
+            # The rest are cut by cut_page
+            break
+      del frame_img
+
+      if by_frame and frame_count > 1:
+         if Logger.isEnabledFor(logging.DEBUG):
+            Logger.debug("Cutting %s more frames %s", frame_count - 1,
+                         tile_threads_note(opts.tile_threads,
+                                           frame_count - 1))
+         with concurrent.futures.ThreadPoolExecutor(
+               max_workers=opts.tile_threads) as pool:
+            # Only a group of frames at a time so memory stays bounded
+            for first in range(1, frame_count, opts.tile_threads):
+               indexes = range(first, min(first + opts.tile_threads,
+                                          frame_count))
+               for index, future in [(index, pool.submit(cut_page, index))
+                                     for index in indexes]:
+                  add_frame(index, *future.result())
+
+      for monitor in plan_monitors:
+         with trace_span("encode", image) as span:
+            writer = writers.pop(id(monitor))
+            writer.close()
+            span.count('bytes_written', os.path.getsize(writer.filename))
+   finally:
+      for writer in writers.values():
+         writer.abort()
+
+def write_tile(opts, image, monitor, tile):
+   """Write the tile cut from image for monitor"""
+   filename = output_filename(image, monitor, opts.output_format)
+   log_debug("Writing output to", filename)
+   with trace_span("encode", image) as span:
+      span.count('bytes_written',
+                 store_tile(tile, filename, opts.encoder_settings))
+
+def split_image(monitors, opts, image, source=None, encoder=None, plan=None):
+   """Split apart an individual image.  source is what load_image returned
+      for image if that has already been done.  Tiles are handed to
+      encoder (a TileEncoder) to be written if one is given, otherwise they
+      are written before returning.  plan is a LayoutPlan to reuse.
+
+      Returns the cache key the tiles should be stored under once they are
+      written, or None if there is nothing to cache."""
+   with profile_image(opts, image):
+      if source is None:
+         source = load_image(monitors, opts, image, plan)
+      if source is None:
+         return None
+      if 'frames' in source:
+         split_frames(monitors, opts, image, source['frames'],
+                      source['format'], plan)
+         return source['cache_key']
+
+      # Header so debug output is readable
+      log_debug("Cropping an image at: [left, upper, right, lower]")
+      if not opts.quiet:
+         # Show the user what this is going to look like
+         for layout_monitors, layout_source in source.get(
+               'layouts', [(monitors, source)]):
+            show_projection(layout_monitors, layout_source['output_layout'],
+                            opts, image, layout_source['img_width'],
+                            layout_source['img_height'],
+                            layout_source['left_padding'],
+                            layout_source['top_padding'])
+
+      tiles = make_tiles(monitors, opts, source)
+      if encoder is None and opts.tile_threads > 1:
+         # Write each tile as soon as it is cut while the rest still are
+         with concurrent.futures.ThreadPoolExecutor(
+               max_workers=opts.tile_threads) as pool:
+            writes = [pool.submit(write_tile, opts, image, monitor, tile)
+                      for monitor, tile in tiles]
+         for write in writes:
+            write.result()
+         return source['cache_key']
+
+      for monitor, resized_image in tiles:
+         if encoder is not None:
+            filename = output_filename(image, monitor, opts.output_format)
+            log_debug("Writing output to", filename)
+            encoder.save(image, resized_image, filename)
+         else:
+            write_tile(opts, image, monitor, resized_image)
+      return source['cache_key']
+
+def load_layout(layout):
+   """Turn whatever split() was given as a layout into a list of monitors
+      (see compile_layout).  layout can be the name of a monitor definition
+      file, the parsed contents of one, or its list of monitors."""
+   if isinstance(layout, (str, os.PathLike)):
+      real_file = os.path.expanduser(layout)
+      with open(real_file, 'r') as f:
+         layout = json.load(f)
+   if not isinstance(layout, dict):
+      if not isinstance(layout, CompiledLayout):
+         layout = list(layout)
+      layout = {"monitors": layout}
+   return compile_layout(layout)
+
+def load_layouts(directories):
+   """Read every monitor definition file in directories.  Returns a dict
+      of layout name (the file name without .json) to its monitors."""
+   layouts = {}
+   for directory in directories:
+      directory = os.path.expanduser(directory)
+      for name in sorted(os.listdir(directory)):
+         if not name.endswith('.json'):
+            continue
+         try:
+            layouts[name[:-len('.json')]] = \
+               load_layout(os.path.join(directory, name))
+         except (OSError, ValueError) as e:
+            print("WARNING: Unable to load", name + ":", e, file=sys.stderr)
+   return layouts
+
+def split_options(**options):
+   """Build the opts split() hands to the splitting code.  Anything not
+      given gets the same default the command line uses.  Raises
+      ValueError for values parse_cmdline would turn down."""
+   unknown = set(options) - set(SPLIT_DEFAULTS)
+   if unknown:
+      raise TypeError("Unknown split option(s): " +
+                      ", ".join(sorted(unknown)))
+   settings = dict(SPLIT_DEFAULTS)
+   settings.update(options)
+   if settings['resample_engine'] not in RESAMPLE_ENGINES:
+      raise ValueError("resample_engine must be one of " +
+                       ", ".join(RESAMPLE_ENGINES) + ", not " +
+                       repr(settings['resample_engine']))
+   if settings['resample_engine'] == 'numpy' and numpy is None:
+      raise ValueError("resample_engine numpy needs NumPy installed")
+   for name in ('strip_height', 'tile_threads'):
+      if settings[name] < 0:
+         raise ValueError(name + " can not be negative")
+   return argparse.Namespace(**settings)
+
+def api_plan(layout, plan, options):
+   """The monitors, opts and LayoutPlan for split() or preview()"""
+   if isinstance(layout, LayoutPlan):
+      plan = layout
+   if plan is not None:
+      return plan.monitors, plan.opts, plan
+   monitors = load_layout(layout)
+   opts = split_options(**options)
+   return monitors, opts, LayoutPlan(monitors, opts, max_sizes=1)
+
+def open_source(image_or_bytes):
+   """Open whatever split() was given as the image"""
+   if isinstance(image_or_bytes, Image.Image):
+      return image_or_bytes
+   if isinstance(image_or_bytes, (bytes, bytearray, memoryview)):
+      return Image.open(io.BytesIO(image_or_bytes))
+   if hasattr(image_or_bytes, 'read'):
+      return Image.open(image_or_bytes)
+   if is_raw_capture(os.path.expanduser(image_or_bytes)):
+      return open_raw(os.path.expanduser(image_or_bytes))
+   return Image.open(os.path.expanduser(image_or_bytes))
+
+def split(image_or_bytes, layout, format=None, plan=None,
+          encoder_profile=None, **options):
+   """Split an image up for a monitor layout without touching the disk.
+
+      image_or_bytes can be a PIL Image, the encoded image as bytes or any
+      other buffer, a file-like object open for binary reading, or a file
+      name.  layout can be anything load_layout takes, or a LayoutPlan to
+      reuse between calls (options are then taken from the plan).  options
+      are the command line settings that change the tiles: left, right,
+      left_padding, right_padding, top, bottom, top_padding,
+      bottom_padding, auto_position, crop_only, draft, mmap,
+      resample_engine, strip_height and tile_threads; split_options
+      raises ValueError for any it would not take.
+
+      Returns a list of (monitor, tile) pairs in the order of the monitors.
+      tile is a PIL Image, or if format is given (e.g. "PNG") the tile
+      encoded in that format as bytes using encoder_profile, anything
+      encoder_settings takes.
+
+      A PIL Image is copied first, as draft decoding would shrink it, and
+      is left as it was.  Anything opened here is closed again.  Nothing
+      here touches shared state other than the plan, which locks, so it
+      is safe to call from several threads at once."""
+   monitors, opts, plan = api_plan(layout, plan, options)
+   settings = None
+   if encoder_profile is not None:
+      settings = encoder_settings(encoder_profile)
+
+   img = open_source(image_or_bytes)
+   if isinstance(image_or_bytes, Image.Image):
+      img = img.copy()
+   source = None
+   try:
+      source = prepare_source(img, monitors, opts, plan)
+      tiles = dict((id(monitor), tile)
+                   for monitor, tile in make_tiles(monitors, opts, source))
+   finally:
+      if source is not None and source['img'] is not img:
+         # Mapped
+         source['img'].close()
+      img.close()
+
+   if format is None:
+      return [(monitor, tiles[id(monitor)]) for monitor in monitors]
+
+   def encode(idx, monitor):
+      with trace_span("encode") as span:
+         buf = io.BytesIO()
+         encode_tile(tiles[id(monitor)], buf, format, settings)
+         span.count('bytes_written', buf.tell())
+         return buf.getvalue()
+
+   encoded = dict((id(monitor), data) for monitor, data in
+                  map_tiles(encode, monitors, opts.tile_threads))
+   return [(monitor, encoded[id(monitor)]) for monitor in monitors]
+
+def preview(image_or_bytes, layout, width=PREVIEW_WIDTH, plan=None,
+            **options):
+   """make_preview for an image and layout given the way split() takes
+      them.  Hand the same plan to split() afterwards and the tiles match
+      the preview.  A PIL Image is copied first so it can still be split.
+      Returns the preview as a PIL Image."""
+   monitors, opts, plan = api_plan(layout, plan, options)
+   img = open_source(image_or_bytes)
+   if isinstance(image_or_bytes, Image.Image):
+      img = img.copy()
+   try:
+      return make_preview(img, monitors, opts, plan, width=width)
+   finally:
+      img.close()
+
+def main():
+   """Command line entry point"""
+   opts = parse_cmdline()
+
+   # Read the monitors
+   monitors = parse_monitors(opts.monitor)
+
+   if not opts.quiet:
+      # Show the user the layout if we aren't quiet
+      for name, layout_monitors in layout_groups(monitors):
+         layout = calculate_scale(layout_monitors,
+                                  output_width=get_terminal_width() - 1)
+         if name is None:
+            print("Monitor Layout read from definition file:")
+         else:
+            print("Monitor Layout", name + ":")
+         display_layout(layout, layout_monitors)
+
+   hooks = []
+   if opts.trace is not None:
+      hooks.append(ChromeTrace(opts.trace))
+   if opts.metrics_file is not None:
+      hooks.append(PrometheusTextfile(opts.metrics_file))
+   Trace_hooks.extend(hooks)
+
+   # Do the work
+   try:
+      failures = split_images(monitors, opts)
+   finally:
+      for hook in hooks:
+         hook.close()
+   if failures:
+      sys.exit(1)
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,52 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# What every test needs: src on the path, the bundled monitor definitions
+# and noisy sources to split.  pytest loads this first; under python -m
+# unittest discover tests each test imports it before wallpaper_splitter.
+import os.path
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from wallpaper_splitter import Image
+
+MONITOR_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'resources',
+                           'monitor_defs')
+
+def layout_file(name):
+   """The bundled monitor definition called name"""
+   return os.path.join(MONITOR_DIR, name + '.json')
+
+def noise_image(size, sigma=60):
+   """An RGB source of noise, the worst case for a resampler since every
+      tap matters"""
+   return Image.merge('RGB', [Image.effect_noise(size, sigma)
+                              for _ in range(3)])
+
+SPLITTER = os.path.join(os.path.dirname(__file__), os.pardir, 'src',
+                        'wallpaper-splitter.py')
+
+def run_splitter(*args):
+   """Run the command line with args.  Returns the CompletedProcess with
+      its output as text."""
+   return subprocess.run([sys.executable, SPLITTER] + list(args),
+                         capture_output=True, text=True)
@@ -0,0 +1,81 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# split() and preview(), the in memory API.  Run from the top of the tree
+# with python -m unittest discover tests (or pytest).
+import gc
+import io
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from conftest import noise_image
+import wallpaper_splitter
+from wallpaper_splitter import Image
+
+# One small monitor, so a bigger JPEG is drafted down
+LAYOUT = [{"name": "Only", "resolution": [640, 360], "upper_left": [0, 0],
+           "suffix": "_1"}]
+
+class ApiTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-api-')
+      self.source = os.path.join(self.directory, 'source.jpg')
+      noise_image((2560, 1440)).save(self.source)
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_image_left_alone(self):
+      for call in (wallpaper_splitter.split, wallpaper_splitter.preview):
+         with Image.open(self.source) as img:
+            tiles = call(img, LAYOUT)
+            self.assertEqual(img.size, (2560, 1440), call.__name__)
+            self.assertEqual(img.mode, 'RGB')
+            # Still open and decodes at full size
+            img.load()
+            self.assertEqual(img.size, (2560, 1440))
+
+      with Image.open(self.source) as img:
+         [(_, tile)] = wallpaper_splitter.split(img, LAYOUT)
+      self.assertEqual(tile.size, (640, 360))
+
+   def test_files_closed(self):
+      with open(self.source, 'rb') as f:
+         data = f.read()
+      with warnings.catch_warnings(record=True) as caught:
+         warnings.simplefilter('always', ResourceWarning)
+         for image in (self.source, data):
+            wallpaper_splitter.split(image, LAYOUT, format='PNG')
+            wallpaper_splitter.preview(image, LAYOUT)
+         gc.collect()
+      self.assertEqual([str(warning.message) for warning in caught], [])
+
+      # A file object handed in is the caller's to close
+      with open(self.source, 'rb') as f:
+         wallpaper_splitter.split(f, LAYOUT)
+         self.assertFalse(f.closed)
+
+if __name__ == '__main__':
+   unittest.main()
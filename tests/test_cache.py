@@ -0,0 +1,88 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --cache-dir storing tiles and putting them back.  Run from the top of the
+# tree with python -m unittest discover tests (or pytest).
+import glob
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, noise_image, run_splitter
+
+class CacheTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-cache-')
+      self.cache_dir = os.path.join(self.directory, 'cache')
+      self.source = os.path.join(self.directory, 'source.jpg')
+      noise_image((640, 360)).save(self.source)
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def split(self, *args):
+      result = run_splitter('-v', '-m', layout_file('dual_4k'),
+                            '--cache-dir', self.cache_dir, self.source,
+                            *args)
+      self.assertEqual(result.returncode, 0, result.stderr)
+      return result.stdout
+
+   def tiles(self):
+      return sorted(glob.glob(os.path.join(self.directory, 'source_*.jpg')))
+
+   def cached(self):
+      return glob.glob(os.path.join(self.cache_dir, '*', '*', 'tile*'))
+
+   def test_restore(self):
+      output = self.split()
+      self.assertNotIn("up to date in the cache", output)
+      tiles = self.tiles()
+      self.assertEqual(len(tiles), 2)
+      self.assertEqual(len(self.cached()), 2)
+      contents = dict((tile, open(tile, 'rb').read()) for tile in tiles)
+
+      for tile in tiles:
+         os.remove(tile)
+      output = self.split()
+      self.assertIn("up to date in the cache", output)
+      self.assertEqual(self.tiles(), tiles)
+      for tile in tiles:
+         # Linked back in, not written again
+         self.assertTrue(any(os.path.samefile(tile, cached)
+                             for cached in self.cached()), tile)
+         self.assertEqual(open(tile, 'rb').read(), contents[tile])
+
+   def test_options_change_the_key(self):
+      self.split()
+      output = self.split('--crop_only')
+      self.assertNotIn("up to date in the cache", output)
+      self.assertEqual(len(self.cached()), 4)
+
+   def test_source_change_misses(self):
+      self.split()
+      noise_image((640, 360)).save(self.source)
+      output = self.split()
+      self.assertNotIn("up to date in the cache", output)
+
+if __name__ == '__main__':
+   unittest.main()
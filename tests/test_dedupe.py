@@ -0,0 +1,144 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --dedupe-index: perceptual hashes, how close counts as a copy, and the
+# copies being skipped.  Run from the top of the tree with python -m
+# unittest discover tests (or pytest).
+import glob
+import os
+import os.path
+import random
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, run_splitter
+
+import wallpaper_splitter
+from wallpaper_splitter import Image, ImageDraw
+
+def picture(seed, size=(1200, 800)):
+   """Blocks of colour, something with a shape to hash unlike noise"""
+   rng = random.Random(seed)
+   img = Image.new('RGB', size)
+   draw = ImageDraw.Draw(img)
+   for _ in range(30):
+      left, top = rng.randrange(size[0]), rng.randrange(size[1])
+      draw.rectangle([left, top, left + rng.randrange(50, 600),
+                      top + rng.randrange(50, 400)],
+                     fill=tuple(rng.randrange(256) for _ in range(3)))
+   return img
+
+def flip_bits(value, count, rng):
+   for bit in rng.sample(range(wallpaper_splitter.DHASH_BITS), count):
+      value ^= 1 << bit
+   return value
+
+class DedupeTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-dedupe-')
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def save(self, name, img, **kwds):
+      path = os.path.join(self.directory, name)
+      img.save(path, **kwds)
+      return path
+
+   def test_hash_survives_reencoding(self):
+      original = self.save('a.png', picture(1))
+      copy = self.save('b.jpg', picture(1).resize((600, 400)), quality=60)
+      other = self.save('c.png', picture(2))
+      value, size = wallpaper_splitter.image_dhash(original)
+      self.assertEqual(size, [1200, 800])
+      copy_value, copy_size = wallpaper_splitter.image_dhash(copy)
+      self.assertEqual(copy_size, [600, 400])
+      self.assertLessEqual(wallpaper_splitter.hamming(value, copy_value), 4)
+      other_value, _ = wallpaper_splitter.image_dhash(other)
+      self.assertGreater(wallpaper_splitter.hamming(value, other_value), 10)
+      broken = os.path.join(self.directory, 'd.png')
+      with open(broken, 'wb') as f:
+         f.write(b"not an image")
+      self.assertIsNone(wallpaper_splitter.image_dhash(broken))
+
+   def test_index_threshold(self):
+      rng = random.Random(7)
+      for distance in (0, 1, 4, 9):
+         index = wallpaper_splitter.HashIndex(distance)
+         value = rng.getrandbits(wallpaper_splitter.DHASH_BITS)
+         for bits in range(distance + 3):
+            index.add(flip_bits(value, bits, rng), bits)
+         self.assertEqual([item for _, item in index.search(value)],
+                          list(range(distance + 1)), distance)
+
+   def split(self, *args):
+      result = run_splitter('-m', layout_file('dual_4k'), '--dedupe-index',
+                            os.path.join(self.directory, 'index.jsonl'),
+                            *args)
+      self.assertEqual(result.returncode, 0, result.stderr)
+      return result.stdout
+
+   def tiles(self, name):
+      return sorted(os.path.basename(path) for path in glob.glob(
+         os.path.join(self.directory, name + '_*')))
+
+   def test_copies_skipped(self):
+      a = self.save('a.jpg', picture(1))
+      b = self.save('b.jpg', picture(1).resize((600, 400)), quality=60)
+      # Same picture, other shape
+      c = self.save('c.jpg', picture(1).resize((1200, 400)))
+      d = self.save('d.jpg', picture(2))
+      output = self.split('--dedupe-link', a, b, c, d)
+      self.assertIn("Near-duplicate: " + b + " of " + a, output)
+      self.assertNotIn("Near-duplicate: " + c, output)
+      self.assertNotIn("Near-duplicate: " + d, output)
+      self.assertEqual(self.tiles('a'), ['a_1.jpg', 'a_2.jpg'])
+      self.assertEqual(self.tiles('c'), ['c_1.jpg', 'c_2.jpg'])
+      # Linked to the original's
+      self.assertEqual(self.tiles('b'), ['b_1.jpg', 'b_2.jpg'])
+      for suffix in ('_1.jpg', '_2.jpg'):
+         self.assertTrue(os.path.samefile(
+            os.path.join(self.directory, 'b' + suffix),
+            os.path.join(self.directory, 'a' + suffix)))
+
+      # The index remembers a for the next run
+      e = self.save('e.jpg', picture(1), quality=70)
+      output = self.split(e)
+      self.assertIn("Near-duplicate: " + e + " of " + a, output)
+      self.assertEqual(self.tiles('e'), [])
+
+   def test_distance_threshold(self):
+      a = self.save('a.jpg', picture(1))
+      b = self.save('b.jpg', picture(1).resize((600, 400)), quality=30)
+      distance = wallpaper_splitter.hamming(
+         wallpaper_splitter.image_dhash(a)[0],
+         wallpaper_splitter.image_dhash(b)[0])
+      output = self.split('--dedupe-distance', str(distance), a, b)
+      self.assertIn("Near-duplicate: " + b, output)
+      # Squeezed hard enough to be a few bits off
+      self.assertGreater(distance, 0)
+      os.remove(os.path.join(self.directory, 'index.jsonl'))
+      output = self.split('--dedupe-distance', str(distance - 1), a, b)
+      self.assertNotIn("Near-duplicate", output)
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,97 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --frames cutting the pages of a TIFF several at a time against one after
+# another, and the loop count of the animations it writes.  Run from the top of the tree with python -m unittest discover
+# tests (or pytest).
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, noise_image
+
+import wallpaper_splitter
+from wallpaper_splitter import Image, ImageChops, ImageSequence
+
+PAGES = 5
+
+class FramesTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-frames-')
+      pages = [noise_image((1600, 900), 40 + page) for page in range(PAGES)]
+      self.source = os.path.join(self.directory, 'source.tif')
+      pages[0].save(self.source, save_all=True, append_images=pages[1:])
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def split(self, tile_threads):
+      """Split the pages with tile_threads.  Returns the pages of every
+         tile by suffix."""
+      monitors = wallpaper_splitter.load_layout(
+         layout_file('6_monitors'))
+      opts = wallpaper_splitter.split_options(tile_threads=tile_threads)
+      opts.quiet = True
+      opts.output_format = None
+      opts.encoder_settings = {}
+      with Image.open(self.source) as img:
+         wallpaper_splitter.split_frames(monitors, opts, self.source, img,
+                                         'TIFF')
+      tiles = {}
+      for monitor in monitors:
+         filename = wallpaper_splitter.output_filename(self.source, monitor)
+         with Image.open(filename) as tile:
+            tiles[monitor['suffix']] = [page.copy() for page in
+                                        ImageSequence.Iterator(tile)]
+         os.remove(filename)
+      return tiles
+
+   def test_same_pages(self):
+      one_by_one = self.split(0)
+      together = self.split(3)
+      self.assertEqual(sorted(one_by_one), sorted(together))
+      for suffix, pages in one_by_one.items():
+         self.assertEqual(len(pages), PAGES)
+         self.assertEqual(len(together[suffix]), PAGES)
+         for index, (expected, page) in enumerate(zip(pages,
+                                                      together[suffix])):
+            self.assertIsNone(ImageChops.difference(expected,
+                                                    page).getbbox(),
+                              (suffix, index))
+
+   def test_loop_count(self):
+      # GIF leaves the count out, the rest have to say play once (1)
+      # rather than forever (0)
+      for fmt, once in (('GIF', None), ('PNG', 1), ('WEBP', 1)):
+         for loop, expected in ((None, once), (0, 0), (3, 3)):
+            filename = os.path.join(self.directory, 'tile.' + fmt.lower())
+            writer = wallpaper_splitter.AnimationWriter(filename, fmt,
+                                                        loop=loop, count=2)
+            for colour in ('red', 'blue'):
+               writer.add(Image.new('RGB', (32, 32), colour), 100)
+            writer.close()
+            with Image.open(filename) as tile:
+               self.assertEqual(tile.n_frames, 2)
+               self.assertEqual(tile.info.get('loop'), expected, (fmt, loop))
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,100 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# Directories and glob patterns as input: what gets split and what is
+# skipped.  Run from the top of the tree with python -m unittest discover
+# tests (or pytest).
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file
+
+import wallpaper_splitter
+from wallpaper_splitter import Image
+
+class InputTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-inputs-')
+      self.monitors = wallpaper_splitter.parse_monitors(
+         [layout_file('dual_4k')])
+      self.suffixes = wallpaper_splitter.tile_suffixes(
+         self.monitors, [layout_file('dual_4k')])
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def touch(self, *names):
+      """Write a tiny image at each of names, under the test directory"""
+      paths = []
+      for name in names:
+         path = os.path.join(self.directory, name)
+         os.makedirs(os.path.dirname(path), exist_ok=True)
+         if os.path.splitext(name)[1] not in ('.jpg', '.png'):
+            open(path, 'w').close()
+         else:
+            Image.new('RGB', (8, 8)).save(path)
+         paths.append(path)
+      return paths
+
+   def images(self, *inputs):
+      return list(wallpaper_splitter.iter_images(self.suffixes, inputs))
+
+   def test_directory(self):
+      a, b, c = self.touch('a.jpg', 'sub/b.png', 'sub/deeper/c.jpg')
+      self.touch('notes.txt', 'sub/no_extension')
+      self.assertEqual(self.images(self.directory), [a, b, c])
+
+   def test_skips_tiles(self):
+      a, = self.touch('a.jpg')
+      # This layout's tiles, another layout's (6_monitors goes up to _6)
+      # and those named after their layout when several are split at once
+      self.touch('a_1.jpg', 'a_2.jpg', 'a_6.jpg', 'a_dual_4k_1.jpg',
+                 'a_preview.png')
+      self.assertEqual(self.images(self.directory), [a])
+
+   def test_tile_without_its_source(self):
+      # Nothing it could have been cut from, so it is an image of its own
+      lonely, = self.touch('lonely_1.jpg')
+      self.assertEqual(self.images(self.directory), [lonely])
+
+   def test_glob(self):
+      a, _, c = self.touch('a.jpg', 'b.png', 'sub/c.jpg')
+      self.touch('a_1.jpg')
+      pattern = os.path.join(self.directory, '**', '*.jpg')
+      self.assertEqual(sorted(self.images(pattern)), sorted([a, c]))
+
+   def test_no_duplicates(self):
+      a, = self.touch('a.jpg')
+      self.assertEqual(self.images(self.directory,
+                                   os.path.join(self.directory, '*.jpg')),
+                       [a])
+
+   def test_files_pass_through(self):
+      # Named on the command line, split whatever they look like
+      tile, = self.touch('a_1.jpg')
+      self.touch('a.jpg')
+      self.assertEqual(self.images(tile), [tile])
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,147 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# Checking monitor definitions and fitting them to bezels and pixel
+# densities.  Run from the top of the tree with python -m unittest discover
+# tests (or pytest).
+import contextlib
+import io
+import random
+import unittest
+
+import conftest # puts src on the path
+
+import wallpaper_splitter
+
+def monitor(suffix, upper_left, resolution=(1920, 1080), **physical):
+   return dict(suffix=suffix, upper_left=list(upper_left),
+               resolution=list(resolution), **physical)
+
+class LayoutTest(unittest.TestCase):
+
+   def compile(self, *monitors, **physical):
+      definition = dict(physical, monitors=list(monitors))
+      return wallpaper_splitter.compile_layout(definition)
+
+   def test_plain(self):
+      monitors = self.compile(monitor('_1', (0, 0)),
+                              monitor('_2', (1920, 0)))
+      self.assertEqual([m['upper_left'] for m in monitors],
+                       [[0, 0], [1920, 0]])
+      self.assertEqual([m['extent'] for m in monitors],
+                       [[1920, 1080], [1920, 1080]])
+
+   def test_overlaps(self):
+      with self.assertRaisesRegex(ValueError, "overlaps"):
+         self.compile(monitor('_1', (0, 0)), monitor('_2', (1919, 0)))
+      with self.assertRaisesRegex(ValueError, "overlaps"):
+         self.compile(monitor('_1', (0, 0)), monitor('_2', (1920, 0)),
+                      monitor('_3', (100, 1079)))
+      # Touching is fine, corners included
+      self.compile(monitor('_1', (0, 0)), monitor('_2', (1920, 1080)),
+                   monitor('_3', (0, 1080)))
+
+   def test_bad_monitors(self):
+      for monitors, message in [
+            ([], "no monitors"),
+            ([monitor('_1', (0, 0)), monitor('_1', (1920, 0))],
+             "same suffix"),
+            ([monitor('', (0, 0))], "suffix"),
+            ([monitor('_1', (0, 0), (0, 1080))], "resolution"),
+            ([monitor('_1', (-1, 0))], "upper_left")]:
+         with self.assertRaisesRegex(ValueError, message):
+            self.compile(*monitors)
+
+   def test_bezels(self):
+      # 96 dpi is 96 / 25.4 pixels a mm, so 10 + 10 mm of bezel is 76
+      monitors = self.compile(monitor('_1', (0, 0)),
+                              monitor('_2', (1920, 0)),
+                              monitor('_3', (0, 1080)),
+                              dpi=96, bezel_mm=10)
+      self.assertEqual([m['upper_left'] for m in monitors],
+                       [[0, 0], [1996, 0], [0, 1156]])
+      self.assertEqual([m['extent'] for m in monitors],
+                       [[1920, 1080]] * 3)
+
+   def test_uneven_bezels(self):
+      # Only the right of the first and the left of the second meet
+      monitors = self.compile(monitor('_1', (0, 0), bezel_mm=[0, 0, 5, 0]),
+                              monitor('_2', (1920, 0),
+                                      bezel_mm=[15, 0, 0, 0]),
+                              dpi=25.4)
+      self.assertEqual(monitors[1]['upper_left'], [1940, 0])
+
+   def test_densities(self):
+      # A 4k monitor next to a 1080p one the same size: the 1080p one is
+      # laid out at the 4k's density and everything past it moves over
+      monitors = self.compile(
+         monitor('_1', (0, 0), size_mm=[600, 340]),
+         monitor('_2', (1920, 0), (3840, 2160), size_mm=[600, 340]))
+      self.assertEqual(monitors[0]['extent'], [3840, 2160])
+      self.assertEqual(monitors[0]['resolution'], [1920, 1080])
+      self.assertEqual(monitors[1]['upper_left'], [3840, 0])
+      self.assertEqual(monitors[1]['extent'], [3840, 2160])
+
+   def test_physical_needs_every_monitor(self):
+      with self.assertRaisesRegex(ValueError, "dpi or size_mm"):
+         self.compile(monitor('_1', (0, 0), dpi=96),
+                      monitor('_2', (1920, 0)))
+      with self.assertRaisesRegex(ValueError, "bezel_mm"):
+         self.compile(monitor('_1', (0, 0)), dpi=96, bezel_mm=-1)
+
+   def test_compiled_once(self):
+      monitors = self.compile(monitor('_1', (0, 0)),
+                              monitor('_2', (1920, 0)), dpi=96, bezel_mm=10)
+      again = wallpaper_splitter.compile_layout({"monitors": monitors})
+      self.assertEqual(again, monitors)
+
+   def test_find_overlaps(self):
+      # The sweep against comparing every pair
+      rng = random.Random(4)
+      for _ in range(50):
+         rects = []
+         for _ in range(12):
+            left, upper = rng.randrange(100), rng.randrange(100)
+            rects.append([left, upper, left + rng.randrange(1, 30),
+                          upper + rng.randrange(1, 30)])
+         expected = set((a, b) for a in range(len(rects))
+                        for b in range(a + 1, len(rects))
+                        if rects[a][0] < rects[b][2] and
+                           rects[b][0] < rects[a][2] and
+                           rects[a][1] < rects[b][3] and
+                           rects[b][1] < rects[a][3])
+         found = set(tuple(sorted(pair)) for pair in
+                     wallpaper_splitter.find_overlaps(rects))
+         self.assertEqual(found, expected)
+
+   def test_vid_buffer_keeps_names(self):
+      v_buf = wallpaper_splitter.VidBuffer(12, 2)
+      v_buf.write(1, 0, "Écran 2 ü")
+      v_buf[0, 1] = "─"
+      self.assertEqual(v_buf[1, 0], "É")
+      out = io.StringIO()
+      with contextlib.redirect_stdout(out):
+         wallpaper_splitter.print_vid_buffer(v_buf)
+      self.assertEqual(out.getvalue(), " Écran 2 ü  \n─" + " " * 11 + "\n")
+      with self.assertRaises(IndexError):
+         v_buf.write(5, 1, "too long")
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,95 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --manifest picking a batch up where an interrupted run left off.  Run from
+# the top of the tree with python -m unittest discover tests (or pytest).
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, noise_image, run_splitter
+
+class ManifestTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-manifest-')
+      self.manifest = os.path.join(self.directory, 'batch.jsonl')
+      self.sources = []
+      for name in ('a', 'b', 'c'):
+         source = os.path.join(self.directory, name + '.jpg')
+         noise_image((640, 360)).save(source)
+         self.sources.append(source)
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def split(self):
+      return run_splitter('-v', '-m', layout_file('dual_4k'),
+                          '--manifest', self.manifest, *self.sources)
+
+   def skipped(self, output):
+      return sorted(os.path.basename(line.split()[1]) for line in
+                    output.splitlines() if line.startswith("Skipping "))
+
+   def records(self):
+      with open(self.manifest, 'r') as f:
+         return [json.loads(line) for line in f if line.strip()]
+
+   def test_resume(self):
+      self.assertEqual(self.split().returncode, 0)
+      records = self.records()
+      self.assertEqual(sorted(record['status'] for record in records),
+                       ['done'] * 3)
+      self.assertEqual(len(records[0]['tiles']), 2)
+
+      # Interrupted part way through writing a line, with b changed since
+      # and one of c's tiles gone
+      with open(self.manifest, 'a') as f:
+         f.write('{"source": "' + self.sources[0])
+      noise_image((640, 360)).save(self.sources[1])
+      os.remove(os.path.join(self.directory, 'c_2.jpg'))
+
+      result = self.split()
+      self.assertEqual(result.returncode, 0, result.stderr)
+      self.assertEqual(self.skipped(result.stdout), ['a.jpg'])
+      self.assertTrue(os.path.isfile(os.path.join(self.directory,
+                                                  'c_2.jpg')))
+      # Everything is done now
+      self.assertEqual(self.skipped(self.split().stdout),
+                       ['a.jpg', 'b.jpg', 'c.jpg'])
+
+   def test_failures_retried(self):
+      with open(self.sources[1], 'wb') as f:
+         f.write(b"not an image")
+      self.assertNotEqual(self.split().returncode, 0)
+      last = dict((record['source'], record) for record in self.records())
+      self.assertEqual(last[os.path.abspath(self.sources[1])]['status'],
+                       'failed')
+
+      noise_image((640, 360)).save(self.sources[1])
+      result = self.split()
+      self.assertEqual(result.returncode, 0, result.stderr)
+      self.assertEqual(self.skipped(result.stdout), ['a.jpg', 'c.jpg'])
+
+if __name__ == '__main__':
+   unittest.main()
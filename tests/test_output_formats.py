@@ -0,0 +1,104 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --output-format and --encoder-profile.  Run from the top of the tree with
+# python -m unittest discover tests (or pytest).
+import argparse
+import io
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, noise_image, run_splitter
+
+import wallpaper_splitter
+from wallpaper_splitter import Image
+
+class OutputFormatTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-formats-')
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_format_names(self):
+      parse = wallpaper_splitter.parse_output_format
+      for value in ('jpg', 'jpeg', 'JPEG', '.jpg'):
+         self.assertEqual(parse(value), 'JPEG')
+      self.assertEqual(parse('webp'), 'WEBP')
+      self.assertEqual(parse('tif'), 'TIFF')
+      with self.assertRaises(argparse.ArgumentTypeError):
+         parse('nope')
+      self.assertEqual(wallpaper_splitter.extension_for('JPEG'), '.jpg')
+      self.assertEqual(wallpaper_splitter.extension_for('TIFF'), '.tif')
+      self.assertEqual(wallpaper_splitter.extension_for('PNG'), '.png')
+
+   def test_profiles(self):
+      settings = wallpaper_splitter.encoder_settings
+      self.assertEqual(settings('default'), {})
+      self.assertEqual(settings('fastest')['PNG'], {"compress_level": 1})
+      # A file extends a built in profile and overrides bits of it
+      filename = os.path.join(self.directory, 'profile.json')
+      with open(filename, 'w') as f:
+         json.dump({"extends": "smallest", "jpeg": {"quality": 90}}, f)
+      loaded = settings(filename)
+      self.assertEqual(loaded['JPEG']['quality'], 90)
+      self.assertTrue(loaded['JPEG']['progressive'])
+      self.assertEqual(loaded['PNG'], {"compress_level": 9})
+      for bad in ({"PNG": {"compress": 9}}, {"extends": "nope"},
+                  {"PNG": 9}, []):
+         with self.assertRaises(ValueError, msg=bad):
+            settings(bad)
+
+   def test_profiles_change_the_output(self):
+      # Something that compresses, unlike noise
+      tile = Image.radial_gradient('L').convert('RGB')
+      sizes = {}
+      for profile in ('fastest', 'smallest'):
+         buf = io.BytesIO()
+         wallpaper_splitter.encode_tile(
+            tile, buf, 'PNG', wallpaper_splitter.encoder_settings(profile))
+         sizes[profile] = buf.tell()
+      self.assertLess(sizes['smallest'], sizes['fastest'])
+      # JPEG can't hold alpha, so the tile is converted
+      buf = io.BytesIO()
+      wallpaper_splitter.encode_tile(tile.convert('RGBA'), buf, 'JPEG')
+      self.assertEqual(Image.open(buf).mode, 'RGB')
+
+   def test_command_line(self):
+      source = os.path.join(self.directory, 'source.png')
+      noise_image((640, 360)).save(source)
+      result = run_splitter('-q', '-m', layout_file('dual_4k'),
+                            '--output-format', 'jpg',
+                            '--encoder-profile', 'fastest', source)
+      self.assertEqual(result.returncode, 0, result.stderr)
+      self.assertEqual(sorted(name for name in os.listdir(self.directory)
+                              if name != 'source.png'),
+                       ['source_1.jpg', 'source_2.jpg'])
+      with Image.open(os.path.join(self.directory, 'source_1.jpg')) as tile:
+         self.assertEqual(tile.format, 'JPEG')
+         self.assertEqual(tile.size, (3840, 2160))
+
+if __name__ == '__main__':
+   unittest.main()
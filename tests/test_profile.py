@@ -0,0 +1,61 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --profile writing a cProfile dump per source.  Run from the top of the
+# tree with python -m unittest discover tests (or pytest).
+import os
+import os.path
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, noise_image, run_splitter
+
+class ProfileTest(unittest.TestCase):
+
+   def setUp(self):
+      self.directory = tempfile.mkdtemp(prefix='wallpaper-profile-')
+      self.profiles = os.path.join(self.directory, 'profiles')
+      os.mkdir(self.profiles)
+
+   def tearDown(self):
+      shutil.rmtree(self.directory)
+
+   def test_same_names(self):
+      # Two sources called a.jpg in different directories keep a dump each
+      sources = []
+      for folder in ('one', 'two'):
+         os.mkdir(os.path.join(self.directory, folder))
+         source = os.path.join(self.directory, folder, 'a.jpg')
+         noise_image((640, 360)).save(source)
+         sources.append(source)
+      result = run_splitter('-m', layout_file('dual_4k'), '--profile',
+                            self.profiles, *sources)
+      self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+      dumps = sorted(os.listdir(self.profiles))
+      self.assertEqual(len(dumps), 2)
+      for dump in dumps:
+         self.assertTrue(dump.startswith('a.jpg-'))
+         self.assertTrue(dump.endswith('.prof'))
+         pstats.Stats(os.path.join(self.profiles, dump))
+
+if __name__ == '__main__':
+   unittest.main()
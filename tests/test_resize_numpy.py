@@ -0,0 +1,98 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --resample-engine numpy against Image.resize.  Run from the top of the tree
+# with python -m unittest discover tests (or pytest).
+import unittest
+
+from conftest import layout_file
+
+import wallpaper_splitter
+from wallpaper_splitter import Image, ImageChops
+
+# How many levels a channel may be off by
+TOLERANCE = 1
+
+def noise(mode, size):
+   """Noise is the worst case for a resampler; every tap matters"""
+   bands = [Image.effect_noise(size, 80) for _ in Image.new(mode, (1, 1))
+            .getbands()]
+   return bands[0] if mode == 'L' else Image.merge(mode, bands)
+
+def max_difference(a, b):
+   extrema = ImageChops.difference(a, b).getextrema()
+   if a.mode == 'L':
+      return extrema[1]
+   return max(high for _, high in extrema)
+
+@unittest.skipIf(wallpaper_splitter.numpy is None, "NumPy is not installed")
+class ResizeNumpyTest(unittest.TestCase):
+
+   def check(self, img, size, resample, plan=None):
+      ours = wallpaper_splitter.resize_numpy(img, size, resample, plan)
+      theirs = img.resize(size, resample)
+      self.assertEqual(ours.mode, theirs.mode)
+      self.assertEqual(ours.size, theirs.size)
+      self.assertLessEqual(max_difference(ours, theirs), TOLERANCE,
+                           "{0} {1} -> {2} {3}".format(img.mode, img.size,
+                                                       size, resample.name))
+
+   def test_filters_and_scales(self):
+      Resampling = Image.Resampling
+      cases = [((1536, 864), (640, 400), Resampling.LANCZOS),
+               ((1000, 700), (1920, 1200), Resampling.BILINEAR),
+               ((1000, 700), (1920, 1200), Resampling.BICUBIC),
+               ((777, 333), (512, 512), Resampling.LANCZOS),
+               ((640, 360), (640, 400), Resampling.BICUBIC),
+               ((900, 300), (899, 300), Resampling.LANCZOS),
+               ((128, 64), (1280, 48), Resampling.BILINEAR)]
+      for mode in wallpaper_splitter.NUMPY_MODES:
+         for in_size, out_size, resample in cases:
+            self.check(noise(mode, in_size), out_size, resample)
+
+   def test_flat_and_extremes(self):
+      # Overshoot past 0 and 255 has to clip the way Pillow's does
+      img = Image.new('L', (300, 200), 0)
+      img.paste(255, (100, 0, 200, 200))
+      for resample in (Image.Resampling.BICUBIC, Image.Resampling.LANCZOS):
+         self.check(img, (1000, 77), resample)
+         self.check(img, (61, 450), resample)
+
+   def test_plan_weights(self):
+      monitors = wallpaper_splitter.load_layout(layout_file('6_monitors'))
+      opts = wallpaper_splitter.split_options(resample_engine='numpy')
+      plan = wallpaper_splitter.LayoutPlan(monitors, opts)
+      img = noise('RGB', (1200, 700))
+      for _ in range(2):
+         # Second time round the weights come from the plan
+         self.check(img, (1920, 1080), Image.Resampling.BICUBIC, plan)
+
+   def test_split_engines_agree(self):
+      img = noise('RGB', (3000, 1500))
+      layout = layout_file('6_monitors')
+      pillow = wallpaper_splitter.split(img, layout)
+      ours = wallpaper_splitter.split(img, layout, resample_engine='numpy')
+      for (monitor, theirs), (_, tile) in zip(pillow, ours):
+         self.assertEqual(tile.size, theirs.size)
+         self.assertLessEqual(max_difference(tile, theirs), TOLERANCE,
+                              monitor['suffix'])
+
+if __name__ == '__main__':
+   unittest.main()
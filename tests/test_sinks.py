@@ -0,0 +1,128 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --sink putting the tiles of a whole batch into one tar, zip or atlas.  Run
+# from the top of the tree with python -m unittest discover tests (or pytest).
+import json
+import os
+import os.path
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from conftest import layout_file, noise_image, run_splitter
+from wallpaper_splitter import member_name
+
+class SinkTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      # The tiles as they come out one file each, to hold the sinks to
+      cls.directory = tempfile.mkdtemp(prefix='wallpaper-sink-')
+      cls.sources = []
+      for name in ('a', 'b'):
+         source = os.path.join(cls.directory, name + '.jpg')
+         noise_image((640, 360)).save(source)
+         cls.sources.append(source)
+      result = run_splitter('-m', layout_file('dual_4k'), *cls.sources)
+      assert result.returncode == 0, result.stderr
+      cls.tiles = {}
+      for source in cls.sources:
+         for index in (1, 2):
+            filename = source[:-4] + '_' + str(index) + '.jpg'
+            with open(filename, 'rb') as f:
+               cls.tiles[member_name(filename)] = f.read()
+            os.remove(filename)
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.directory)
+
+   def setUp(self):
+      self.output = tempfile.mkdtemp(prefix='wallpaper-sink-file-')
+
+   def tearDown(self):
+      shutil.rmtree(self.output)
+
+   def split(self, sink, *args):
+      """Split the sources into a sink.  Returns the file it wrote."""
+      sink_file = os.path.join(self.output, 'tiles.' + sink)
+      result = run_splitter('-m', layout_file('dual_4k'), '--sink', sink,
+                            '--sink-file', sink_file,
+                            *(args + tuple(self.sources)))
+      self.assertEqual(result.returncode, 0, result.stderr)
+      # Nothing is left beside the sources
+      self.assertEqual(sorted(os.listdir(self.directory)), ['a.jpg', 'b.jpg'])
+      return sink_file
+
+   def test_tar(self):
+      with tarfile.open(self.split('tar')) as tar:
+         tiles = dict((member.name, tar.extractfile(member).read())
+                      for member in tar.getmembers())
+      self.assertEqual(tiles, self.tiles)
+
+   def test_zip(self):
+      with zipfile.ZipFile(self.split('zip')) as archive:
+         tiles = dict((info.filename, archive.read(info))
+                      for info in archive.infolist())
+         # Already compressed by the encoder
+         self.assertEqual(set(info.compress_type for info in
+                              archive.infolist()), {zipfile.ZIP_STORED})
+      self.assertEqual(tiles, self.tiles)
+
+   def test_atlas(self):
+      atlas = self.split('atlas')
+      with open(atlas + '.json', 'r') as f:
+         index = json.load(f)
+      with open(atlas, 'rb') as f:
+         data = f.read()
+      self.assertEqual(index['atlas'], 'tiles.atlas')
+      self.assertEqual(index['bytes'], len(data))
+      tiles = dict((name, data[where['offset']:
+                               where['offset'] + where['length']])
+                   for name, where in index['tiles'].items())
+      self.assertEqual(tiles, self.tiles)
+
+   def test_jobs(self):
+      # Workers hand their tiles back to the parent's sink
+      with zipfile.ZipFile(self.split('zip', '--jobs', '2')) as archive:
+         tiles = dict((info.filename, archive.read(info))
+                      for info in archive.infolist())
+      self.assertEqual(tiles, self.tiles)
+
+   def test_needs_tiles_on_disk(self):
+      result = run_splitter('-m', layout_file('dual_4k'), '--sink', 'tar',
+                            '--sink-file',
+                            os.path.join(self.output, 'tiles.tar'),
+                            '--manifest',
+                            os.path.join(self.output, 'batch.jsonl'),
+                            *self.sources)
+      self.assertNotEqual(result.returncode, 0)
+      self.assertIn("can not be used with --manifest", result.stderr)
+      result = run_splitter('-m', layout_file('dual_4k'), '--sink', 'tar',
+                            *self.sources)
+      self.assertNotEqual(result.returncode, 0)
+      self.assertIn("needs a --sink-file", result.stderr)
+      self.assertEqual(os.listdir(self.output), [])
+
+if __name__ == '__main__':
+   unittest.main()
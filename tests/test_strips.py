@@ -0,0 +1,113 @@
+###############################################################################
+# Copyright (C) 2014 - Barry Grussling
+# Targetting Python3
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+#
+###############################################################################
+# --strip-height against decoding the whole source.  Run from the top of the
+# tree with python -m unittest discover tests (or pytest).
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from conftest import layout_file, noise_image
+
+import wallpaper_splitter
+from wallpaper_splitter import Image, ImageChops
+
+# Each band is resampled on its own so a pixel can round the other way
+TOLERANCE = 1
+
+class StripTest(unittest.TestCase):
+
+   @classmethod
+   def setUpClass(cls):
+      cls.directory = tempfile.mkdtemp(prefix='wallpaper-strips-')
+      source = noise_image((2400, 1500))
+      cls.sources = []
+      for ext in ('ppm', 'tif'):
+         filename = os.path.join(cls.directory, 'source.' + ext)
+         source.save(filename)
+         cls.sources.append(filename)
+
+   @classmethod
+   def tearDownClass(cls):
+      shutil.rmtree(cls.directory)
+
+   def test_same_tiles(self):
+      engines = ['tile']
+      if wallpaper_splitter.numpy is not None:
+         engines.append('numpy')
+      for source in self.sources:
+         for layout in ('6_monitors', 'dual_4k'):
+            definition = layout_file(layout)
+            for engine in engines:
+               for crop_only in (False, True):
+                  options = {"resample_engine": engine,
+                             "crop_only": crop_only, "mmap": False}
+                  whole = wallpaper_splitter.split(source, definition,
+                                                   **options)
+                  for strip_height in (64, 37):
+                     strips = wallpaper_splitter.split(
+                        source, definition, strip_height=strip_height,
+                        **options)
+                     self.compare(whole, strips,
+                                  (os.path.basename(source), layout, engine,
+                                   crop_only, strip_height))
+
+   def test_part_of_the_width(self):
+      # Much wider than dual_4k, so only the middle columns are kept
+      source = noise_image((6000, 600))
+      for ext in ('ppm', 'tif'):
+         filename = os.path.join(self.directory, 'wide.' + ext)
+         source.save(filename)
+         definition = layout_file('dual_4k')
+         whole = wallpaper_splitter.split(filename, definition, mmap=False)
+         strips = wallpaper_splitter.split(filename, definition, mmap=False,
+                                           strip_height=50)
+         self.compare(whole, strips, ext)
+
+   def test_pixel_limit(self):
+      # Only sources that get decoded whole are held to the limit
+      png = os.path.join(self.directory, 'source.png')
+      Image.open(self.sources[0]).save(png)
+      limit = Image.MAX_IMAGE_PIXELS
+      try:
+         Image.MAX_IMAGE_PIXELS = 2400 * 1500 // 3
+         wallpaper_splitter.lift_pixel_limit()
+         self.assertIsNone(Image.MAX_IMAGE_PIXELS)
+         with self.assertRaises(Image.DecompressionBombError):
+            wallpaper_splitter.open_image(png)
+         for source in self.sources:
+            wallpaper_splitter.open_image(source).close()
+      finally:
+         Image.MAX_IMAGE_PIXELS = limit
+         wallpaper_splitter.Bomb_pixels = None
+
+   def compare(self, whole, strips, case):
+      self.assertEqual(len(whole), len(strips), case)
+      for (monitor, expected), (_, tile) in zip(whole, strips):
+         self.assertEqual(tile.size, expected.size, case)
+         self.assertEqual(tile.mode, expected.mode, case)
+         difference = max(high for _, high in
+                          ImageChops.difference(tile, expected).getextrema())
+         self.assertLessEqual(difference, TOLERANCE,
+                              str(case) + " " + monitor['suffix'])
+
+if __name__ == '__main__':
+   unittest.main()